@@ -2,6 +2,7 @@
 from __future__ import print_function
 import os
 import sys
+import hashlib
 import multiprocessing as mp
 import argparse
 import time
@@ -9,8 +10,20 @@ import datetime
 from dateutil.parser import parse as dt_parser
 import sqlite3
 import re
-from subprocess import call
-import mimetypes
+import imp
+import shlex
+import traceback
+import threading
+import socket
+import signal
+from subprocess import Popen
+import json
+import numpy as np
+import plantcv as pcv
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 
 # Parse command-line arguments
@@ -58,13 +71,16 @@ def options():
     }
     parser = argparse.ArgumentParser(description='Parallel imaging processing with PlantCV.',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument("-d", "--dir", help='Input directory containing images or snapshots.', required=True)
+    parser.add_argument("-d", "--dir", help='Input directory containing images or snapshots. Required unless '
+                                             '--worker is used.', required=False)
     parser.add_argument("-a", "--adaptor",
                         help='Image metadata reader adaptor. PhenoFront metadata is stored in a CSV file and the '
                              'image file name. For the filename option, all metadata is stored in the image file '
                              'name. Current adaptors: phenofront, image', default="phenofront")
-    parser.add_argument("-p", "--pipeline", help='Pipeline script file.', required=True)
-    parser.add_argument("-s", "--db", help='SQLite database file name.', required=True)
+    parser.add_argument("-p", "--pipeline", help='Pipeline script file. Required unless --worker is used.',
+                        required=False)
+    parser.add_argument("-s", "--db", help='SQLite database file name. Required unless --worker is used.',
+                        required=False)
     parser.add_argument("-i", "--outdir", help='Output directory for images. Not required by all pipelines.',
                         default=".")
     parser.add_argument("-T", "--cpu", help='Number of CPU to use.', default=1, type=int)
@@ -72,6 +88,11 @@ def options():
                         help='will overwrite an existing database'
                              'Warning: activating this option will delete an existing database!',
                         default=False, action="store_true")
+    parser.add_argument("-n", "--incremental",
+                        help='Only process images that are new or have changed (file modification time or size) '
+                             'since they were last processed successfully into the database. Also used to resume '
+                             'an interrupted run.',
+                        default=False, action="store_true")
     parser.add_argument("-D", "--dates",
                         help='Date range. Format: YYYY-MM-DD-hh-mm-ss_YYYY-MM-DD-hh-mm-ss. If the second date '
                              'is excluded then the current date is assumed.',
@@ -91,11 +112,77 @@ def options():
                         help='Coprocess the specified imgtype with the imgtype specified in --match '
                              '(e.g. coprocess NIR images with VIS).',
                         default=None)
+    parser.add_argument("-S", "--snapshot",
+                        help='Run the pipeline once per snapshot (image directory) with all of its matching images '
+                             '(e.g. the frames of a PSII measurement) instead of once per image. The images are '
+                             'passed in frame order, each with its own results file (repeated --image and --result).',
+                        default=False, action="store_true")
     parser.add_argument("-w", "--writeimg", help='Include analysis images in output.', default=False,
                         action="store_true")
+    parser.add_argument("-m", "--writeimg-sample",
+                        help='Fraction of the images (or snapshots) to include analysis images for with --writeimg. '
+                             'The images are sampled by file name, so every run samples the same images.',
+                        default=1.0, type=float)
+    parser.add_argument("-x", "--index",
+                        help='Image metadata index database file. The index is updated for new and changed '
+                             'directories (snapshots) only and is used to select the images to process.',
+                        required=False)
     parser.add_argument("-o", "--other_args", help='Other arguments to pass to the pipeline script.', required=False)
+    parser.add_argument("-r", "--runner",
+                        help='Job runner. subprocess = start a new Python interpreter for each image, '
+                             'inprocess = import the pipeline script once per worker process and call its main() '
+                             'function for each image.',
+                        default="subprocess")
+    parser.add_argument("-b", "--batchsize",
+                        help='Number of images a worker takes from the job queue at a time.', default=1, type=int)
+    parser.add_argument("-q", "--queue",
+                        help='Job queue file on a shared file system. Instead of processing the images itself, the '
+                             'run writes the jobs to the queue and loads the results of the jobs that are done by '
+                             'workers (--worker) on any node.',
+                        required=False)
+    parser.add_argument("-W", "--worker",
+                        help='Work on the jobs of the job queue file of another run (--queue). Uses --cpu worker '
+                             'processes and --batchsize. All other options are taken from the queue.',
+                        required=False)
+    parser.add_argument("-L", "--lease",
+                        help='Job queue lease time in seconds. A job whose worker has not been heard from for this '
+                             'long is given to another worker.', default=300, type=int)
+    parser.add_argument("-A", "--attempts",
+                        help='Number of times a job is tried before the image is recorded as failed, if its job '
+                             'queue worker is lost or it is killed at the time or memory limit.', default=3, type=int)
+    parser.add_argument("-k", "--timeout",
+                        help='Wall-clock time limit for each image, in seconds. Images that run longer are killed '
+                             'and tried again. 0 = no limit.', default=0, type=float)
+    parser.add_argument("-R", "--rss",
+                        help='Memory (resident set size) limit for each image, in MB. Images that use more are '
+                             'killed and tried again. 0 = no limit.', default=0, type=float)
     args = parser.parse_args()
 
+    if args.cpu < 1:
+        raise ValueError("Number of CPU must be at least 1")
+
+    if args.batchsize < 1:
+        raise ValueError("Batch size must be at least 1")
+
+    # Workers get everything else from the job queue
+    if args.worker:
+        return args
+
+    for option, value in [('dir', args.dir), ('pipeline', args.pipeline), ('db', args.db)]:
+        if value is None:
+            parser.error("argument --{0} is required".format(option))
+
+    if args.lease < 1 or args.attempts < 1:
+        raise ValueError("Lease time and attempts must be at least 1")
+
+    if args.timeout < 0 or args.rss < 0:
+        raise ValueError("Time and memory limits must not be negative")
+    if not 0 <= args.writeimg_sample <= 1:
+        raise ValueError("Analysis image sample fraction must be between 0 and 1")
+    if args.rss > 0 and not os.path.exists('/proc/self/status'):
+        raise ValueError("The memory limit is only supported on Linux")
+    args.limits = {'timeout': args.timeout, 'rss': args.rss, 'attempts': args.attempts}
+
     if not os.path.exists(args.dir):
         raise IOError("Directory does not exist: {0}".format(args.dir))
     if not os.path.exists(args.pipeline):
@@ -110,6 +197,12 @@ def options():
         raise IOError("Directory does not exist: {0}".format(args.outdir))
 
     args.jobdir = start_time
+    # Workers on other nodes need absolute paths
+    if args.queue:
+        args.jobdir = os.path.abspath(args.jobdir)
+        args.dir = os.path.abspath(args.dir)
+        args.pipeline = os.path.abspath(args.pipeline)
+        args.outdir = os.path.abspath(args.outdir)
     try:
         os.makedirs(args.jobdir)
     except IOError as e:
@@ -118,6 +211,9 @@ def options():
     if args.adaptor != 'phenofront' and args.adaptor != 'filename':
         raise ValueError("Adaptor must be either phenofront or filename")
 
+    if args.runner != 'subprocess' and args.runner != 'inprocess':
+        raise ValueError("Runner must be either subprocess or inprocess")
+
     if args.dates:
         dates = args.dates.split('_')
         if len(dates) == 1:
@@ -167,6 +263,9 @@ def options():
     if (args.coprocess is not None) and ('imgtype' not in args.imgtype):
         raise ValueError("When the coprocess imgtype is defined, imgtype must be included in match.")
 
+    if args.snapshot and (args.coprocess is not None):
+        raise ValueError("Snapshot jobs cannot be combined with coprocess.")
+
     return args
 
 
@@ -188,6 +287,11 @@ def main():
     # Get options
     args = options()
 
+    # Work on the jobs of another run
+    if args.worker:
+        queue_worker(args)
+        return
+
     # Variables
     ###########################################
     meta = {}
@@ -215,16 +319,14 @@ def main():
     args.fail_log = file_writer(prefix + '_failed_images_' + args.start_time + '.log')
     args.error_log = file_writer(prefix + '_errors_' + args.start_time + '.log')
 
-    # Open intermediate database files
-    runinfo_file = file_writer(prefix + '_runinfo.tab')
-    args.metadata_file = file_writer(prefix + '_metadata.tab')
-    args.analysis_images_file = file_writer(prefix + '_analysis_images.tab')
-    args.features_file = file_writer(prefix + '_features.tab')
-    args.signal_file = file_writer(prefix + '_signal.tab')
+    # Time spent in each stage of the run
+    args.stages = []
 
     # Database setup
     ###########################################
+    stage_start_time = time.time()
     args = db_connect(args)
+    run_stage(args, 'database setup', stage_start_time, time.time() - stage_start_time)
     ###########################################
 
     # Run info
@@ -232,11 +334,13 @@ def main():
     # Next run ID
     args.run_id += 1
 
-    runinfo_file.write("|".join(map(str, (args.run_id, args.start_time, command))) + '\n')
+    # The run info row is inserted together with the first results of the run
+    args.runinfo = (args.run_id, args.start_time, command)
     ###########################################
 
     # Read image file names
     ###########################################
+    stage_start_time = time.time()
     if args.adaptor == 'filename':
         # Input directory contains images where the file name contains all metadata
         args, meta = filename_parser(args)
@@ -244,6 +348,7 @@ def main():
         # Input directory is in PhenoFront snapshot format with subdirectories for each snapshot.
         # Metadata is stored in a CSV file.
         args, meta = phenofront_parser(args)
+    run_stage(args, 'metadata', stage_start_time, time.time() - stage_start_time)
     ###########################################
 
     # Process images
@@ -255,51 +360,66 @@ def main():
     # Job builder clock time
     job_builder_clock_time = time.time() - job_builder_start_time
     print("took " + str(job_builder_clock_time) + '\n', file=sys.stderr)
+    run_stage(args, 'job list', job_builder_start_time, job_builder_clock_time)
+
+    # Results are loaded into the database by a writer thread as jobs finish
+    results_queue = queue.Queue()
+    writer = threading.Thread(target=process_results, args=(args, results_queue))
+    writer.start()
 
     # Parallel image processing time
     multi_start_time = time.time()
     print("Processing images... ", file=sys.stderr)
 
-    exe_multiproc(jobs, args.cpu)
-
-    # Parallel clock time
-    multi_clock_time = time.time() - multi_start_time
-    print("took " + str(multi_clock_time) + '\n', file=sys.stderr)
-
-    ###########################################
-
-    # Compile image analysis results
+    try:
+        if args.queue:
+            job_stats = exe_queue(jobs, args, results_queue)
+        else:
+            job_stats = exe_multiproc(jobs, args, results_queue)
+    finally:
+        # Let the writer finish loading the results of completed jobs
+        results_queue.put(None)
+
+        # Parallel clock time
+        multi_clock_time = time.time() - multi_start_time
+        print("took " + str(multi_clock_time) + '\n', file=sys.stderr)
+
+        # Compile image analysis results
+        ###########################################
+        # Process results start time
+        process_results_start_time = time.time()
+        print("Processing results... ", file=sys.stderr)
+        writer.join()
+        # Process results clock time (the results of the last jobs)
+        process_results_clock_time = time.time() - process_results_start_time
+        print("took " + str(process_results_clock_time) + '\n', file=sys.stderr)
+        ###########################################
+
+    run_stage(args, 'image processing', multi_start_time, multi_clock_time)
+    run_stage(args, 'results after processing', process_results_start_time, process_results_clock_time)
+    # Time the writer spent in database transactions, while the images were processed and after
+    run_stage(args, 'database writes', args.writer_start, args.writer_busy)
+
+    worker_report(job_stats, multi_clock_time)
+    if args.coprocess is not None:
+        print("{0} images had no image to coprocess with (see the error log)".format(args.coimg_unmatched) + '\n',
+              file=sys.stderr)
+    if args.writer_error is not None:
+        raise RuntimeError("Loading results into the database failed:\n" + args.writer_error)
+
+    # Run telemetry
     ###########################################
-    # Process results start time
-    process_results_start_time = time.time()
-    print("Processing results... ", file=sys.stderr)
-    process_results(args)
-    # Process results clock time
-    process_results_clock_time = time.time() - process_results_start_time
-    print("took " + str(process_results_clock_time) + '\n', file=sys.stderr)
+    run_telemetry(args, job_stats, multi_start_time)
+    run_summary(args, job_stats)
     ###########################################
 
     # Cleanup
     ###########################################
-    runinfo_file.close()
-    args.metadata_file.close()
-    args.features_file.close()
-    args.signal_file.close()
-    args.analysis_images_file.close()
     args.fail_log.close()
     args.error_log.close()
     args.connect.close()
     ###########################################
 
-    # Load database
-    ###########################################
-    call("sqlite3 " + args.db + " '.import " + runinfo_file.name + " runinfo'", shell=True)
-    call("sqlite3 " + args.db + " '.import " + args.metadata_file.name + " metadata'", shell=True)
-    call("sqlite3 " + args.db + " '.import " + args.features_file.name + " features'", shell=True)
-    call("sqlite3 " + args.db + " '.import " + args.analysis_images_file.name + " analysis_images'", shell=True)
-    call("sqlite3 " + args.db + " '.import " + args.signal_file.name + " signal'", shell=True)
-    ###########################################
-
 
 ###########################################
 
@@ -376,6 +496,7 @@ def db_connect(args):
         args: (object) argsparse object.
     Returns:
         args: (object) argparse object with the following added:
+        args.connect: Database connection.
         args.sq: Database cursor.
         args.run_id: Last run ID.
         args.image_id: Last image ID.
@@ -385,43 +506,166 @@ def db_connect(args):
 
     # Delete the existing database if create is true
     if args.create:
-        if os.path.isfile(args.db):
-            os.remove(args.db)
-
-    if os.path.isfile(args.db):
-        args.connect = sqlite3.connect(args.db)
-        # Replace the row_factory result constructor with a dictionary constructor
-        args.connect.row_factory = dict_factory
-        # Change the text output format from unicode to UTF-8
-        args.connect.text_factory = str
-        # Database handler
-        args.sq = args.connect.cursor()
-
-        for row in args.sq.execute('SELECT MAX(run_id) AS max FROM runinfo'):
-            if row['max'] is not None:
-                args.run_id = row['max']
-
-        # Get the last run ID
-        for row in args.sq.execute('SELECT MAX(image_id) AS max FROM metadata'):
-            if row['max'] is not None:
-                args.image_id = row['max']
-
-    if os.path.isfile(args.db) == False:
-        # Connect to the database
-        args.connect = sqlite3.connect(args.db)
-        # Replace the row_factory result constructor with a dictionary constructor
-        args.connect.row_factory = dict_factory
-        # Change the text output format from unicode to UTF-8
-        args.connect.text_factory = str
-        # Database handler
-        args.sq = args.connect.cursor()
-        # Run and image IDs
-        args.run_id = 0
-        args.image_id = 0
+        for db_file in [args.db, args.db + '-wal', args.db + '-shm']:
+            if os.path.isfile(db_file):
+                os.remove(db_file)
+
+    # Run and image IDs
+    args.run_id = 0
+    args.image_id = 0
+
+    # Connect to the database
+    args.connect = db_open(args.db)
+    # Database handler
+    args.sq = args.connect.cursor()
+
+    # Create the result tables
+    args = db_schema(args)
+
+    # Get the last run ID
+    for row in args.sq.execute('SELECT MAX(run_id) AS max FROM runinfo'):
+        if row['max'] is not None:
+            args.run_id = row['max']
+
+    # Get the last image ID
+    for row in args.sq.execute('SELECT MAX(image_id) AS max FROM metadata'):
+        if row['max'] is not None:
+            args.image_id = row['max']
+
+    return args
+
+
+###########################################
+
+# Open a database connection
+###########################################
+def db_open(filename):
+    """
+    Open a connection to the output database with the settings used for loading results.
+
+    Args:
+        filename: (string) SQLite database file name.
+    Returns:
+        connect: Database connection.
+    Raises:
+
+    """
+    connect = sqlite3.connect(filename)
+    # Transactions are managed explicitly (BEGIN/COMMIT) instead of by the sqlite3 module
+    connect.isolation_level = None
+    # Replace the row_factory result constructor with a dictionary constructor
+    connect.row_factory = dict_factory
+    # Change the text output format from unicode to UTF-8
+    connect.text_factory = str
+
+    # Write-ahead logging lets readers query the database while results are loaded. With WAL, synchronous=NORMAL
+    # is still safe against corruption and avoids an fsync for every transaction
+    connect.execute('PRAGMA journal_mode = WAL')
+    connect.execute('PRAGMA synchronous = NORMAL')
+    connect.execute('PRAGMA temp_store = MEMORY')
+    # Page cache size in KiB (negative values are KiB, positive values are pages)
+    connect.execute('PRAGMA cache_size = -65536')
+
+    return connect
+
+
+###########################################
+
+# Create the database tables
+###########################################
+def db_schema(args):
+    """
+    Define the result table fields and create the database tables if they do not exist.
+
+    Args:
+        args: (object) argparse object.
+    Returns:
+        args: (object) argparse object with the result table field lists added.
+    Raises:
+
+    """
+    # Metadata table
+    args.metadata_fields = ['image_id', 'run_id']
+    args.metadata_fields.extend(args.valid_meta.keys())
+
+    # Feature data table
+    args.feature_fields = ['area', 'hull-area', 'solidity', 'perimeter', 'width', 'height',
+                           'longest_axis', 'center-of-mass-x', 'center-of-mass-y', 'hull_vertices',
+                           'in_bounds', 'ellipse_center_x', 'ellipse_center_y', 'ellipse_major_axis',
+                           'ellipse_minor_axis', 'ellipse_angle', 'ellipse_eccentricity']
+    args.opt_feature_fields = ['y-position', 'height_above_bound', 'height_below_bound',
+                               'above_bound_area', 'percent_above_bound_area', 'below_bound_area',
+                               'percent_below_bound_area']
+    args.marker_fields = ['marker_area', 'marker_major_axis_length', 'marker_minor_axis_length',
+                          'marker_eccentricity']
+    args.watershed_fields = ['estimated_object_count']
+    args.landmark_fields = ['tip_points', 'tip_points_r', 'centroid_r', 'baseline_r', 'tip_number', 'vert_ave_c',
+                            'hori_ave_c', 'euc_ave_c', 'ang_ave_c', 'vert_ave_b', 'hori_ave_b', 'euc_ave_b',
+                            'ang_ave_b', 'left_lmk', 'right_lmk', 'center_h_lmk', 'left_lmk_r', 'right_lmk_r',
+                            'center_h_lmk_r', 'top_lmk', 'bottom_lmk', 'center_v_lmk', 'top_lmk_r', 'bottom_lmk_r',
+                            'center_v_lmk_r']
+
+    # Signal channel data table
+    args.signal_fields = ['bin-number', 'channel_name', 'values', 'bin_values']
+
+    # bin-number	blue	green	red	lightness	green-magenta	blue-yellow	hue	saturation	value
+
+    # Initialize the database with the schema template if the tables do not exist yet
+    args.sq.execute(
+        'CREATE TABLE IF NOT EXISTS `runinfo` (`run_id` INTEGER PRIMARY KEY, `datetime` INTEGER NOT NULL, '
+        '`command` TEXT NOT NULL);')
+    args.sq.execute(
+        'CREATE TABLE IF NOT EXISTS `metadata` (`image_id` INTEGER PRIMARY KEY, `run_id` INTEGER NOT NULL, `' +
+        '` TEXT NOT NULL, `'.join(map(str, args.metadata_fields[2:])) + '` TEXT NOT NULL);')
+    args.sq.execute(
+        'CREATE TABLE IF NOT EXISTS `features` (`image_id` INTEGER PRIMARY KEY, `' + '` TEXT NOT NULL, `'.join(
+            map(str, args.feature_fields + args.opt_feature_fields + args.marker_fields + args.watershed_fields +
+                args.landmark_fields)) + '` TEXT NOT NULL);')
+    args.sq.execute(
+        'CREATE TABLE IF NOT EXISTS `analysis_images` (`image_id` INTEGER NOT NULL, `type` TEXT NOT NULL, '
+        '`image_path` TEXT NOT NULL);')
+    args.sq.execute(
+        'CREATE TABLE IF NOT EXISTS `signal` (`image_id` INTEGER NOT NULL, `' + '` TEXT NOT NULL, `'.join(
+            map(str, args.signal_fields)) + '` TEXT NOT NULL);')
+    # Run telemetry: time spent in each stage of a run and in each job
+    args.sq.execute(
+        'CREATE TABLE IF NOT EXISTS `runstages` (`run_id` INTEGER NOT NULL, `stage` TEXT NOT NULL, '
+        '`start` REAL NOT NULL, `seconds` REAL NOT NULL);')
+    args.sq.execute(
+        'CREATE TABLE IF NOT EXISTS `runjobs` (`run_id` INTEGER NOT NULL, `image` TEXT NOT NULL, '
+        '`worker` TEXT NOT NULL, `start` REAL NOT NULL, `end` REAL NOT NULL, `queue_wait` REAL NOT NULL, '
+        '`parse_seconds` REAL NOT NULL, `status` INTEGER NOT NULL, `attempts` INTEGER NOT NULL, `peak_rss` REAL);')
+    # Index of successfully processed image files, used by incremental runs
+    args.sq.execute(
+        'CREATE TABLE IF NOT EXISTS `processed_images` (`image` TEXT NOT NULL, `mtime` REAL NOT NULL, '
+        '`size` INTEGER NOT NULL, `image_id` INTEGER NOT NULL, `run_id` INTEGER NOT NULL);')
 
     return args
 
 
+###########################################
+
+# Insert rows into a database table
+###########################################
+def db_insert(sq, table, rows):
+    """
+    Insert a batch of rows into a database table and empty the batch.
+
+    Args:
+        sq: (object) database cursor.
+        table: (string) table name.
+        rows: (list) list of row value lists, in table column order.
+    Returns:
+
+    Raises:
+
+    """
+    if len(rows) > 0:
+        placeholders = ', '.join(['?'] * len(rows[0]))
+        sq.executemany('INSERT INTO `' + table + '` VALUES (' + placeholders + ')', rows)
+        del rows[:]
+
+
 ###########################################
 
 # Reads images from a single directory in
@@ -438,9 +682,15 @@ def filename_parser(args):
     Raises:
         IOError: if an image file does not exist.
     """
+    # Select images from the metadata index
+    if args.index:
+        index_filename(args)
+        return args, index_meta(args)
+
     # Metadata data structure
     meta = {}
     args.jobcount = 0
+    args.coimg_unmatched = 0
 
     # Compile regular expression to remove image file extensions
     pattern = '\.' + args.type + '$'
@@ -504,9 +754,15 @@ def phenofront_parser(args):
     Raises:
     
     """
+    # Select images from the metadata index
+    if args.index:
+        index_phenofront(args)
+        return args, index_meta(args)
+
     # Metadata data structure
     meta = {}
     args.jobcount = 0
+    args.coimg_unmatched = 0
 
     # Open the SnapshotInfo.csv file
     csvfile = open(args.dir + '/SnapshotInfo.csv', 'rU')
@@ -532,6 +788,8 @@ def phenofront_parser(args):
         if img_list[:-1] == ';':
             img_list = img_list[:-1]
         imgs = img_list.split(';')
+        # Images to coprocess in this snapshot, built when the first image needs one
+        coimgs = None
         for img in imgs:
             if len(img) != 0:
                 dirpath = args.dir + '/snapshot' + data[colnames['id']]
@@ -587,28 +845,14 @@ def phenofront_parser(args):
                     # If the image meets the user's criteria, store the metadata
                     if img_pass == 1:
                         # Link image to coprocessed image
-                        coimg_pass = 0
                         if args.coprocess is not None:
-                            for coimg in imgs:
-                                if len(coimg) != 0:
-                                    meta_parts = coimg.split(args.delimiter)
-                                    coimgtype = meta_parts[args.fields['imgtype']]
-                                    if coimgtype == args.coprocess:
-                                        if 'camera' in args.fields:
-                                            cocamera = meta_parts[args.fields['camera']]
-                                            if 'frame' in args.fields:
-                                                coframe = meta_parts[args.fields['frame']]
-                                                if cocamera == img_meta['camera'] and coframe == img_meta['frame']:
-                                                    img_meta['coimg'] = coimg + '.' + args.type
-                                                    coimg_pass = 1
-                                            else:
-                                                if cocamera == img_meta['camera']:
-                                                    img_meta['coimg'] = coimg + '.' + args.type
-                                                    coimg_pass = 1
-                                        else:
-                                            img_meta['coimg'] = coimg + '.' + args.type
-                                            coimg_pass = 1
-                            if coimg_pass == 0:
+                            if coimgs is None:
+                                coimgs = coimg_lookup(args, imgs)
+                            coimg = coimgs.get(coimg_key(args, img_meta))
+                            if coimg is not None:
+                                img_meta['coimg'] = coimg + '.' + args.type
+                            else:
+                                args.coimg_unmatched += 1
                                 args.error_log.write(
                                     "Could not find an image to coprocess with " + dirpath + '/' + filename + '\n')
                         meta[filename] = img_meta
@@ -617,385 +861,1797 @@ def phenofront_parser(args):
 
     return args, meta
 
+
 ###########################################
 
+# Coprocessed image lookup key
+###########################################
+def coimg_key(args, img_meta):
+    """
+    Get the key that links an image to the image to coprocess with it: camera and frame, if camera is part of the
+    image file name metadata. Without camera, any image to coprocess matches.
+
+    Args:
+        args: (object) argparse object.
+        img_meta: (dictionary) image metadata.
+    Returns:
+        key: (tuple) camera and frame metadata values.
+    Raises:
+
+    """
+    return tuple([img_meta[field] for field in coimg_fields(args)])
+
 
-# Process images using multiprocessing
 ###########################################
-def process_images_multiproc(jobs):
-    for job in jobs:
-        os.system(job)
+
+# Metadata fields that link images to coprocessed images
+###########################################
+def coimg_fields(args):
+    """
+    Get the metadata fields that link an image to the image to coprocess with it.
+
+    Args:
+        args: (object) argparse object.
+    Returns:
+        fields: (list) camera and frame, if they are part of the image file name metadata; frame only with camera.
+    Raises:
+
+    """
+    if 'camera' not in args.fields:
+        return []
+
+    return [field for field in ['camera', 'frame'] if field in args.fields]
 
 
-# Multiprocessing pool builder
 ###########################################
-def exe_multiproc(jobs, cpus):
-    try:
-        p = mp.Pool(processes=cpus)
-        p.map_async(process_images_multiproc, jobs).get(9999999)
-    except KeyboardInterrupt:
-        p.terminate()
-        p.join()
-        raise ValueError("Execution terminated by user\n")
 
+# Coprocessed images of a snapshot
 ###########################################
+def coimg_lookup(args, imgs):
+    """
+    Find the images to coprocess in a snapshot.
+
+    Args:
+        args: (object) argparse object.
+        imgs: (list) snapshot image names (without the file extension).
+    Returns:
+        coimgs: (dictionary) images of the coprocess imgtype keyed by coimg_key. If several images have the same key,
+                the last one is used.
+    Raises:
+
+    """
+    coimgs = {}
+    for coimg in imgs:
+        if len(coimg) != 0:
+            meta_parts = coimg.split(args.delimiter)
+            if meta_parts[args.fields['imgtype']] == args.coprocess:
+                coimg_meta = {}
+                for field in coimg_fields(args):
+                    coimg_meta[field] = meta_parts[args.fields[field]]
+                coimgs[coimg_key(args, coimg_meta)] = coimg
+
+    return coimgs
 
 
-# Build job list
 ###########################################
-def job_builder(args, meta):
+
+# Image metadata index
+###########################################
+def index_connect(args):
     """
-    Build a list of image processing jobs.
-  
+    Open the image metadata index database and create the index tables. The index is rebuilt if it was built with
+    different adaptor settings.
+
     Args:
         args: (object) argparse object.
-        meta: metadata data structure.
     Returns:
-    
+        args: (object) argparse object with the following added:
+        args.index_connect: Index database connection.
+        args.index_sq: Index database cursor.
     Raises:
-    
+
     """
-    # Overall job stack. List of list of jobs
-    job_stack = []
+    args.index_connect = sqlite3.connect(args.index)
+    args.index_connect.isolation_level = None
+    args.index_connect.row_factory = dict_factory
+    args.index_connect.text_factory = str
+    args.index_sq = args.index_connect.cursor()
+
+    # Settings that change how images are found and how their metadata is read
+    settings = {'adaptor': args.adaptor, 'dir': os.path.abspath(args.dir), 'type': args.type,
+                'delimiter': args.delimiter, 'meta': args.meta}
+
+    args.index_sq.execute('CREATE TABLE IF NOT EXISTS `settings` (`key` TEXT PRIMARY KEY, `value` TEXT NOT NULL);')
+    stored = {}
+    for row in args.index_sq.execute('SELECT * FROM settings'):
+        stored[row['key']] = row['value']
+    if stored != settings:
+        args.index_sq.execute('DROP TABLE IF EXISTS `dirs`')
+        args.index_sq.execute('DROP TABLE IF EXISTS `images`')
+        args.index_sq.execute('DELETE FROM settings')
+        args.index_sq.executemany('INSERT INTO settings VALUES (?, ?)', list(settings.items()))
+
+    # Scanned directories (snapshots): modification time and subdirectories (snapshot CSV row)
+    args.index_sq.execute(
+        'CREATE TABLE IF NOT EXISTS `dirs` (`path` TEXT PRIMARY KEY, `mtime` REAL, `contents` TEXT NOT NULL);')
+    # Images: valid is 1 for usable images, 0 for images that do not match the metadata format and -1 for missing
+    # images. Metadata that is not available is NULL
+    args.index_sq.execute(
+        'CREATE TABLE IF NOT EXISTS `images` (`path` TEXT NOT NULL, `filename` TEXT NOT NULL, '
+        '`valid` INTEGER NOT NULL, `unix_time` INTEGER, `' + '` TEXT, `'.join(sorted(args.valid_meta.keys())) +
+        '` TEXT);')
+    args.index_sq.execute('CREATE INDEX IF NOT EXISTS `images_path` ON `images` (`path`);')
+    for field in ['imgtype', 'camera', 'zoom']:
+        args.index_sq.execute(
+            'CREATE INDEX IF NOT EXISTS `images_{0}` ON `images` (`{0}`);'.format(field))
+    args.index_sq.execute('CREATE INDEX IF NOT EXISTS `images_unix_time` ON `images` (`unix_time`);')
 
-    # Jobs/CPU (INT): divide the number of images by the number of requested CPU resources
-    jobs_per_cpu = args.jobcount / args.cpu
+    return args
 
-    # Get the list of images
-    # images = list(meta.keys())
-    images = []
-    for img in list(meta.keys()):
-        # # If a date range was requested, check whether the image is within range
-        # if args.dates:
-        #     # Convert image datetime to unix time
-        #     timestamp = dt_parser(meta[img]['timestamp'])
-        #     time_delta = timestamp - datetime.datetime(1970, 1, 1)
-        #     unix_time = (time_delta.days * 24 * 3600) + time_delta.seconds
-        #     if unix_time < args.start_date or unix_time > args.end_date:
-        #         continue
-        if args.coprocess is not None:
-            if meta[img]['imgtype'] != args.coprocess:
-                images.append(img)
-        else:
-            images.append(img)
 
-    print("Job list will include " + str(len(images)) + " images" + '\n', file=sys.stderr)
+###########################################
 
-    # For each image
-    for img in images:
-        if (args.coprocess is not None) and ('coimg' in meta[img]):
-            # Create an output file to store the co-image processing results and populate with metadata
-            coimg = meta[meta[img]['coimg']]
-            coout = file_writer("./{0}/{1}.txt".format(args.jobdir, meta[img]['coimg']))
-            coout.write('\t'.join(map(str, ("META", "image", coimg['path'] + '/' + meta[img]['coimg']))) + '\n')
-            # Valid metadata
-            for m in list(args.valid_meta.keys()):
-                coout.write('\t'.join(map(str, ("META", m, coimg[m]))) + '\n')
-
-        # Create an output file to store the image processing results and populate with metadata
-        outfile = file_writer("./{0}/{1}.txt".format(args.jobdir, img))
-        outfile.write('\t'.join(map(str, ("META", "image", meta[img]['path'] + '/' + img))) + '\n')
-        # Valid metadata
-        for m in list(args.valid_meta.keys()):
-            outfile.write('\t'.join(map(str, ("META", m, meta[img][m]))) + '\n')
-
-        outfile.close()
-
-    # Build the job stack
-    # The first n - 1 CPUs will get INT jobs_per_cpu
-    # The last CPU will get the remainder
-    job = 0
-    # For the first n - 1 CPU
-    for c in range(1, args.cpu):
-        # List of jobs for this CPU
-        jobs = []
-
-        # For each job/CPU
-        for j in range(0, jobs_per_cpu):
-            # Add job to list
-            if args.coprocess is not None and ('coimg' in meta[images[job]]):
-                job_str = "python {0} --image {1}/{2} --outdir {3} --result ./{4}/{5}.txt --coresult ./{6}/{7}.txt".format(
-                    args.pipeline, meta[images[job]]['path'], images[job], args.outdir, args.jobdir, images[job],
-                    args.jobdir, meta[images[job]]['coimg'])
-                if args.writeimg:
-                    job_str += ' --writeimg'
-                if args.other_args:
-                    job_str += ' ' + args.other_args
-                jobs.append(job_str)
-            else:
-                job_str = "python {0} --image {1}/{2} --outdir {3} --result ./{4}/{5}.txt".format(args.pipeline,
-                                                                                           meta[images[job]]['path'],
-                                                                                           images[job], args.outdir,
-                                                                                           args.jobdir, images[job])
-                if args.writeimg:
-                    job_str += ' --writeimg'
-                if args.other_args:
-                    job_str += ' ' + args.other_args
-                jobs.append(job_str)
-
-            # Increase the job counter by 1
-            job += 1
-
-        # Add the CPU job list to the job stack
-        job_stack.append(jobs)
-
-    # Add the remaining jobs to the last CPU
-    jobs = []
-    for j in range(job, len(images)):
-        # Add job to list
-        if args.coprocess is not None and ('coimg' in meta[images[j]]):
-            job_str = "python {0} --image {1}/{2} --outdir {3} --result ./{4}/{5}.txt --coresult ./{6}/{7}.txt".format(
-                args.pipeline, meta[images[j]]['path'], images[j], args.outdir, args.jobdir, images[j], args.jobdir,
-                meta[images[j]]['coimg'])
-            if args.writeimg:
-                job_str += ' --writeimg'
-            if args.other_args:
-                job_str += ' ' + args.other_args
-            jobs.append(job_str)
-        else:
-            job_str = "python {0} --image {1}/{2} --outdir {3} --result ./{4}/{5}.txt".format(args.pipeline,
-                                                                                       meta[images[j]]['path'],
-                                                                                       images[j], args.outdir,
-                                                                                       args.jobdir, images[j])
-            if args.writeimg:
-                job_str += ' --writeimg'
-            if args.other_args:
-                job_str += ' ' + args.other_args
-            jobs.append(job_str)
-    # Add the CPU job list to the job stack
-    job_stack.append(jobs)
+# Unix time of an image time stamp
+###########################################
+def unix_time(img_time):
+    """
+    Convert an image date-time string to Unix time.
+
+    Args:
+        img_time: (string) date-time string.
+    Returns:
+        unix_time: (int) seconds since 1970-01-01.
+    Raises:
+
+    """
+    timestamp = dt_parser(img_time)
+    time_delta = timestamp - datetime.datetime(1970, 1, 1)
 
-    return job_stack
+    return (time_delta.days * 24 * 3600) + time_delta.seconds
 
 
 ###########################################
 
-# Process results. Parse individual image output files.
+# Build an index row for one image
 ###########################################
-def process_results(args):
+def index_row(args, dirpath, filename, valid, metadata, data=None, colnames=None):
     """
-    Get results from individual files.
-    Parse the results and recompile for SQLite.
-  
+    Build a metadata index row for one image.
+
     Args:
         args: (object) argparse object.
+        dirpath: (string) image directory.
+        filename: (string) image file name.
+        valid: (int) 1 for usable images, 0 for images that do not match the metadata format, -1 for missing images.
+        metadata: (list) metadata values from the image file name.
+        data: (list) snapshot CSV row values (phenofront adaptor).
+        colnames: (dictionary) snapshot CSV column numbers keyed by column name (phenofront adaptor).
     Returns:
-    
+        row: (list) index row values in images table column order.
     Raises:
-    
+
     """
+    values = {}
+    for field in args.valid_meta:
+        values[field] = None
+        if valid == 0:
+            continue
+        # Metadata from the image file name takes precedence over the snapshot CSV file
+        if field in args.fields:
+            values[field] = metadata[args.fields[field]]
+        elif colnames is not None and field in colnames:
+            values[field] = data[colnames[field]]
+
+    # Date-time strings are parsed once, when the image is indexed
+    img_time = None
+    if values['timestamp'] is not None:
+        try:
+            img_time = unix_time(values['timestamp'])
+        except ValueError:
+            img_time = None
+
+    return [dirpath, filename, valid, img_time] + [values[field] for field in sorted(args.valid_meta.keys())]
 
-    # Metadata table
-    metadata_fields = ['image_id', 'run_id']
-    metadata_fields.extend(args.valid_meta.keys())
-    # args.metadata_file.write('#' + '\t'.join(map(str, metadata_fields)) + '\n')
 
-    # Feature data table
-    feature_fields = ['area', 'hull-area', 'solidity', 'perimeter', 'width', 'height',
-                      'longest_axis', 'center-of-mass-x', 'center-of-mass-y', 'hull_vertices',
-                      'in_bounds', 'ellipse_center_x', 'ellipse_center_y', 'ellipse_major_axis',
-                      'ellipse_minor_axis', 'ellipse_angle', 'ellipse_eccentricity']
-    opt_feature_fields = ['y-position', 'height_above_bound', 'height_below_bound',
-                          'above_bound_area', 'percent_above_bound_area', 'below_bound_area',
-                          'percent_below_bound_area']
-    marker_fields = ['marker_area','marker_major_axis_length','marker_minor_axis_length','marker_eccentricity']
-    watershed_fields=['estimated_object_count']
-    landmark_fields = ['tip_points', 'tip_points_r', 'centroid_r', 'baseline_r', 'tip_number', 'vert_ave_c',
-                       'hori_ave_c', 'euc_ave_c', 'ang_ave_c', 'vert_ave_b', 'hori_ave_b', 'euc_ave_b', 'ang_ave_b',
-                       'left_lmk', 'right_lmk', 'center_h_lmk', 'left_lmk_r', 'right_lmk_r', 'center_h_lmk_r',
-                       'top_lmk', 'bottom_lmk', 'center_v_lmk', 'top_lmk_r', 'bottom_lmk_r', 'center_v_lmk_r']
-
-    # args.features_file.write('#' + '\t'.join(map(str, feature_fields + opt_feature_fields)) + '\n')
+###########################################
 
-    # Signal channel data table
-    signal_fields = ['bin-number', 'channel_name', 'values', 'bin_values']
+# Update the metadata index from a directory tree of images
+###########################################
+def index_filename(args):
+    """
+    Update the metadata index for the filename adaptor. Directories that have not been modified since they were
+    indexed are not listed again.
 
-    # bin-number	blue	green	red	lightness	green-magenta	blue-yellow	hue	saturation	value
+    Args:
+        args: (object) argparse object.
+    Returns:
 
-    # Initialize the database with the schema template if create is true
-    args.sq.execute(
-        'CREATE TABLE IF NOT EXISTS `runinfo` (`run_id` INTEGER PRIMARY KEY, `datetime` INTEGER NOT NULL, '
-        '`command` TEXT NOT NULL);')
-    args.sq.execute(
-        'CREATE TABLE IF NOT EXISTS `metadata` (`image_id` INTEGER PRIMARY KEY, `run_id` INTEGER NOT NULL, `' +
-        '` TEXT NOT NULL, `'.join(map(str, metadata_fields[2:])) + '` TEXT NOT NULL);')
-    args.sq.execute(
-        'CREATE TABLE IF NOT EXISTS `features` (`image_id` INTEGER PRIMARY KEY, `' + '` TEXT NOT NULL, `'.join(
-            map(str, feature_fields + opt_feature_fields + marker_fields+ watershed_fields + landmark_fields)) + '` TEXT NOT NULL);')
-    args.sq.execute(
-        'CREATE TABLE IF NOT EXISTS `analysis_images` (`image_id` INTEGER NOT NULL, `type` TEXT NOT NULL, '
-        '`image_path` TEXT NOT NULL);')
-    args.sq.execute(
-        'CREATE TABLE IF NOT EXISTS `signal` (`image_id` INTEGER NOT NULL, `' + '` TEXT NOT NULL, `'.join(
-            map(str, signal_fields)) + '` TEXT NOT NULL);')
+    Raises:
 
-    # Walk through the image processing job directory and process data from each file
-    for (dirpath, dirnames, filenames) in os.walk(args.jobdir):
-        for filename in filenames:
-            # Make sure file is a text file
-            if 'text/plain' in mimetypes.guess_type(filename):
-                meta = {}
-                images = {}
-                features = []
-                feature_data = {}
-                signal = []
-                signal_data = {}
-                boundary = []
-                boundary_data = {}
-                marker = []
-                marker_data = {}
-                watershed=[]
-                watershed_data={}
-                landmark = []
-                landmark_data = {}
-                # Open results file
-                with open(dirpath + '/' + filename) as results:
-                    # For each line in the file
-                    for row in results:
-                        # Remove the newline character
-                        row = row.rstrip('\n')
-                        # Split the line by tab characters
-                        cols = row.split('\t')
-                        # If the data is of class meta, store in the metadata dictionary
-                        if cols[0] == 'META':
-                            meta[cols[1]] = cols[2]
-                        # If the data is of class image, store in the image dictionary
-                        elif cols[0] == 'IMAGE':
-                            images[cols[1]] = cols[2]
-                        # If the data is of class shapes, store in the shapes dictionary
-                        elif cols[0] == 'HEADER_SHAPES':
-                            features = cols
-                        elif cols[0] == 'SHAPES_DATA':
-                            for i, datum in enumerate(cols):
-                                if i > 0:
-                                    feature_data[features[i]] = datum
-                        # If the data is of class histogram/signal, store in the signal dictionary
-                        elif cols[0] == 'HEADER_HISTOGRAM':
-                            signal = cols
-                        elif cols[0] == 'HISTOGRAM_DATA':
-                            for i, datum in enumerate(cols):
-                                if i > 0:
-                                    signal_data[signal[i]] = datum
-                        # If the data is of class boundary (horizontal rule), store in the boundary dictionary
-                        elif 'HEADER_BOUNDARY' in cols[0]:
-                            boundary = cols
-                            # Temporary hack
-                            boundary_data['y-position'] = cols[0].replace('HEADER_BOUNDARY', '')
-                        elif cols[0] == 'BOUNDARY_DATA':
-                            for i, datum in enumerate(cols):
-                                if i > 0:
-                                    boundary_data[boundary[i]] = datum
-                        elif 'HEADER_MARKER' in cols[0]:
-                            marker = cols
-                            # Temporary hack
-                            marker[1] = 'marker_area'
-                        elif 'MARKER_DATA' in cols[0]:
-                            for i, datum in enumerate(cols):
-                                if i > 0:
-                                    marker_data[marker[i]] = datum
-                        elif 'HEADER_WATERSHED' in cols[0]:
-                            watershed=cols
-                            watershed[1]='estimated_object_count'
-                        elif 'WATERSHED_DATA' in cols[0]:
-                            for i, datum in enumerate(cols):
-                                if i>0:
-                                    watershed_data[watershed[i]]=datum
-                        elif 'HEADER_LANDMARK' in cols[0]:
-                            landmark = cols
-                        elif 'LANDMARK_DATA' in cols[0]:
-                            for i, datum in enumerate(cols):
-                                if i > 0:
-                                    landmark_data[landmark[i]] = datum
-
-                # Check to see if the image failed, if not continue
-
-                # Print the image metadata to the aggregate output file
-                args.image_id += 1
-                meta['image_id'] = args.image_id
-                meta['run_id'] = args.run_id
-
-                meta_table = []
-                for field in metadata_fields:
-                    meta_table.append(meta[field])
-
-                if len(feature_data) != 0:
-                    args.metadata_file.write('|'.join(map(str, meta_table)) + '\n')
-
-                    # Print the image feature data to the aggregate output file
-                    feature_data['image_id'] = args.image_id
-
-                    # Boundary data is optional, if it's not there we need to add in placeholder data
-                    if len(boundary_data) == 0:
-                        for field in opt_feature_fields:
-                            boundary_data[field] = 0
-                    feature_data.update(boundary_data)
-
-                    # Marker data is optional, if it's not there we need to add in placeholder data
-                    if len(marker_data) == 0:
-                        for field in marker_fields:
-                            marker_data[field] = 0
-                    feature_data.update(marker_data)
-
-                    # Watershed data is optional, if it's not there we need to add in placeholder data
-                    if len(watershed_data) == 0:
-                        for field in watershed_fields:
-                            watershed_data[field] = 0
-                    feature_data.update(watershed_data)
-
-                    # Landmark data is optional, if it's not there we need to add in placeholder data
-                    if len(landmark_data) == 0:
-                        for field in landmark_fields:
-                            landmark_data[field] = 0
-                    feature_data.update(landmark_data)
-
-                    feature_table = [args.image_id]
-                    for field in feature_fields + opt_feature_fields + marker_fields + watershed_fields + landmark_fields:
-                        feature_table.append(feature_data[field])
-
-                    args.features_file.write('|'.join(map(str, feature_table)) + '\n')
-
-                    # Print the analysis image data to the aggregate output file
-                    for img_type in images:
-                        args.analysis_images_file.write(
-                            '|'.join(map(str, (args.image_id, img_type, images[img_type]))) + '\n')
-
-                    # Print the image signal data to the aggregate output file
-                    for key in signal_data.keys():
-                        if key != 'bin-number' and key != 'bin-values':
-                            signal_data[key] = signal_data[key].replace('[', '')
-                            signal_data[key] = signal_data[key].replace(']', '')
-                            signal_table = [args.image_id, signal_data['bin-number'],key, signal_data[key],signal_data['bin-values']]
-                            args.signal_file.write('|'.join(map(str, signal_table)) + '\n')
-                else:
-                    args.fail_log.write('|'.join(map(str, meta_table)) + '\n')
+    """
+    args = index_connect(args)
+    # Metadata that the images have
+    args.index_fields = set(args.fields)
+    # Compile regular expression to remove image file extensions
+    ext = re.compile('\\.' + args.type + '$', re.IGNORECASE)
+
+    args.index_sq.execute('BEGIN IMMEDIATE')
+    try:
+        dirs = [args.dir]
+        while len(dirs) > 0:
+            dirs.extend(index_filename_dir(args, dirs.pop(), ext))
+        args.index_sq.execute('COMMIT')
+    except BaseException:
+        args.index_sq.execute('ROLLBACK')
+        raise
+
+
+###########################################
 
-                    args.metadata_file.write('|'.join(map(str, meta_table)) + '\n')
+# Update the metadata index for one directory
+###########################################
+def index_filename_dir(args, dirpath, ext):
+    """
+    Update the metadata index for the images in one directory, if the directory was modified since it was indexed.
+
+    Args:
+        args: (object) argparse object.
+        dirpath: (string) directory.
+        ext: (object) compiled regular expression matching the image file extension.
+    Returns:
+        subdirs: (list) subdirectories of dirpath.
+    Raises:
 
-                    feature_table = [args.image_id]
+    """
+    mtime = os.stat(dirpath).st_mtime
+    stored = None
+    for row in args.index_sq.execute('SELECT * FROM dirs WHERE path = ?', (dirpath,)):
+        stored = row
+
+    if stored is not None and stored['mtime'] == mtime:
+        return [os.path.join(dirpath, name) for name in stored['contents'].split('\n') if name]
+
+    subdirs = []
+    rows = []
+    for name in sorted(os.listdir(dirpath)):
+        path = os.path.join(dirpath, name)
+        if os.path.isdir(path):
+            # Symbolic links to directories are not followed (as in os.walk)
+            if not os.path.islink(path):
+                subdirs.append(name)
+        elif ext.search(name) is not None:
+            rows.append(index_row(args, dirpath, name, 1, ext.sub('', name).split(args.delimiter)))
+
+    # Forget subdirectories that were removed
+    if stored is not None:
+        for name in set(stored['contents'].split('\n')) - set(subdirs):
+            if name:
+                removed = os.path.join(dirpath, name)
+                args.index_sq.execute('DELETE FROM images WHERE path = ? OR substr(path, 1, ?) = ?',
+                                      (removed, len(removed) + 1, removed + os.sep))
+                args.index_sq.execute('DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?',
+                                      (removed, len(removed) + 1, removed + os.sep))
+
+    args.index_sq.execute('DELETE FROM images WHERE path = ?', (dirpath,))
+    if len(rows) > 0:
+        args.index_sq.executemany('INSERT INTO images VALUES (' + ', '.join(['?'] * len(rows[0])) + ')', rows)
+    args.index_sq.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                          (dirpath, index_mtime(mtime), '\n'.join(subdirs)))
+
+    return [os.path.join(dirpath, name) for name in subdirs]
 
-                    for field in feature_fields + opt_feature_fields + marker_fields + watershed_fields+ landmark_fields:
-                        feature_table.append(0)
 
-                    args.features_file.write('|'.join(map(str, feature_table)) + '\n')
+###########################################
 
+# Directory modification time to store in the index
 ###########################################
+def index_mtime(mtime):
+    """
+    Get the directory modification time to store in the metadata index. A directory modified in the last few seconds
+    may be modified again without changing its modification time (on file systems with a coarse time resolution), so
+    no time is stored and the directory is scanned again next time.
+
+    Args:
+        mtime: (float) directory modification time.
+    Returns:
+        mtime: (float) directory modification time, or None if it is too recent.
+    Raises:
+
+    """
+    if time.time() - mtime < 2:
+        return None
+
+    return mtime
 
 
-# Check to see if the image was taken between a specified date range
 ###########################################
-def check_date_range(args, img_time):
-    """Check image time versus included date range
 
-    :param args: (object) argparse object.
-    :param img_time: date-time string
-    :return: boolean
+# Update the metadata index from a PhenoFront snapshot directory
+###########################################
+def index_phenofront(args):
     """
-    # Convert image datetime to unix time
-    timestamp = dt_parser(img_time)
-    time_delta = timestamp - datetime.datetime(1970, 1, 1)
-    unix_time = (time_delta.days * 24 * 3600) + time_delta.seconds
+    Update the metadata index for the phenofront adaptor. Snapshots are checked again only if their SnapshotInfo.csv
+    row or their directory modification time changed since they were indexed.
+
+    Args:
+        args: (object) argparse object.
+    Returns:
+
+    Raises:
+
+    """
+    args = index_connect(args)
+
+    with open(args.dir + '/SnapshotInfo.csv', 'rU') as csvfile:
+        # Table column order, whitespace removed from the field names
+        cols = csvfile.readline().rstrip('\n').replace(" ", "").split(',')
+        colnames = {}
+        for i, col in enumerate(cols):
+            colnames[col] = i
+        # Metadata that the images have
+        args.index_fields = set(args.fields) | set(cols)
+
+        stored = {}
+        for row in args.index_sq.execute('SELECT * FROM dirs'):
+            stored[row['path']] = row
+
+        args.index_sq.execute('BEGIN IMMEDIATE')
+        try:
+            # The CSV column layout is part of each stored snapshot row
+            header = ','.join(cols)
+            snapshots = set()
+            for row in csvfile:
+                row = row.rstrip('\n')
+                data = row.split(',')
+                dirpath = args.dir + '/snapshot' + data[colnames['id']]
+                snapshots.add(dirpath)
+                try:
+                    mtime = os.stat(dirpath).st_mtime
+                except OSError:
+                    mtime = None
+                contents = header + '\n' + row
+                if (dirpath in stored and mtime is not None and stored[dirpath]['mtime'] == mtime and
+                        stored[dirpath]['contents'] == contents):
+                    continue
+
+                img_list = data[colnames['tiles']]
+                rows = []
+                for img in img_list.split(';'):
+                    if len(img) != 0:
+                        filename = img + '.' + args.type
+                        # Metadata from image file name
+                        metadata = img.split(args.delimiter)
+                        # Not all images in a directory may have the same metadata structure
+                        valid = 0
+                        if len(metadata) == args.meta_count:
+                            valid = 1
+                            if not os.path.exists(dirpath + '/' + filename):
+                                valid = -1
+                        rows.append(index_row(args, dirpath, filename, valid, metadata, data, colnames))
+
+                args.index_sq.execute('DELETE FROM images WHERE path = ?', (dirpath,))
+                if len(rows) > 0:
+                    args.index_sq.executemany('INSERT INTO images VALUES (' + ', '.join(['?'] * len(rows[0])) + ')',
+                                              rows)
+                if mtime is not None:
+                    mtime = index_mtime(mtime)
+                args.index_sq.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', (dirpath, mtime, contents))
+
+            # Forget snapshots that were removed from the CSV file
+            for dirpath in set(stored.keys()) - snapshots:
+                args.index_sq.execute('DELETE FROM images WHERE path = ?', (dirpath,))
+                args.index_sq.execute('DELETE FROM dirs WHERE path = ?', (dirpath,))
+            args.index_sq.execute('COMMIT')
+        except BaseException:
+            args.index_sq.execute('ROLLBACK')
+            raise
+
+
+###########################################
+
+# Select images from the metadata index
+###########################################
+def index_meta(args):
+    """
+    Select the images that match the --match, --dates and --coprocess criteria from the metadata index.
+
+    Args:
+        args: (object) argparse object.
+    Returns:
+        meta: image metadata object.
+    Raises:
+
+    """
+    # Metadata data structure
+    meta = {}
+    args.jobcount = 0
+    args.coimg_unmatched = 0
+    fields = sorted(args.valid_meta.keys())
+
+    # Metadata restrictions only apply to metadata that the images have (in their file names or in the snapshot CSV
+    # file), as in filename_parser and phenofront_parser
+    where = ['valid = 1']
+    params = []
+    for field in sorted(args.imgtype.keys()):
+        if field in args.valid_meta and field in args.index_fields:
+            where.append('`{0}` = ?'.format(field))
+            params.append(args.imgtype[field])
+    if args.dates:
+        where.append('unix_time >= ? AND unix_time <= ?')
+        params.extend([args.start_date, args.end_date])
+
+    for row in args.index_sq.execute('SELECT * FROM images WHERE ' + ' AND '.join(where), params):
+        meta[row['filename']] = index_img_meta(args, row, fields)
+        args.jobcount += 1
+
+    if args.adaptor == 'phenofront':
+        for row in args.index_sq.execute('SELECT path, filename FROM images WHERE valid = -1'):
+            args.error_log.write("Something is wrong, file {0}/{1} does not exist".format(row['path'],
+                                                                                       row['filename']))
+        if args.coprocess is not None:
+            index_coimg(args, meta, fields)
+
+    args.index_connect.close()
+
+    return meta
+
+
+###########################################
+
+# Image metadata from an index row
+###########################################
+def index_img_meta(args, row, fields):
+    """
+    Build the image metadata of one image from its metadata index row.
+
+    Args:
+        args: (object) argparse object.
+        row: (dictionary) images table row.
+        fields: (list) metadata field names.
+    Returns:
+        img_meta: (dictionary) image metadata. Metadata that is not available gets the default value.
+    Raises:
+
+    """
+    img_meta = {'path': row['path']}
+    for field in fields:
+        if row[field] is None:
+            img_meta[field] = args.valid_meta[field]
+        else:
+            img_meta[field] = row[field]
+
+    return img_meta
+
+
+###########################################
+
+# Link images to coprocessed images from the metadata index
+###########################################
+def index_coimg(args, meta, fields):
+    """
+    Add the images to coprocess to the image metadata and link each selected image to the image to coprocess with
+    it from the same snapshot.
+
+    Args:
+        args: (object) argparse object.
+        meta: image metadata object.
+        fields: (list) metadata field names.
+    Returns:
+
+    Raises:
+
+    """
+    snapshots = set([meta[img]['path'] for img in meta])
+    coimgs = {}
+    for row in args.index_sq.execute('SELECT * FROM images WHERE valid >= 0 AND imgtype = ? ORDER BY rowid',
+                                     (args.coprocess,)):
+        if row['path'] in snapshots:
+            # If several images have the same key, the last one is used
+            coimgs[(row['path'],) + coimg_key(args, row)] = row['filename']
+            if row['valid'] == 1 and row['filename'] not in meta:
+                meta[row['filename']] = index_img_meta(args, row, fields)
+
+    for img in list(meta.keys()):
+        img_meta = meta[img]
+        if img_meta['imgtype'] == args.coprocess:
+            continue
+        coimg = coimgs.get((img_meta['path'],) + coimg_key(args, img_meta))
+        if coimg is not None:
+            img_meta['coimg'] = coimg
+        else:
+            args.coimg_unmatched += 1
+            args.error_log.write(
+                "Could not find an image to coprocess with " + img_meta['path'] + '/' + img + '\n')
+
+###########################################
+
+
+# Job runner used by each worker process
+job_runner = None
+# Per-job limits used by each worker process
+job_limits = None
+# Pipeline module loaded by each in-process worker
+pipeline_module = None
+pipeline_error = None
+
+
+# Initialize a worker process
+###########################################
+def init_worker(runner, pipeline, limits):
+    """
+    Set up a worker process. For the inprocess runner, import the pipeline script once per worker.
+
+    Args:
+        runner: (string) subprocess or inprocess.
+        pipeline: (string) pipeline script file.
+        limits: (dictionary) per-job wall-clock time limit in seconds (timeout), resident memory limit in MB (rss)
+                and number of attempts (attempts). A limit of 0 is no limit.
+    Returns:
+
+    Raises:
+
+    """
+    global job_runner, job_limits, pipeline_module, pipeline_error
+    job_runner = runner
+    job_limits = limits
+    if runner != 'inprocess':
+        return
+
+    # Match the module search path of "python <pipeline>"
+    sys.path.insert(0, os.path.abspath(os.path.dirname(pipeline)))
+    # Import errors are reported for each job instead of killing the worker (the pool would restart it forever)
+    try:
+        pipeline_module = imp.load_source('plantcv_pipeline', pipeline)
+        if not hasattr(pipeline_module, 'main'):
+            pipeline_error = "Pipeline script {0} does not have a main() function".format(pipeline)
+    except Exception:
+        pipeline_error = traceback.format_exc()
+
+
+def run_pipeline_subprocess(job):
+    """
+    Run the pipeline for one job in a new Python interpreter.
+
+    Args:
+        job: (list) pipeline argument list. The first element is the pipeline script.
+    Returns:
+        status: (int) exit status of the pipeline.
+        rusage: (object) resource usage of the interpreter (see os.wait4).
+    Raises:
+
+    """
+    process = Popen(['python'] + job)
+    pid, wstatus, rusage = os.wait4(process.pid, 0)
+    process.returncode = exit_status(wstatus)
+
+    return process.returncode, rusage
+
+
+def exit_status(wstatus):
+    """
+    Get the exit status of a child process from its wait status, as returned by subprocess.
+
+    Args:
+        wstatus: (int) wait status (see os.wait4).
+    Returns:
+        status: (int) exit status, or the negative signal number if the process was killed by a signal.
+    Raises:
+
+    """
+    if os.WIFSIGNALED(wstatus):
+        return -os.WTERMSIG(wstatus)
+
+    return os.WEXITSTATUS(wstatus)
+
+
+def run_pipeline_inprocess(job):
+    """
+    Run the pipeline main() function for one job in the current process.
+
+    Args:
+        job: (list) pipeline argument list. The first element is the pipeline script.
+    Returns:
+        status: (int) exit status, 0 if the pipeline finished without error.
+    Raises:
+
+    """
+    if pipeline_error is not None:
+        print(pipeline_error, file=sys.stderr)
+        return 1
+
+    # The pipeline options() function parses sys.argv, the same as when it runs as a script
+    argv = sys.argv
+    sys.argv = list(job)
+    status = 0
+    try:
+        pipeline_module.main()
+    except SystemExit as e:
+        if e.code is not None and e.code != 0:
+            status = 1
+    except Exception:
+        print("Error processing " + ' '.join(map(str, job)), file=sys.stderr)
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.argv = argv
+        # Do not let figures from one image leak into the next
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+
+    return status
+
+
+def run_pipeline_limited(job, runner, timeout, rss):
+    """
+    Run the pipeline for one job in a child process and kill it if it runs longer than the time limit or uses more
+    resident memory than the memory limit. The inprocess runner forks the worker, so the pipeline script is still
+    imported only once.
+
+    Args:
+        job: (list) pipeline argument list. The first element is the pipeline script.
+        runner: (string) subprocess or inprocess.
+        timeout: (float) wall-clock time limit in seconds, 0 for no limit.
+        rss: (float) resident memory limit in MB, 0 for no limit.
+    Returns:
+        status: (int) exit status, 0 if the pipeline finished without error.
+        limit: (string) description of the limit the job hit, None if it did not hit a limit.
+        rusage: (object) resource usage of the child process (see os.wait4).
+    Raises:
+
+    """
+    start = time.time()
+    process = None
+    if runner == 'inprocess':
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                status = run_pipeline_inprocess(job)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+    else:
+        process = Popen(['python'] + job)
+        pid = process.pid
+
+    limit = None
+    interval = 0.01
+    while True:
+        wpid, wstatus, rusage = os.wait4(pid, os.WNOHANG)
+        if wpid == pid:
+            break
+        if limit is None:
+            if timeout > 0 and time.time() - start > timeout:
+                limit = "time limit ({0} s)".format(timeout)
+            elif rss > 0 and process_rss(pid) > rss:
+                limit = "memory limit ({0} MB)".format(rss)
+            if limit is not None:
+                os.kill(pid, signal.SIGKILL)
+                continue
+        time.sleep(interval)
+        # Check often at first so that short jobs are not slowed down
+        interval = min(interval * 2, 0.5)
+
+    status = exit_status(wstatus)
+    if process is not None:
+        process.returncode = status
+
+    return status, limit, rusage
+
+
+def process_rss(pid):
+    """
+    Get the resident memory size of a process.
+
+    Args:
+        pid: (int) process ID.
+    Returns:
+        rss: (float) resident memory size in MB, 0 if the process has exited.
+    Raises:
+
+    """
+    try:
+        with open('/proc/{0}/status'.format(pid)) as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return float(line.split()[1]) / 1024
+    except IOError:
+        pass
+
+    return 0
+
+
+# Process images using multiprocessing
+###########################################
+def process_images_multiproc(jobs):
+    """
+    Run a batch of jobs taken from the job queue.
+
+    Args:
+        jobs: (list) list of jobs (see job_args).
+    Returns:
+        job_stats: (list) one dictionary per job with the image, worker process ID, start and end time, exit status,
+                   number of attempts, peak memory use (MB, None if it is not measured for the job), time spent parsing
+                   results and the parsed results of the job.
+    Raises:
+
+    """
+    job_stats = []
+    for job in jobs:
+        start = time.time()
+        limits = []
+        rusage = None
+        if job_limits['timeout'] > 0 or job_limits['rss'] > 0:
+            for attempt in range(1, job_limits['attempts'] + 1):
+                status, limit, rusage = run_pipeline_limited(job['args'], job_runner, job_limits['timeout'],
+                                                             job_limits['rss'])
+                if limit is None:
+                    break
+                limits.append("killed at the {0} (attempt {1} of {2})".format(limit, attempt,
+                                                                             job_limits['attempts']))
+                print("Killed " + job['image'] + " at the " + limit, file=sys.stderr)
+                # Results of a killed job are incomplete
+                for filename, img_meta in job['results']:
+                    if os.path.isfile(filename):
+                        os.remove(filename)
+        elif job_runner == 'inprocess':
+            status = run_pipeline_inprocess(job['args'])
+        else:
+            status, rusage = run_pipeline_subprocess(job['args'])
+        end = time.time()
+
+        # Peak memory use of the child process. Without a child process (the inprocess runner without limits) the
+        # peak of the job cannot be told apart from that of the worker and earlier jobs, and is not recorded
+        peak_rss = None
+        if rusage is not None:
+            # ru_maxrss is in KB on Linux
+            peak_rss = rusage.ru_maxrss / 1024.0
+
+        # Results are parsed here so the database writer only has to insert them
+        results = [parse_results(filename, img_meta) for filename, img_meta in job['results']]
+        results[0]['limits'] = limits
+        job_stats.append({'image': job['results'][0][1]['image'], 'worker': os.getpid(), 'start': start, 'end': end,
+                          'status': status, 'attempts': min(len(limits) + 1, job_limits['attempts']),
+                          'peak_rss': peak_rss, 'parse': time.time() - end, 'results': results})
+
+    return job_stats
+
+
+# Multiprocessing pool builder
+###########################################
+def exe_multiproc(jobs, args, results_queue):
+    """
+    Run jobs on a pool of worker processes. Workers pull batches of args.batchsize jobs from a shared queue as they
+    become free, so no worker is left idle while another works through a large static share of the images.
+    The parsed results of each finished batch are passed on to the database writer.
+
+    Args:
+        jobs: (list) list of jobs (see job_args).
+        args: (object) argparse object.
+        results_queue: (object) queue read by the database writer (see process_results).
+    Returns:
+        job_stats: (list) job statistics (see process_images_multiproc).
+    Raises:
+        ValueError: if execution is terminated by the user.
+    """
+    batches = [jobs[i:i + args.batchsize] for i in range(0, len(jobs), args.batchsize)]
+    job_stats = []
+    p = mp.Pool(processes=args.cpu, initializer=init_worker, initargs=(args.runner, args.pipeline, args.limits))
+    try:
+        results = p.imap_unordered(process_images_multiproc, batches)
+        for i in range(0, len(batches)):
+            # A timeout keeps the wait interruptible by KeyboardInterrupt
+            batch_stats = results.next(9999999)
+            batch_results = []
+            for stat in batch_stats:
+                batch_results.extend(stat.pop('results'))
+            results_queue.put(batch_results)
+            job_stats.extend(batch_stats)
+        p.close()
+        p.join()
+    except KeyboardInterrupt:
+        p.terminate()
+        p.join()
+        raise ValueError("Execution terminated by user\n")
+
+    return job_stats
+
+
+# Shared job queue
+###########################################
+def queue_connect(filename):
+    """
+    Open a connection to a job queue file.
+
+    Args:
+        filename: (string) job queue file name.
+    Returns:
+        connect: Job queue database connection.
+    Raises:
+
+    """
+    # Workers on several nodes write to the queue, wait for the lock instead of failing
+    connect = sqlite3.connect(filename, timeout=600)
+    connect.isolation_level = None
+    connect.row_factory = dict_factory
+    connect.text_factory = str
+    # Write-ahead logging does not work on network file systems
+    connect.execute('PRAGMA journal_mode = DELETE')
+
+    return connect
+
+
+###########################################
+
+# Read a job queue value
+###########################################
+def queue_loads(text):
+    """
+    Decode a job or the statistics of a job stored in a job queue file as JSON. Only strings, numbers, booleans,
+    None, lists and dictionaries are decoded, so reading the queue does not run code written to it.
+
+    Args:
+        text: (string) JSON text.
+    Returns:
+        value: decoded value. Strings are native strings (on Python 2 JSON strings are decoded as unicode).
+    Raises:
+
+    """
+    def native(value):
+        if isinstance(value, dict):
+            return dict((native(key), native(item)) for key, item in value.items())
+        if isinstance(value, list):
+            return [native(item) for item in value]
+        if isinstance(value, type(u'')) and not isinstance(value, str):
+            return value.encode('utf-8')
+        return value
+
+    return native(json.loads(text))
+
+
+###########################################
+
+# Write the jobs to a job queue file
+###########################################
+def queue_create(jobs, args):
+    """
+    Write the job list and the settings workers need to a new job queue file. The queue is built in a temporary
+    file and renamed so workers never see a partial queue.
+
+    Args:
+        jobs: (list) list of jobs (see job_args).
+        args: (object) argparse object.
+    Returns:
+
+    Raises:
+
+    """
+    tmp_file = args.queue + '.tmp'
+    for queue_file in [args.queue, tmp_file, args.queue + '-journal', tmp_file + '-journal']:
+        if os.path.isfile(queue_file):
+            os.remove(queue_file)
+
+    connect = queue_connect(tmp_file)
+    connect.execute('CREATE TABLE `settings` (`key` TEXT PRIMARY KEY, `value` TEXT NOT NULL);')
+    # state: pending, running, done or failed. job is the job (see job_args) and stats the job statistics and parsed
+    # results of a job that is done (see process_images_multiproc), both as JSON (see queue_loads). Results are
+    # loaded into the database when loaded is set
+    connect.execute('CREATE TABLE `jobs` (`job_id` INTEGER PRIMARY KEY, `job` TEXT NOT NULL, '
+                    '`state` TEXT NOT NULL, `worker` TEXT, `lease` REAL, `attempts` INTEGER NOT NULL, '
+                    '`status` INTEGER, `stats` TEXT, `loaded` INTEGER NOT NULL);')
+    connect.execute('CREATE INDEX `jobs_state` ON `jobs` (`state`);')
+    connect.execute('BEGIN')
+    settings = {'pipeline': args.pipeline, 'runner': args.runner, 'lease': args.lease, 'attempts': args.attempts,
+                'timeout': args.timeout, 'rss': args.rss, 'closed': 0}
+    connect.executemany('INSERT INTO settings VALUES (?, ?)', list(settings.items()))
+    connect.executemany("INSERT INTO jobs VALUES (?, ?, 'pending', NULL, NULL, 0, NULL, NULL, 0)",
+                        [(i, json.dumps(job)) for i, job in enumerate(jobs)])
+    connect.execute('COMMIT')
+    connect.close()
+
+    os.rename(tmp_file, args.queue)
+
+
+###########################################
+
+# Coordinate the workers of a job queue
+###########################################
+def exe_queue(jobs, args, results_queue):
+    """
+    Write the jobs to the job queue file and pass the results of the jobs that are done by workers (--worker) to the
+    database writer. Jobs whose worker stopped renewing its lease are given to other workers; after args.attempts
+    tries the image is recorded as failed.
+
+    Args:
+        jobs: (list) list of jobs (see job_args).
+        args: (object) argparse object.
+        results_queue: (object) queue read by the database writer (see process_results).
+    Returns:
+        job_stats: (list) job statistics (see process_images_multiproc). The worker is the host name and process ID.
+    Raises:
+        ValueError: if execution is terminated by the user.
+    """
+    queue_create(jobs, args)
+    print("Waiting for workers: plantcv-pipeline.py --worker " + args.queue, file=sys.stderr)
+
+    connect = queue_connect(args.queue)
+    sq = connect.cursor()
+    job_stats = []
+    try:
+        while len(job_stats) < len(jobs):
+            # Give up on jobs that were lost too many times
+            sq.execute('BEGIN IMMEDIATE')
+            sq.execute("UPDATE jobs SET state = 'failed', status = 1 WHERE state = 'running' AND lease < ? "
+                       "AND attempts >= ?", (time.time(), args.attempts))
+            sq.execute('COMMIT')
+
+            finished = sq.execute("SELECT * FROM jobs WHERE state IN ('done', 'failed') AND loaded = 0 "
+                                  "ORDER BY job_id").fetchall()
+            if len(finished) == 0:
+                time.sleep(1)
+                continue
+
+            batch_results = []
+            for row in finished:
+                if row['state'] == 'done':
+                    stat = queue_loads(row['stats'])
+                    batch_results.extend(stat.pop('results'))
+                    # Earlier attempts by lost workers count too
+                    stat['attempts'] += row['attempts'] - 1
+                else:
+                    # Record the image as failed, as a single-node run does for an image without results. Results
+                    # files left by a lost worker may be incomplete and are not read
+                    job = jobs[row['job_id']]
+                    batch_results.extend([parse_results(None, img_meta) for filename, img_meta in job['results']])
+                    print("Giving up on " + job['image'] + " after " + str(row['attempts']) + " attempts",
+                          file=sys.stderr)
+                    now = time.time()
+                    stat = {'image': job['results'][0][1]['image'], 'start': now, 'end': now, 'status': 1,
+                            'attempts': row['attempts'], 'peak_rss': None, 'parse': 0}
+                stat['worker'] = row['worker']
+                job_stats.append(stat)
+            results_queue.put(batch_results)
+            sq.execute('BEGIN IMMEDIATE')
+            sq.executemany('UPDATE jobs SET loaded = 1, stats = NULL WHERE job_id = ?',
+                           [(row['job_id'],) for row in finished])
+            sq.execute('COMMIT')
+    except KeyboardInterrupt:
+        raise ValueError("Execution terminated by user\n")
+    finally:
+        # Tell the workers to stop
+        sq.execute("UPDATE settings SET value = 1 WHERE key = 'closed'")
+        connect.close()
+
+    return job_stats
+
+
+###########################################
+
+# Work on the jobs of a job queue
+###########################################
+def queue_worker(args):
+    """
+    Work on the jobs of a job queue file with args.cpu worker processes until all jobs are finished.
+
+    Args:
+        args: (object) argparse object.
+    Returns:
+
+    Raises:
+
+    """
+    # The coordinator may still be building the job list
+    while not os.path.isfile(args.worker):
+        time.sleep(1)
+
+    if args.cpu == 1:
+        queue_worker_loop(args.worker, args.batchsize)
+    else:
+        workers = [mp.Process(target=queue_worker_loop, args=(args.worker, args.batchsize))
+                   for i in range(0, args.cpu)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+
+###########################################
+
+# Job queue worker process
+###########################################
+def queue_worker_loop(queue_file, batchsize):
+    """
+    Claim batches of jobs from a job queue file, run them and store their results in the queue, until the queue is
+    closed or no job is left. The lease of the claimed jobs is renewed by a heartbeat thread while they run.
+
+    Args:
+        queue_file: (string) job queue file name.
+        batchsize: (int) number of jobs to claim at a time.
+    Returns:
+
+    Raises:
+
+    """
+    connect = queue_connect(queue_file)
+    sq = connect.cursor()
+    settings = {}
+    for row in sq.execute('SELECT * FROM settings'):
+        settings[row['key']] = row['value']
+    lease = float(settings['lease'])
+    attempts = int(settings['attempts'])
+    worker = socket.gethostname() + ':' + str(os.getpid())
+
+    init_worker(settings['runner'], settings['pipeline'],
+                {'timeout': float(settings['timeout']), 'rss': float(settings['rss']), 'attempts': attempts})
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=queue_heartbeat, args=(queue_file, worker, lease, stop))
+    heartbeat.daemon = True
+    heartbeat.start()
+    try:
+        while True:
+            # Claim pending jobs, or jobs whose worker stopped renewing its lease
+            sq.execute('BEGIN IMMEDIATE')
+            claimed = sq.execute("SELECT job_id, job, attempts FROM jobs WHERE (state = 'pending' OR (state = 'running' AND "
+                                 "lease < ?)) AND attempts < ? ORDER BY job_id LIMIT ?",
+                                 (time.time(), attempts, batchsize)).fetchall()
+            sq.executemany("UPDATE jobs SET state = 'running', worker = ?, lease = ?, attempts = attempts + 1 "
+                           "WHERE job_id = ?", [(worker, time.time() + lease, row['job_id']) for row in claimed])
+            sq.execute('COMMIT')
+
+            if len(claimed) == 0:
+                closed = sq.execute("SELECT value FROM settings WHERE key = 'closed'").fetchone()['value']
+                left = sq.execute("SELECT COUNT(*) AS count FROM jobs WHERE state IN ('pending', 'running')"
+                                  ).fetchone()['count']
+                if int(closed) == 1 or left == 0:
+                    break
+                time.sleep(1)
+                continue
+
+            for row in claimed:
+                job = queue_loads(row['job'])
+                # Each attempt writes results files of its own, so that a lost worker that is still running does not
+                # write to the results of the attempt that replaced it
+                attempt = job_attempt(job, 'attempt{0}-{1}'.format(row['attempts'] + 1, worker.replace(':', '-')))
+                stat = process_images_multiproc([attempt])[0]
+                # Only the worker that holds the job can finish it
+                done = sq.execute("UPDATE jobs SET state = 'done', status = ?, stats = ? "
+                                  "WHERE job_id = ? AND worker = ? AND state = 'running'",
+                                  (stat['status'], json.dumps(stat), row['job_id'],
+                                   worker)).rowcount == 1
+                for (filename, img_meta), (attempt_file, attempt_meta) in zip(job['results'], attempt['results']):
+                    if os.path.isfile(attempt_file):
+                        if done:
+                            os.rename(attempt_file, filename)
+                        else:
+                            os.remove(attempt_file)
+    finally:
+        stop.set()
+        connect.close()
+
+
+###########################################
+
+# Results files of one attempt at a job
+###########################################
+def job_attempt(job, tag):
+    """
+    Copy a job so that the pipeline writes to results files of its own. The attempt results file names are the job
+    results file names with the tag added before the extension.
+
+    Args:
+        job: (dictionary) job (see job_args).
+        tag: (string) name of the attempt.
+    Returns:
+        attempt: (dictionary) job with the attempt results files.
+    Raises:
+
+    """
+    results = []
+    attempt_files = {}
+    for filename, img_meta in job['results']:
+        root, ext = os.path.splitext(filename)
+        attempt_files[filename] = root + '.' + tag + ext
+        results.append((attempt_files[filename], img_meta))
+    job_argv = [attempt_files.get(arg, arg) for arg in job['args']]
+
+    return {'image': job['image'], 'args': job_argv, 'results': results}
+
+
+###########################################
+
+# Renew job queue leases
+###########################################
+def queue_heartbeat(queue_file, worker, lease, stop):
+    """
+    Renew the lease of the jobs a worker is running, until stopped.
+
+    Args:
+        queue_file: (string) job queue file name.
+        worker: (string) worker name.
+        lease: (float) lease time in seconds.
+        stop: (object) threading event that stops the heartbeat.
+    Returns:
+
+    Raises:
+
+    """
+    connect = queue_connect(queue_file)
+    while not stop.wait(lease / 3):
+        connect.execute("UPDATE jobs SET lease = ? WHERE worker = ? AND state = 'running'",
+                        (time.time() + lease, worker))
+    connect.close()
+
+###########################################
+
+
+# Report how busy each worker was
+###########################################
+def worker_report(job_stats, clock_time):
+    """
+    Print the number of images and busy time for each worker process.
+
+    Args:
+        job_stats: (list) job statistics from exe_multiproc.
+        clock_time: (float) wall-clock time of the parallel image processing step.
+    Returns:
+
+    Raises:
+
+    """
+    workers = {}
+    for stat in job_stats:
+        if stat['worker'] not in workers:
+            workers[stat['worker']] = {'images': 0, 'busy': 0}
+        workers[stat['worker']]['images'] += 1
+        workers[stat['worker']]['busy'] += stat['end'] - stat['start']
+
+    print("Worker utilization:", file=sys.stderr)
+    for worker in sorted(workers.keys()):
+        busy = workers[worker]['busy']
+        percent = 0
+        if clock_time > 0:
+            percent = 100 * busy / clock_time
+        print("    worker {0}: {1} images, busy {2:.1f} s ({3:.1f}%)".format(worker, workers[worker]['images'], busy,
+                                                                           percent), file=sys.stderr)
+    failed = len([stat for stat in job_stats if stat['status'] != 0])
+    if failed:
+        print("    {0} images exited with an error".format(failed), file=sys.stderr)
+    print('', file=sys.stderr)
+
+###########################################
+
+
+# Record the time spent in a stage of the run
+###########################################
+def run_stage(args, stage, start, seconds):
+    """
+    Record the time spent in a stage of the run.
+
+    Args:
+        args: (object) argparse object.
+        stage: (string) stage name.
+        start: (float) stage start time (Unix time).
+        seconds: (float) time spent in the stage.
+    Returns:
+
+    Raises:
+
+    """
+    args.stages.append((stage, start, seconds))
+
+
+###########################################
+
+# Store the run telemetry
+###########################################
+def run_telemetry(args, job_stats, submit_time):
+    """
+    Store the stage timings and job statistics of the run in the runstages and runjobs tables.
+
+    Args:
+        args: (object) argparse object.
+        job_stats: (list) job statistics from exe_multiproc or exe_queue.
+        submit_time: (float) time the jobs were handed to the workers (Unix time).
+    Returns:
+
+    Raises:
+
+    """
+    stages = [(args.run_id,) + stage for stage in args.stages]
+    jobs = []
+    for stat in job_stats:
+        jobs.append((args.run_id, stat['image'], str(stat['worker']), stat['start'], stat['end'],
+                     max(stat['start'] - submit_time, 0), stat['parse'], stat['status'], stat['attempts'],
+                     stat['peak_rss']))
+
+    args.sq.execute('BEGIN IMMEDIATE')
+    try:
+        db_insert(args.sq, 'runstages', stages)
+        db_insert(args.sq, 'runjobs', jobs)
+        args.sq.execute('COMMIT')
+    except BaseException:
+        args.sq.execute('ROLLBACK')
+        raise
+
+
+###########################################
+
+# Print a summary of the run telemetry
+###########################################
+def run_summary(args, job_stats):
+    """
+    Print the throughput, per-image statistics and stage timings of the run.
+
+    Args:
+        args: (object) argparse object.
+        job_stats: (list) job statistics from exe_multiproc or exe_queue.
+    Returns:
+
+    Raises:
+
+    """
+    # The database writes overlap with the other stages and are not part of the total
+    total = sum([stage[2] for stage in args.stages if stage[0] != 'database writes'])
+    print("Run summary (run " + str(args.run_id) + "):", file=sys.stderr)
+    processing = [stage[2] for stage in args.stages if stage[0] == 'image processing'][0]
+    if len(job_stats) > 0:
+        runtimes = sorted([stat['end'] - stat['start'] for stat in job_stats])
+        peak_rss = [stat['peak_rss'] for stat in job_stats if stat['peak_rss'] is not None]
+        rate = 0
+        if processing > 0:
+            rate = len(job_stats) / processing
+        print("    {0} images, {1:.2f} images/s".format(len(job_stats), rate), file=sys.stderr)
+        print("    image time: mean {0:.2f} s, median {1:.2f} s, max {2:.2f} s".format(
+            sum(runtimes) / len(runtimes), runtimes[len(runtimes) // 2], runtimes[-1]), file=sys.stderr)
+        print("    results parsing: {0:.2f} s".format(sum([stat['parse'] for stat in job_stats])), file=sys.stderr)
+        if len(peak_rss) > 0:
+            print("    peak memory: max {0:.0f} MB".format(max(peak_rss)), file=sys.stderr)
+        retried = len([stat for stat in job_stats if stat['attempts'] > 1])
+        if retried:
+            print("    {0} images were tried more than once".format(retried), file=sys.stderr)
+    for stage in args.stages:
+        percent = 0
+        if total > 0 and stage[0] != 'database writes':
+            percent = 100 * stage[2] / total
+        print("    {0}: {1:.2f} s ({2:.1f}%)".format(stage[0], stage[2], percent), file=sys.stderr)
+    print('', file=sys.stderr)
+
+
+# Build job list
+###########################################
+def job_builder(args, meta):
+    """
+    Build a list of image processing jobs.
+  
+    Args:
+        args: (object) argparse object.
+        meta: metadata data structure.
+    Returns:
+        jobs: (list) list of jobs (see job_args).
+    Raises:
+    
+    """
+    # Get the list of images
+    # images = list(meta.keys())
+    images = []
+    for img in list(meta.keys()):
+        # # If a date range was requested, check whether the image is within range
+        # if args.dates:
+        #     # Convert image datetime to unix time
+        #     timestamp = dt_parser(meta[img]['timestamp'])
+        #     time_delta = timestamp - datetime.datetime(1970, 1, 1)
+        #     unix_time = (time_delta.days * 24 * 3600) + time_delta.seconds
+        #     if unix_time < args.start_date or unix_time > args.end_date:
+        #         continue
+        if args.coprocess is not None:
+            if meta[img]['imgtype'] != args.coprocess:
+                images.append(img)
+        else:
+            images.append(img)
+
+    # Skip images that have not changed since they were last processed
+    if args.incremental:
+        processed = processed_images(args)
+        new_images = []
+        for img in images:
+            files = [img]
+            if (args.coprocess is not None) and ('coimg' in meta[img]):
+                files.append(meta[img]['coimg'])
+            for filename in files:
+                if processed.get(meta[filename]['path'] + '/' + filename) != file_stat(meta, filename):
+                    new_images.append(img)
+                    break
+        if args.snapshot:
+            # Snapshots are processed again as a whole. Images without results (e.g. dark frames) are never in the
+            # processed images index, so a snapshot is new if none of its images were processed or one has changed
+            snapshots = {}
+            for img in images:
+                snapshots.setdefault(meta[img]['path'], []).append(img)
+            new_snapshots = set()
+            for path in snapshots:
+                stats = [processed.get(path + '/' + img) for img in snapshots[path]]
+                if all([stat is None for stat in stats]) or \
+                        any([stat is not None and img in new_images for stat, img in zip(stats, snapshots[path])]):
+                    new_snapshots.add(path)
+            new_images = [img for img in images if meta[img]['path'] in new_snapshots]
+        print("Skipping " + str(len(images) - len(new_images)) + " images that were already processed",
+              file=sys.stderr)
+        images = new_images
+
+    print("Job list will include " + str(len(images)) + " images" + '\n', file=sys.stderr)
+
+    jobs = []
+    if args.snapshot:
+        # One job for all the images of each snapshot
+        snapshots = {}
+        for img in images:
+            snapshots.setdefault(meta[img]['path'], []).append(img)
+        for path in sorted(snapshots):
+            jobs.append(snapshot_job_args(args, meta, path, snapshots[path]))
+    else:
+        # For each image
+        for img in images:
+            # Add the job to the job list
+            jobs.append(job_args(args, meta, img))
+
+    return jobs
+
+
+###########################################
+
+# Modification time and size of an image file
+###########################################
+def file_stat(meta, img):
+    """
+    Get the modification time and size of an image file.
+
+    Args:
+        meta: metadata data structure.
+        img: (string) image file name.
+    Returns:
+        stat: (tuple) file modification time (float) and size (int).
+    Raises:
+
+    """
+    stat = os.stat(meta[img]['path'] + '/' + img)
+
+    return float(stat.st_mtime), int(stat.st_size)
+
+
+###########################################
+
+# Read the processed images index
+###########################################
+def processed_images(args):
+    """
+    Read the index of images that were processed successfully in earlier runs.
+
+    Args:
+        args: (object) argparse object.
+    Returns:
+        processed: (dictionary) file modification time and size keyed by image path, from the most recent run that
+                   processed the image.
+    Raises:
+
+    """
+    processed = {}
+    for row in args.sq.execute('SELECT image, mtime, size FROM processed_images ORDER BY image_id'):
+        processed[row['image']] = (float(row['mtime']), int(row['size']))
+
+    return processed
+
+
+###########################################
+
+# Metadata of one image
+###########################################
+def job_meta(args, meta, img):
+    """
+    Collect the metadata that is stored in the database with the results of one image.
+
+    Args:
+        args: (object) argparse object.
+        meta: metadata data structure.
+        img: (string) image file name.
+    Returns:
+        img_meta: (dictionary) image path, file modification time and size, and valid metadata values.
+    Raises:
+
+    """
+    mtime, size = file_stat(meta, img)
+    img_meta = {'image': meta[img]['path'] + '/' + img, 'mtime': mtime, 'size': size}
+    # Valid metadata
+    for m in list(args.valid_meta.keys()):
+        img_meta[m] = str(meta[img][m])
+
+    return img_meta
+
+
+###########################################
+
+# Build the pipeline arguments for one image
+###########################################
+def job_args(args, meta, img):
+    """
+    Build the pipeline command-line arguments for one image.
+
+    Args:
+        args: (object) argparse object.
+        meta: metadata data structure.
+        img: (string) image file name.
+    Returns:
+        job: (dictionary) image name, pipeline argument list (the first element is the pipeline script) and the
+             results files the pipeline writes to, each with the metadata of its image.
+    Raises:
+
+    """
+    results = [(os.path.join(args.jobdir, img + '.pcv'), job_meta(args, meta, img))]
+    job_argv = [args.pipeline, '--image', meta[img]['path'] + '/' + img, '--outdir', args.outdir,
+                '--result', results[0][0]]
+    if args.coprocess is not None and ('coimg' in meta[img]):
+        coimg = meta[img]['coimg']
+        results.append((os.path.join(args.jobdir, coimg + '.pcv'), job_meta(args, meta, coimg)))
+        job_argv.extend(['--coresult', results[1][0]])
+    if writeimg_sampled(args, img):
+        job_argv.append('--writeimg')
+    if args.other_args:
+        job_argv.extend(shlex.split(args.other_args))
+
+    return {'image': img, 'args': job_argv, 'results': results}
+
+
+###########################################
+
+# Build the pipeline arguments for one snapshot
+###########################################
+def snapshot_job_args(args, meta, path, imgs):
+    """
+    Build the pipeline command-line arguments for all images of one snapshot.
+
+    Args:
+        args: (object) argparse object.
+        meta: metadata data structure.
+        path: (string) snapshot directory.
+        imgs: (list) image file names in the snapshot directory.
+    Returns:
+        job: (dictionary) snapshot name, pipeline argument list (the first element is the pipeline script) and the
+             results files the pipeline writes to, each with the metadata of its image.
+    Raises:
+
+    """
+    # Frame order (numeric frames sort by number), then file name
+    def frame_order(img):
+        frame = str(meta[img]['frame'])
+        if frame.isdigit():
+            return 0, int(frame), img
+        return 1, frame, img
+
+    results = []
+    job_argv = [args.pipeline, '--snapshot', path, '--outdir', args.outdir]
+    for img in sorted(imgs, key=frame_order):
+        results.append((os.path.join(args.jobdir, img + '.pcv'), job_meta(args, meta, img)))
+        job_argv.extend(['--image', meta[img]['path'] + '/' + img, '--result', results[-1][0]])
+    if writeimg_sampled(args, os.path.basename(path)):
+        job_argv.append('--writeimg')
+    if args.other_args:
+        job_argv.extend(shlex.split(args.other_args))
+
+    return {'image': os.path.basename(path), 'args': job_argv, 'results': results}
+
+
+###########################################
+
+# Sample the images to include analysis images for
+###########################################
+def writeimg_sampled(args, name):
+    """
+    Decide whether the pipeline includes analysis images for an image or snapshot (--writeimg and --writeimg-sample).
+    The decision depends on the name only, so every run (e.g. an incremental run) samples the same images.
+
+    Args:
+        args: (object) argparse object.
+        name: (string) image file name or snapshot directory name.
+    Returns:
+        sampled: (bool) True if the pipeline is run with --writeimg.
+    Raises:
+
+    """
+    if not args.writeimg:
+        return False
+    if not isinstance(name, bytes):
+        name = name.encode('utf-8')
+    # The first 32 bits of the name hash are uniformly distributed
+    return int(hashlib.md5(name).hexdigest()[:8], 16) < args.writeimg_sample * 2 ** 32
+
+
+###########################################
+
+# Process results. Parse individual image output files.
+###########################################
+def process_results(args, results_queue):
+    """
+    Load the results of finished jobs into the SQLite database while the images are processed.
+    Runs as the single database writer. Parsed results arrive on a queue as batches of finished jobs; each batch is
+    loaded in one transaction so the database only ever holds complete images. A None item ends the run.
+    Errors are stored in args.writer_error.
+
+    Args:
+        args: (object) argparse object.
+        results_queue: (object) queue of lists of parsed results (see parse_results), one list per batch of jobs.
+    Returns:
+
+    Raises:
+
+    """
+    args.writer_error = None
+    args.writer_start = time.time()
+    args.writer_busy = 0
+    connect = db_open(args.db)
+    sq = connect.cursor()
+    # Database row batches, one list per table
+    rows = {'runinfo': [args.runinfo], 'metadata': [], 'features': [], 'analysis_images': [], 'signal': [],
+            'processed_images': []}
+    done = False
+    try:
+        while not done:
+            # Wait for results, then take everything else that is already waiting
+            batch = [results_queue.get()]
+            while batch[-1] is not None:
+                try:
+                    batch.append(results_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                done = True
+                batch.pop()
+
+            transaction_start_time = time.time()
+            sq.execute('BEGIN IMMEDIATE')
+            try:
+                for batch_results in batch:
+                    for results in batch_results:
+                        result_rows(args, results, rows)
+                    # Insert full batches so memory use does not grow with the size of the run
+                    for table in rows:
+                        if len(rows[table]) >= 10000:
+                            db_insert(sq, table, rows[table])
+                for table in rows:
+                    db_insert(sq, table, rows[table])
+                sq.execute('COMMIT')
+                args.writer_busy += time.time() - transaction_start_time
+            except BaseException:
+                sq.execute('ROLLBACK')
+                raise
+    except BaseException:
+        args.writer_error = traceback.format_exc()
+        # Keep draining the queue so the image processing is not blocked by a failed writer
+        while not done:
+            done = results_queue.get() is None
+    finally:
+        connect.close()
+
+
+###########################################
+
+# Parse an individual image output file
+###########################################
+def parse_results(filename, job_meta):
+    """
+    Parse the results file of one image.
+
+    Args:
+        filename: (string) results file name, None if the job has no results.
+        job_meta: (dictionary) image metadata from the job. META rows in the results file take precedence.
+    Returns:
+        results: (dictionary) parsed metadata, analysis images, features and signal data.
+    Raises:
+
+    """
+    meta = dict(job_meta)
+    images = {}
+    features = []
+    feature_data = {}
+    signal = []
+    signal_data = {}
+    boundary = []
+    boundary_data = {}
+    marker = []
+    marker_data = {}
+    watershed = []
+    watershed_data = {}
+    landmark = []
+    landmark_data = {}
+    # A pipeline that fails before writing any results leaves no results file
+    rows = []
+    if filename is not None and os.path.isfile(filename):
+        rows = pcv.read_results(filename)
+
+    # For each row in the results file
+    for row in rows:
+        # Binary results files hold the values written by the pipeline, convert them to text as in text results files
+        cols = [result_text(datum) for datum in row]
+        # If the data is of class meta, store in the metadata dictionary
+        if cols[0] == 'META':
+            meta[cols[1]] = cols[2]
+        # If the data is of class image, store in the image dictionary
+        elif cols[0] == 'IMAGE':
+            images[cols[1]] = cols[2]
+        # If the data is of class shapes, store in the shapes dictionary
+        elif cols[0] == 'HEADER_SHAPES':
+            features = cols
+        elif cols[0] == 'SHAPES_DATA':
+            for i, datum in enumerate(cols):
+                if i > 0:
+                    feature_data[features[i]] = datum
+        # If the data is of class histogram/signal, store in the signal dictionary
+        elif cols[0] == 'HEADER_HISTOGRAM':
+            signal = cols
+        elif cols[0] == 'HISTOGRAM_DATA':
+            for i, datum in enumerate(cols):
+                if i > 0:
+                    signal_data[signal[i]] = datum
+        # If the data is of class boundary (horizontal rule), store in the boundary dictionary
+        elif 'HEADER_BOUNDARY' in cols[0]:
+            boundary = cols
+            # Temporary hack
+            boundary_data['y-position'] = cols[0].replace('HEADER_BOUNDARY', '')
+        elif cols[0] == 'BOUNDARY_DATA':
+            for i, datum in enumerate(cols):
+                if i > 0:
+                    boundary_data[boundary[i]] = datum
+        elif 'HEADER_MARKER' in cols[0]:
+            marker = cols
+            # Temporary hack
+            marker[1] = 'marker_area'
+        elif 'MARKER_DATA' in cols[0]:
+            for i, datum in enumerate(cols):
+                if i > 0:
+                    marker_data[marker[i]] = datum
+        elif 'HEADER_WATERSHED' in cols[0]:
+            watershed = cols
+            watershed[1] = 'estimated_object_count'
+        elif 'WATERSHED_DATA' in cols[0]:
+            for i, datum in enumerate(cols):
+                if i > 0:
+                    watershed_data[watershed[i]] = datum
+        elif 'HEADER_LANDMARK' in cols[0]:
+            landmark = cols
+        elif 'LANDMARK_DATA' in cols[0]:
+            for i, datum in enumerate(cols):
+                if i > 0:
+                    landmark_data[landmark[i]] = datum
+
+    return {'meta': meta, 'images': images, 'features': feature_data, 'signal': signal_data,
+            'boundary': boundary_data, 'marker': marker_data, 'watershed': watershed_data, 'landmark': landmark_data,
+            'limits': []}
+
+
+###########################################
+
+# Convert a results file value to text
+###########################################
+def result_text(datum):
+    """
+    Convert a value read from a results file to the text a tab-delimited results file holds for it.
+
+    Args:
+        datum: value read from a results file.
+    Returns:
+        text: (string) value as text. Arrays are formatted as Python lists.
+    Raises:
+
+    """
+    if isinstance(datum, np.ndarray):
+        return str(datum.tolist())
+
+    return str(datum)
+
+
+###########################################
+
+# Convert the parsed results of one image to database rows
+###########################################
+def result_rows(args, results, rows):
+    """
+    Assign the next image ID to the parsed results of one image and add them to the database row batches.
+
+    Args:
+        args: (object) argparse object.
+        results: (dictionary) parsed results from parse_results.
+        rows: (dictionary) database row batches keyed by table name.
+    Returns:
+
+    Raises:
+
+    """
+    meta = results['meta']
+    feature_data = results['features']
+    signal_data = results['signal']
+    all_feature_fields = (args.feature_fields + args.opt_feature_fields + args.marker_fields +
+                          args.watershed_fields + args.landmark_fields)
+
+    # Check to see if the image failed, if not continue
+
+    # Add the image metadata to the metadata table
+    args.image_id += 1
+    meta['image_id'] = args.image_id
+    meta['run_id'] = args.run_id
+
+    meta_table = []
+    for field in args.metadata_fields:
+        meta_table.append(meta[field])
+
+    # Record the images that were killed at the time or memory limit
+    for limit in results['limits']:
+        args.fail_log.write('|'.join(map(str, meta_table + [meta['image'], limit])) + '\n')
+
+    if len(feature_data) != 0:
+        rows['metadata'].append(meta_table)
+
+        # Add the image feature data to the features table
+        feature_data['image_id'] = args.image_id
+
+        # Boundary, marker, watershed and landmark data are optional, if they are not there we need to add in
+        # placeholder data
+        for data_type, fields in [('boundary', args.opt_feature_fields), ('marker', args.marker_fields),
+                                  ('watershed', args.watershed_fields), ('landmark', args.landmark_fields)]:
+            if len(results[data_type]) == 0:
+                for field in fields:
+                    results[data_type][field] = 0
+            feature_data.update(results[data_type])
+
+        feature_table = [args.image_id]
+        for field in all_feature_fields:
+            feature_table.append(feature_data[field])
+
+        rows['features'].append(feature_table)
+
+        # Add the image file to the processed images index. Failed images are not indexed so that they are retried
+        if 'mtime' in meta:
+            rows['processed_images'].append([meta['image'], float(meta['mtime']), int(meta['size']), args.image_id,
+                                             args.run_id])
+
+        # Add the analysis image data to the analysis_images table
+        for img_type in results['images']:
+            rows['analysis_images'].append([args.image_id, img_type, results['images'][img_type]])
+
+        # Add the image signal data to the signal table
+        for key in signal_data.keys():
+            if key != 'bin-number' and key != 'bin-values':
+                signal_data[key] = signal_data[key].replace('[', '')
+                signal_data[key] = signal_data[key].replace(']', '')
+                rows['signal'].append([args.image_id, signal_data['bin-number'], key, signal_data[key],
+                                       signal_data['bin-values']])
+    else:
+        args.fail_log.write('|'.join(map(str, meta_table)) + '\n')
+
+        rows['metadata'].append(meta_table)
+
+        feature_table = [args.image_id]
+
+        for field in all_feature_fields:
+            feature_table.append(0)
+
+        rows['features'].append(feature_table)
+
+###########################################
+
+
+# Check to see if the image was taken between a specified date range
+###########################################
+def check_date_range(args, img_time):
+    """Check image time versus included date range
+
+    :param args: (object) argparse object.
+    :param img_time: date-time string
+    :return: boolean
+    """
+    # Convert image datetime to unix time
+    img_unix_time = unix_time(img_time)
     # Does the image date-time fall outside or inside the included range
-    if unix_time < args.start_date or unix_time > args.end_date:
+    if img_unix_time < args.start_date or img_unix_time > args.end_date:
         return False
     else:
         return True
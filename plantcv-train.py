@@ -5,10 +5,16 @@ import os
 import sys
 import argparse
 import datetime
-from scipy import stats
+import multiprocessing as mp
 import numpy as np
 import cv2
 
+# Color channels of the Naive Bayes model
+CHANNELS = ["hue", "saturation", "value"]
+
+# Color spaces of the color lookup table model (OpenCV conversion from BGR)
+COLORSPACES = {"bgr": None, "hsv": cv2.COLOR_BGR2HSV, "lab": cv2.COLOR_BGR2LAB}
+
 
 # Parse command-line arguments
 ###########################################
@@ -23,23 +29,53 @@ def options():
     start_time = datetime.datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
     print("Starting run " + start_time + '\n', file=sys.stderr)
 
-    methods = ["naive_bayes"]
+    methods = ["naive_bayes", "color_lut"]
 
     parser = argparse.ArgumentParser(description='PlantCV machine learning training script.',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("-i", "--imgdir", help='Input directory containing images.', required=True)
-    parser.add_argument("-b", "--maskdir", help="Input directory containing black/white masks.", required=True)
+    parser.add_argument("-b", "--maskdir", help="Input directory containing black/white masks (naive_bayes).")
+    parser.add_argument("-c", "--classes", help="Classes and the input directories containing their black/white "
+                                                "masks (color_lut). Format: class1:maskdir1,class2:maskdir2,...")
+    parser.add_argument("-s", "--colorspace", help="Color space of the lookup table (color_lut): bgr, hsv or lab.",
+                        default="hsv")
+    parser.add_argument("-n", "--bins", help="Number of bins per color channel of the lookup table (color_lut), a "
+                                             "power of 2 up to 256.", default=32, type=int)
     parser.add_argument("-m", "--method", help="Learning method. Available methods: " + ", ".join(map(str, methods)),
                         required=True)
-    parser.add_argument("-o", "--outfile", help="Trained classifier output filename.", required=True)
+    parser.add_argument("-T", "--cpu", help="Number of CPU to use for reading images.", default=1, type=int)
+    parser.add_argument("-o", "--outfile", help="Trained classifier output filename. A filename ending in .npz is "
+                                                "written as a compiled model.", required=True)
     args = parser.parse_args()
 
     if not os.path.exists(args.imgdir):
         raise IOError("Directory does not exist: {0}".format(args.imgdir))
-    if not os.path.exists(args.maskdir):
-        raise IOError("Directory does not exist: {0}".format(args.maskdir))
     if args.method not in methods:
         raise KeyError("Method is not supported: {0}".format(args.method))
+    if args.method == "naive_bayes":
+        if args.maskdir is None:
+            parser.error("the naive_bayes method requires -b/--maskdir")
+        if not os.path.exists(args.maskdir):
+            raise IOError("Directory does not exist: {0}".format(args.maskdir))
+    if args.method == "color_lut":
+        if args.classes is None:
+            parser.error("the color_lut method requires -c/--classes")
+        # Parse the class:maskdir pairs, in the order given
+        classes = []
+        for pair in args.classes.split(","):
+            if ":" not in pair:
+                parser.error("classes must be given as class:maskdir pairs, not: {0}".format(pair))
+            cls, maskdir = pair.split(":", 1)
+            if not os.path.exists(maskdir):
+                raise IOError("Directory does not exist: {0}".format(maskdir))
+            classes.append((cls, maskdir))
+        if len(classes) < 2 or len(set([cls for cls, maskdir in classes])) != len(classes):
+            parser.error("at least two classes with different names are required")
+        args.classes = classes
+        if args.colorspace not in COLORSPACES:
+            raise KeyError("Color space is not supported: {0}".format(args.colorspace))
+        if args.bins not in [2 ** i for i in range(1, 9)]:
+            parser.error("the number of bins must be a power of 2 from 2 to 256")
 
     return args
 
@@ -58,7 +94,9 @@ def main():
     args = options()
 
     if args.method == "naive_bayes":
-        naive_bayes(args.imgdir, args.maskdir, args.outfile)
+        naive_bayes(args.imgdir, args.maskdir, args.outfile, args.cpu)
+    elif args.method == "color_lut":
+        color_lut(args.imgdir, args.classes, args.outfile, args.colorspace, args.bins, args.cpu)
 
 
 ###########################################
@@ -66,79 +104,177 @@ def main():
 
 # Naive Bayes
 ###########################################
-def naive_bayes(imgdir, maskdir, outfile):
+def naive_bayes(imgdir, maskdir, outfile, cpu=1):
     """Naive Bayes training function
 
+    Images are read by a pool of worker processes, which sample plant and background pixels and return the histograms
+    of the samples for each color channel. Only the histograms are kept, so memory use does not grow with the number
+    of images.
+
     :param imgdir: str
     :param maskdir: str
     :param outfile: str
+    :param cpu: int
     :return:
     """
-    # Initialize color channel ndarrays for plant (foreground) and background
-    plant = {"hue": np.array([], dtype=np.uint8), "saturation": np.array([], dtype=np.uint8),
-             "value": np.array([], dtype=np.uint8)}
-    background = {"hue": np.array([], dtype=np.uint8), "saturation": np.array([], dtype=np.uint8),
-                  "value": np.array([], dtype=np.uint8)}
-
-    # Walk through the image directory
-    print("Reading images...")
+    # List the images that have a mask
+    images = []
     for (dirpath, dirnames, filenames) in os.walk(imgdir):
         for filename in filenames:
             # Is this an image type we can work with?
             if filename[-3:] in ['png', 'jpg', 'jpeg']:
                 # Does the mask exist?
                 if os.path.exists(os.path.join(maskdir, filename)):
-                    # Read the image as BGR
-                    img = cv2.imread(os.path.join(dirpath, filename), 1)
-                    # Read the mask as grayscale
-                    mask = cv2.imread(os.path.join(maskdir, filename), 0)
+                    images.append((os.path.join(dirpath, filename), os.path.join(maskdir, filename)))
+    # Each image is sampled with its own random seed (its position in the list), so the result does not depend on the
+    # order in which the reader processes finish
+    images = [(img_file, mask_file, seed) for seed, (img_file, mask_file) in enumerate(sorted(images))]
 
-                    # Convert the image to HSV and split into component channels
-                    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-                    hue, saturation, value = cv2.split(hsv)
+    # Initialize color channel histograms (one row per channel, one column per 8-bit intensity value) for plant
+    # (foreground) and background
+    plant = np.zeros((len(CHANNELS), 256), dtype=np.int64)
+    background = np.zeros((len(CHANNELS), 256), dtype=np.int64)
 
-                    # Store channels in a dictionary
-                    channels = {"hue": hue, "saturation": saturation, "value": value}
+    print("Reading " + str(len(images)) + " images...")
+    for fg, bg in read_images(image_histograms, images, cpu):
+        plant += fg
+        background += bg
 
-                    # Split channels into plant and non-plant signal
-                    for channel in channels.keys():
-                        fg, bg = split_plant_background_signal(channels[channel], mask)
+    # Calculate a probability density function for each channel using a Gaussian kernel density estimator
+    pdfs = {"plant": {}, "background": {}}
+    for i, channel in enumerate(CHANNELS):
+        print("Calculating PDF for the " + channel + " channel...")
+        # Calculate p from the PDFs for each 8-bit intensity value
+        pdfs["plant"][channel] = histogram_pdf(plant[i])
+        pdfs["background"][channel] = histogram_pdf(background[i])
+        plot_pdf(channel, pdfs["plant"][channel], pdfs["background"][channel])
+
+    # Save the PDFs to the output file, as a compiled model or as text
+    if outfile[-4:] == ".npz":
+        write_compiled_model(outfile, pdfs)
+    else:
+        write_pdfs(outfile, pdfs)
+
+
+def read_images(reader, images, cpu=1):
+    """Run a reader function on each image, in a pool of worker processes if more than one CPU is used, and yield the
+    results as they are ready (in any order)
+
+    :param reader: function
+    :param images: list
+    :param cpu: int
+    :return: generator
+    """
+    if cpu > 1:
+        pool = mp.Pool(cpu)
+        try:
+            for result in pool.imap_unordered(reader, images, chunksize=max(1, min(16, len(images) // (cpu * 4)))):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for image in images:
+            yield reader(image)
+
+
+def image_histograms(image):
+    """Read an image and its mask, sample plant and background pixels and count the sampled pixels at each intensity
+    value of each color channel
+
+    :param image: tuple
+    :return plant: ndarray
+    :return background: ndarray
+    """
+    img_file, mask_file, seed = image
+    rng = np.random.RandomState(seed)
+    # Read the image as BGR
+    img = cv2.imread(img_file, 1)
+    # Read the mask as grayscale
+    mask = cv2.imread(mask_file, 0)
+
+    # Convert the image to HSV and split into component channels
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    channels = cv2.split(hsv)
+
+    plant = np.zeros((len(CHANNELS), 256), dtype=np.int64)
+    background = np.zeros((len(CHANNELS), 256), dtype=np.int64)
+    # Split channels into plant and non-plant signal
+    for i, channel in enumerate(channels):
+        fg, bg = split_plant_background_signal(channel, mask)
+        # The plant class is sampled at 10%, so images with fewer than 10 plant pixels (or no background) add nothing
+        if len(fg) < 10 or len(bg) == 0:
+            if i == 0:
+                print("Warning: skipping " + img_file + ", its mask has " + str(len(fg)) + " plant and " +
+                      str(len(bg)) + " background pixels (at least 10 and 1 are needed)", file=sys.stderr)
+            continue
+
+        # Randomly sample from the plant class (sample 10% of the pixels)
+        fg = fg[rng.randint(0, len(fg), len(fg) // 10)]
+        # Randomly sample from the background class the same n as the plant class
+        bg = bg[rng.randint(0, len(bg), len(fg))]
+        plant[i] = np.bincount(fg, minlength=256)
+        background[i] = np.bincount(bg, minlength=256)
 
-                        # Randomly sample from the plant class (sample 10% of the pixels)
-                        fg = fg[np.random.random_integers(0, len(fg) - 1, len(fg) / 10)]
-                        # Randomly sample from the background class the same n as the plant class
-                        bg = bg[np.random.random_integers(0, len(bg) - 1, len(fg))]
-                        plant[channel] = np.append(plant[channel], fg)
-                        background[channel] = np.append(background[channel], bg)
+    return plant, background
 
-    # Calculate a probability density function for each channel using a Gaussian kernel density estimator
-    # Create an output file for the PDFs
+
+def histogram_pdf(histogram):
+    """Gaussian kernel density estimate of 8-bit intensity values, evaluated at each intensity value (0-255)
+
+    Calculated from the histogram of the values. The bandwidth is chosen with Scott's rule, so the result is the same
+    as scipy.stats.gaussian_kde on the values themselves.
+
+    :param histogram: ndarray
+    :return pdf: ndarray
+    :raises: ValueError
+    """
+    values = np.arange(256, dtype=np.float64)
+    n = float(np.sum(histogram))
+    if n < 2:
+        raise ValueError("At least two pixels of each class are needed to calculate a PDF")
+    mean = np.dot(histogram, values) / n
+    # Sample standard deviation, scaled by Scott's factor
+    bandwidth = np.sqrt(np.dot(histogram, (values - mean) ** 2) / (n - 1)) * n ** (-1. / 5)
+    if bandwidth == 0:
+        raise ValueError("All pixels of a class have the same value, cannot calculate a PDF")
+    # Gaussian kernel centered on each intensity value, weighted by the number of pixels with that value
+    kernel = np.exp(-0.5 * ((values[:, np.newaxis] - values[np.newaxis, :]) / bandwidth) ** 2)
+    pdf = np.dot(kernel, histogram) / (n * bandwidth * np.sqrt(2 * np.pi))
+
+    return pdf
+
+
+def write_pdfs(outfile, pdfs):
+    """Write the PDFs to a text file, one tab-delimited row per class and channel
+
+    :param outfile: str
+    :param pdfs: dict
+    :return:
+    """
     out = open(outfile, "w")
     out.write("class\tchannel\t" + "\t".join(map(str, range(0, 256))) + "\n")
-    for channel in plant.keys():
-        print("Calculating PDF for the " + channel + " channel...")
-        plant_kde = stats.gaussian_kde(plant[channel])
-        bg_kde = stats.gaussian_kde(background[channel])
-        # Calculate p from the PDFs for each 8-bit intensity value and save to outfile
-        plant_pdf = plant_kde(range(0, 256))
-        out.write("plant\t" + channel + "\t" + "\t".join(map(str, plant_pdf)) + "\n")
-        bg_pdf = bg_kde(range(0, 256))
-        out.write("background\t" + channel + "\t" + "\t".join(map(str, bg_pdf)) + "\n")
-        plot_pdf(channel, plant_pdf, bg_pdf)
-
-        # Add the second moment (variance) distribution for each channel
-        # print("Calculating PDF for the " + channel + "^2 channel...")
-        # plant2_kde = stats.gaussian_kde(plant[channel].astype(np.int32) ** 2)
-        # bg2_kde = stats.gaussian_kde(background[channel].astype(np.int32) ** 2)
-        # plant2_pdf = plant2_kde([x ** 2 for x in range(0, 256)])
-        # out.write("plant\t" + channel + "2\t" + "\t".join(map(str, plant2_pdf)) + "\n")
-        # bg2_pdf = bg2_kde([x ** 2 for x in range(0, 256)])
-        # out.write("background\t" + channel + "2\t" + "\t".join(map(str, bg2_pdf)) + "\n")
-        # plot_pdf(channel + "2", plant2_pdf, bg2_pdf)
-
+    for channel in CHANNELS:
+        out.write("plant\t" + channel + "\t" + "\t".join(map(str, pdfs["plant"][channel])) + "\n")
+        out.write("background\t" + channel + "\t" + "\t".join(map(str, pdfs["background"][channel])) + "\n")
     out.close()
 
 
+def write_compiled_model(outfile, pdfs):
+    """Write the PDFs as a compiled model: a NumPy archive with the class and channel names and, for each class, the
+    PDF and log PDF lookup tables (one row per channel). naive_bayes_classifier reads it without parsing text.
+
+    :param outfile: str
+    :param pdfs: dict
+    :return:
+    """
+    classes = ["plant", "background"]
+    tables = np.array([[pdfs[cls][channel] for channel in CHANNELS] for cls in classes], dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        log_tables = np.log(tables)
+    np.savez(outfile, classes=np.array(classes), channels=np.array(CHANNELS), pdfs=tables, log_pdfs=log_tables)
+
+
 def split_plant_background_signal(channel, mask):
     """Split a single-channel image by foreground and background using a mask
 
@@ -168,5 +304,104 @@ def plot_pdf(channel, plant, background):
     plt.close()
 
 
+###########################################
+
+
+# Color lookup table
+###########################################
+def color_lut(imgdir, classes, outfile, colorspace="hsv", bins=32, cpu=1):
+    """Color lookup table training function
+
+    Counts the training pixels of each class in each bin of a joint color histogram (bins x bins x bins, in the chosen
+    color space) and labels each bin with the class that is most likely to have colors in that bin. Bins without
+    training pixels get the label of the nearest bin with training pixels. The model is written as a NumPy archive.
+
+    :param imgdir: str
+    :param classes: list
+    :param outfile: str
+    :param colorspace: str
+    :param bins: int
+    :param cpu: int
+    :return:
+    :raises: ValueError
+    """
+    from scipy import ndimage
+
+    # List the images that have a mask for at least one class
+    images = []
+    for (dirpath, dirnames, filenames) in os.walk(imgdir):
+        for filename in filenames:
+            # Is this an image type we can work with?
+            if filename[-3:] in ['png', 'jpg', 'jpeg']:
+                masks = [os.path.join(maskdir, filename) for cls, maskdir in classes]
+                if any([os.path.exists(mask) for mask in masks]):
+                    images.append((os.path.join(dirpath, filename), masks, colorspace, bins))
+
+    # Number of training pixels of each class (rows) in each color bin (columns)
+    counts = np.zeros((len(classes), bins ** 3), dtype=np.int64)
+    print("Reading " + str(len(images)) + " images...")
+    for image_counts in read_images(image_color_counts, images, cpu):
+        counts += image_counts
+
+    print("Calculating the lookup table...")
+    totals = np.sum(counts, axis=1)
+    for i, (cls, maskdir) in enumerate(classes):
+        if totals[i] == 0:
+            raise ValueError("There are no training pixels for the class {0}".format(cls))
+    # Probability of each color bin given the class, so that each class has the same weight whatever its number of
+    # training pixels
+    likelihood = counts / totals[:, np.newaxis].astype(np.float64)
+    lut = np.argmax(likelihood, axis=0).astype(np.uint8).reshape((bins, bins, bins))
+    # Label the bins without training pixels with the label of the nearest bin with training pixels
+    empty = np.sum(counts, axis=0).reshape((bins, bins, bins)) == 0
+    if np.any(empty):
+        nearest = ndimage.distance_transform_edt(empty, return_distances=False, return_indices=True)
+        lut = lut[tuple(nearest)]
+    print("{0} of {1} color bins have training pixels".format(np.sum(~empty), bins ** 3))
+
+    # The output file name is used as given (numpy.savez would add .npz to a file name)
+    out = open(outfile, "wb")
+    np.savez(out, classes=np.array([cls for cls, maskdir in classes]), colorspace=np.array(colorspace),
+             bins=np.array(bins), lut=lut)
+    out.close()
+
+
+def image_color_counts(image):
+    """Read an image and the masks of each class and count the pixels of each class in each color bin
+
+    :param image: tuple
+    :return counts: ndarray
+    """
+    img_file, masks, colorspace, bins = image
+    # Read the image as BGR and convert it to the color space of the lookup table
+    img = cv2.imread(img_file, 1)
+    if COLORSPACES[colorspace] is not None:
+        img = cv2.cvtColor(img, COLORSPACES[colorspace])
+    color_bins = quantize_colors(img, bins)
+
+    counts = np.zeros((len(masks), bins ** 3), dtype=np.int64)
+    for i, mask_file in enumerate(masks):
+        if os.path.exists(mask_file):
+            # Read the mask as grayscale
+            mask = cv2.imread(mask_file, 0)
+            counts[i] = np.bincount(color_bins[mask == 255], minlength=bins ** 3)
+
+    return counts
+
+
+def quantize_colors(img, bins):
+    """Index of the joint color bin of each pixel of a 3-channel 8-bit image
+
+    :param img: ndarray
+    :param bins: int
+    :return color_bins: ndarray
+    """
+    # Number of low bits dropped from each channel
+    shift = 8 - (int(bins).bit_length() - 1)
+    channels = [(channel >> shift).astype(np.int32) for channel in cv2.split(img)]
+
+    return (channels[0] * bins + channels[1]) * bins + channels[2]
+
+
 if __name__ == '__main__':
     main()
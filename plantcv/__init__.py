@@ -1,3 +1,8 @@
+import sys
+import types
+import pkgutil
+import importlib
+
 __all__ = ['fatal_error', 'print_image', 'plot_image', 'plot_colorbar', 'readimage', 'laplace_filter', 'sobel_filter',
            'scharr_filter', 'hist_equalization', 'plot_hist', 'image_add', 'image_subtract', 'erode', 'dilate',
            'watershed', 'rectangle_mask', 'rgb2gray_hsv', 'rgb2gray_lab', 'rgb2gray', 'binary_threshold',
@@ -8,67 +13,59 @@ __all__ = ['fatal_error', 'print_image', 'plot_image', 'plot_colorbar', 'readima
            'white_balance', 'triangle_auto_threshold', 'acute_vertex', 'scale_features', 'turgor_proxy',
            'x_axis_pseudolandmarks', 'y_axis_pseudolandmarks', 'gaussian_blur', 'cluster_contours',
            'cluster_contour_splitimg', 'rotate_img', 'shift_img', 'output_mask', 'auto_crop',
-           'background_subtraction', 'naive_bayes_classifier']
+           'background_subtraction', 'naive_bayes_classifier', 'read_results', 'color_lut_classifier',
+           'image_stack', 'fluor_fvfm_series', 'AnalysisImage', 'write_analysis_images',
+           'defer_analysis_images']
+
+# Function modules are imported on first use of the function (pcv.readimage or from plantcv import readimage), so
+# that importing plantcv does not load every module and its dependencies (e.g. scipy and scikit-image for watershed)
+# Most functions are defined in a module of the same name; the others are listed here
+_functions = dict((name, name) for name in __all__)
+del _functions['watershed']
+_functions['watershed_segmentation'] = 'watershed'
+_functions['output_mask'] = 'output_mask_ori_img'
+_functions['_pseudocolored_image'] = 'analyze_color'
+_functions['AnalysisImage'] = 'analysis_image'
+_functions['write_analysis_images'] = 'analysis_image'
+_functions['defer_analysis_images'] = 'analysis_image'
+
+_submodules = set(name for _, name, _ in pkgutil.iter_modules(__path__))
+
+
+class _LazyPackage(types.ModuleType):
+    """The plantcv package module, importing function modules when a function is first used."""
+
+    def __getattr__(self, name):
+        # Only called for names that are not set yet
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name in _functions:
+            module = importlib.import_module('.' + _functions[name], self.__name__)
+            value = getattr(module, name)
+        elif name in _submodules:
+            value = importlib.import_module('.' + name, self.__name__)
+        else:
+            raise AttributeError("'module' object has no attribute '{0}'".format(name))
+        setattr(self, name, value)
+        return value
+
+    def __getattribute__(self, name):
+        value = types.ModuleType.__getattribute__(self, name)
+        # The import system binds each imported submodule to the package (also when a module imports another one
+        # directly), replacing the function of the same name
+        if isinstance(value, types.ModuleType) and _functions.get(name) == name:
+            value = getattr(value, name)
+            self.__dict__[name] = value
+        return value
+
+    def __dir__(self):
+        return sorted(set(list(self.__dict__) + list(_functions) + list(_submodules)))
+
 
-from fatal_error import fatal_error
-from print_image import print_image
-from plot_image import plot_image
-from plot_colorbar import plot_colorbar
-from readimage import readimage
-from laplace_filter import laplace_filter
-from sobel_filter import sobel_filter
-from scharr_filter import scharr_filter
-from hist_equalization import hist_equalization
-from plot_hist import plot_hist
-from image_add import image_add
-from image_subtract import image_subtract
-from erode import erode
-from dilate import dilate
-from watershed import watershed_segmentation
-from rectangle_mask import rectangle_mask
-from rgb2gray_hsv import rgb2gray_hsv
-from rgb2gray_lab import rgb2gray_lab
-from rgb2gray import rgb2gray
-from binary_threshold import binary_threshold
-from median_blur import median_blur
-from fill import fill
-from invert import invert
-from logical_and import logical_and
-from logical_or import logical_or
-from logical_xor import logical_xor
-from apply_mask import apply_mask
-from find_objects import find_objects
-from define_roi import define_roi
-from roi_objects import roi_objects
-from object_composition import object_composition
-from analyze_object import analyze_object
-from analyze_bound import analyze_bound
-from analyze_color import analyze_color
-from analyze_NIR_intensity import analyze_NIR_intensity
-from fluor_fvfm import fluor_fvfm
-from print_results import print_results
-from resize import resize
-from flip import flip
-from crop_position_mask import crop_position_mask
-from get_nir import get_nir
-from adaptive_threshold import adaptive_threshold
-from otsu_auto_threshold import otsu_auto_threshold
-from report_size_marker_area import report_size_marker_area
-from white_balance import white_balance
-from triangle_auto_threshold import triangle_auto_threshold
-from acute_vertex import acute_vertex
-from scale_features import scale_features
-from turgor_proxy import turgor_proxy
-from x_axis_pseudolandmarks import x_axis_pseudolandmarks
-from y_axis_pseudolandmarks import y_axis_pseudolandmarks
-from gaussian_blur import gaussian_blur
-from cluster_contours import cluster_contours
-from cluster_contour_splitimg import cluster_contour_splitimg
-from rotate_img import rotate_img
-from shift_img import shift_img
-from output_mask_ori_img import output_mask
-from auto_crop import auto_crop
-from background_subtraction import background_subtraction
-from naive_bayes_classifier import naive_bayes_classifier
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(dict((key, value) for key, value in globals().items() if key.startswith('__')))
+# The original module is kept so that the globals of this file stay valid
+_package.__dict__['_module'] = sys.modules[__name__]
+sys.modules[__name__] = _package
 
-# add new functions to end of lists
+# add new functions to end of lists and, if the function is not defined in a module of the same name, to _functions
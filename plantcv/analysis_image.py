@@ -0,0 +1,97 @@
+# Analysis image that can be rendered when it is written
+
+from . import print_image
+
+# If True, analysis images are rendered when they are written instead of when they are made (see
+# defer_analysis_images)
+_deferred = False
+
+
+class AnalysisImage(object):
+    """Output image of an analysis function, rendered and saved to its file.
+
+    Analysis functions return their output images as rows of ['IMAGE', type, filename], with an AnalysisImage as the
+    filename. By default the image is rendered and saved when the AnalysisImage is made, so pipelines that write the
+    rows as tab-delimited text find the image in its file. If analysis images are deferred (see
+    defer_analysis_images), the image is only made when write() is called: by print_results, by write_analysis_images
+    or directly, so pipelines that do not write the image rows of an image do not pay for rendering it. A deferred
+    image is made from the arguments of the render function as they are when it is written (the input images are not
+    copied), so they should not be changed before then.
+
+    Inputs:
+    filename = name of the image file
+    render   = function that makes the image
+    args     = arguments of the render function
+
+    :param filename: str
+    :param render: function
+    :param args: list
+    """
+
+    def __init__(self, filename, render, *args):
+        self.filename = filename
+        self._render = render
+        self._args = args
+        if not _deferred:
+            self.write()
+
+    def write(self):
+        """Render the image and save it to its file, if that has not been done yet.
+
+        Returns:
+        filename = name of the image file
+
+        :return filename: str
+        """
+        if self._render is not None:
+            render, args = self._render, self._args
+            # The input images are released once the image is saved
+            self._render, self._args = None, None
+            print_image(render(*args), self.filename)
+
+        return self.filename
+
+    def __str__(self):
+        # The file name, without rendering the image
+        return str(self.filename)
+
+    def __repr__(self):
+        return 'AnalysisImage({0!r})'.format(self.filename)
+
+    def __reduce__(self):
+        # Stored (e.g. in a binary results file) as the file name, without rendering the image
+        return str, (str(self.filename),)
+
+
+def defer_analysis_images(deferred=True):
+    """Render the analysis images made after this call when they are written (with print_results,
+    write_analysis_images or AnalysisImage.write) instead of when they are made.
+
+    Pipelines that write only some of their image rows (or none) call this first. Pipelines that write the image rows
+    as text must write them with write_analysis_images.
+
+    Inputs:
+    deferred = if True analysis images are rendered when they are written, if False when they are made
+
+    :param deferred: bool
+    :return:
+    """
+    global _deferred
+    _deferred = bool(deferred)
+
+
+def write_analysis_images(analysis_images):
+    """Render and save the AnalysisImage file names of analysis image rows, for pipelines that write the rows to their
+    results file as text.
+
+    Inputs:
+    analysis_images = list of analysis image rows (['IMAGE', type, filename])
+
+    Returns:
+    analysis_images = list of analysis image rows, with the file names of the AnalysisImages written
+
+    :param analysis_images: list
+    :return analysis_images: list
+    """
+    return [[value.write() if isinstance(value, AnalysisImage) else value for value in row]
+            for row in analysis_images]
@@ -7,8 +7,11 @@ from . import print_image
 from . import plot_image
 from . import plot_colorbar
 from . import rgb2gray_hsv
-from . import binary_threshold
-from . import apply_mask
+from .analysis_image import AnalysisImage
+from .crop_context import mask_context, crop_image
+
+# Histogram bin of each pixel value and bin edges, by number of bins and value range (see _intensity_bins)
+_intensity_luts = {}
 
 
 def analyze_NIR_intensity(img, rgbimg, mask, bins, device, histplot=False, debug=None, filename=False):
@@ -47,10 +50,11 @@ def analyze_NIR_intensity(img, rgbimg, mask, bins, device, histplot=False, debug
 
     device += 1
 
-    # apply plant shaped mask to image
-    device, mask1 = binary_threshold(mask, 0, 255, 'light', device, None)
-    mask1 = (mask1 / 255)
-    masked = np.multiply(img, mask1)
+    # Pixels of the plant (mask pixels above 0), from the bounding box of the mask. Thresholding the mask is counted
+    # as a pipeline step, as when it was done with binary_threshold
+    device += 1
+    box = mask_context(mask)
+    plant = crop_image(img, box)[crop_image(mask, box) > 0]
 
     # calculate histogram
     if img.dtype == 'uint16':
@@ -58,7 +62,7 @@ def analyze_NIR_intensity(img, rgbimg, mask, bins, device, histplot=False, debug
     else:
         maxval = 256
 
-    hist_nir, hist_bins = np.histogram(masked, bins, (1, maxval), False, None, None)
+    hist_nir, hist_bins = _intensity_histogram(plant, bins, maxval)
 
     hist_bins1 = hist_bins[:-1]
     hist_bins2 = [l for l in hist_bins1]
@@ -66,7 +70,7 @@ def analyze_NIR_intensity(img, rgbimg, mask, bins, device, histplot=False, debug
     hist_nir1 = [l for l in hist_nir]
 
     # make hist percentage for plotting
-    pixels = cv2.countNonZero(mask1)
+    pixels = len(plant)
     hist_percent = (hist_nir / pixels) * 100
 
     # report histogram data
@@ -87,19 +91,11 @@ def analyze_NIR_intensity(img, rgbimg, mask, bins, device, histplot=False, debug
     analysis_img = []
 
     if filename is not False:
-        # make mask to select the background
-        mask_inv = cv2.bitwise_not(mask)
-        img_back = cv2.bitwise_and(rgbimg, rgbimg, mask=mask_inv)
-        img_back1 = cv2.applyColorMap(img_back, colormap=1)
-
-        # mask the background and color the plant with color scheme 'jet'
-        cplant = cv2.applyColorMap(rgbimg, colormap=2)
-        device, masked1 = apply_mask(cplant, mask, 'black', device, debug=None)
-        cplant_back = cv2.add(masked1, img_back1)
-
+        # The pseudocolored image is an AnalysisImage (rendered now, or when it is written if analysis images are
+        # deferred). Masking the pseudocolored plant is counted as a pipeline step, as when it was done with apply_mask
+        device += 1
         fig_name_pseudo = (str(filename[0:-4]) + '_nir_pseudo_col.jpg')
-        print_image(cplant_back, fig_name_pseudo)
-        analysis_img.append(['IMAGE', 'pseudo', fig_name_pseudo])
+        analysis_img.append(['IMAGE', 'pseudo', AnalysisImage(fig_name_pseudo, _pseudocolored_nir, rgbimg, mask)])
 
     if filename is not False and (histplot is True or debug is not None):
         import matplotlib
@@ -122,6 +118,7 @@ def analyze_NIR_intensity(img, rgbimg, mask, bins, device, histplot=False, debug
         if not os.path.isfile(path + '/' + fig_name):
             plot_colorbar(path, fig_name, bins)
 
+        masked1, cplant_back = _pseudocolored_nir(rgbimg, mask, plant=True)
         if debug == 'print':
             print_image(masked1, (str(device) + "_nir_pseudo_plant.jpg"))
             print_image(cplant_back, (str(device) + "_nir_pseudo_plant_back.jpg"))
@@ -130,3 +127,98 @@ def analyze_NIR_intensity(img, rgbimg, mask, bins, device, histplot=False, debug
             plot_image(cplant_back)
 
     return device, hist_header, hist_data, analysis_img
+
+
+def _intensity_histogram(pixels, bins, maxval):
+    """Histogram of pixel values, as np.histogram with bins bins over the range [1, maxval] counts them.
+
+    Unsigned 8- and 16-bit values are counted by value and the counts are summed into bins, without converting the
+    pixels; other types are counted with np.histogram.
+
+    Inputs:
+    pixels   = pixel values (1-D numpy array)
+    bins     = number of histogram bins
+    maxval   = upper end of the histogram range
+
+    Returns:
+    hist     = pixel count of each bin
+    edges    = bin edges (bins + 1)
+
+    :param pixels: numpy array
+    :param bins: int
+    :param maxval: int
+    :return hist: numpy array
+    :return edges: numpy array
+    """
+    if pixels.dtype != np.uint8 and pixels.dtype != np.uint16:
+        return np.histogram(pixels, bins, (1, maxval))
+
+    lut, edges = _intensity_bins(bins, maxval)
+    counts = np.bincount(pixels, minlength=maxval)
+    hist = np.bincount(lut, weights=counts, minlength=bins + 1)[:bins]
+
+    return hist.astype(np.intp), edges
+
+
+def _intensity_bins(bins, maxval):
+    """Histogram bin of each pixel value from 0 to maxval - 1, as np.histogram with bins bins over the range
+    [1, maxval] counts them, and the bin edges.
+
+    The bins are found with np.histogram itself (bins are runs of consecutive values), so that the histograms are the
+    same as those of np.histogram. The lookup table is made once for each number of bins and value range.
+
+    Inputs:
+    bins     = number of histogram bins
+    maxval   = upper end of the histogram range
+
+    Returns:
+    lut      = histogram bin of each value (numpy array of maxval bin indices; bins if the value is not counted)
+    edges    = bin edges (bins + 1)
+
+    :param bins: int
+    :param maxval: int
+    :return lut: numpy array
+    :return edges: numpy array
+    """
+    if (bins, maxval) not in _intensity_luts:
+        values = np.arange(maxval, dtype=np.uint16 if maxval > 256 else np.uint8)
+        values_per_bin, edges = np.histogram(values, bins, (1, maxval))
+        # Value 0 is below the range
+        lut = np.concatenate([[bins], np.repeat(np.arange(bins), values_per_bin)])
+        _intensity_luts[(bins, maxval)] = (lut, edges)
+
+    return _intensity_luts[(bins, maxval)]
+
+
+def _pseudocolored_nir(rgbimg, mask, plant=False):
+    """Pseudocolored NIR image: the plant colored with color scheme 'jet' on the background colored with color scheme
+    'bone'.
+
+    Inputs:
+    rgbimg      = RGB NIR image
+    mask        = mask made from selected contours
+    plant       = if True also return the pseudocolored plant on black
+
+    Returns:
+    masked1     = pseudocolored plant (if plant is True)
+    cplant_back = pseudocolored image
+
+    :param rgbimg: numpy array
+    :param mask: numpy array
+    :param plant: bool
+    :return masked1: numpy array
+    :return cplant_back: numpy array
+    """
+    # make mask to select the background
+    mask_inv = cv2.bitwise_not(mask)
+    img_back = cv2.bitwise_and(rgbimg, rgbimg, mask=mask_inv)
+    img_back1 = cv2.applyColorMap(img_back, colormap=1)
+
+    # mask the background and color the plant with color scheme 'jet'
+    cplant = cv2.applyColorMap(rgbimg, colormap=2)
+    masked1 = cv2.bitwise_and(cplant, cplant, mask=mask)
+    cplant_back = cv2.add(masked1, img_back1)
+
+    if plant:
+        return masked1, cplant_back
+    return cplant_back
@@ -4,6 +4,7 @@ import cv2
 import numpy as np
 from . import print_image
 from . import plot_image
+from .crop_context import FRAME_INSET, crop_context, crop_image
 
 
 def analyze_bound(img, imgname, obj, mask, line_position, device, debug=None, filename=False):
@@ -42,24 +43,21 @@ def analyze_bound(img, imgname, obj, mask, line_position, device, debug=None, fi
     """
 
     device += 1
-    ori_img = np.copy(img)
+    # Output images are only drawn if they are printed or plotted
+    draw = bool(filename) or debug is not None
+    if draw:
+        ori_img = np.copy(img)
 
     # Draw line horizontal line through bottom of image, that is adjusted to user input height
-    if len(np.shape(ori_img)) == 3:
-        iy, ix, iz = np.shape(ori_img)
+    if len(np.shape(img)) == 3:
+        iy, ix, iz = np.shape(img)
     else:
-        iy, ix = np.shape(ori_img)
-    size = (iy, ix)
+        iy, ix = np.shape(img)
     size1 = (iy, ix, 3)
-    background = np.zeros(size, dtype=np.uint8)
-    wback = (np.zeros(size1, dtype=np.uint8)) + 255
+    if draw:
+        wback = (np.zeros(size1, dtype=np.uint8)) + 255
     x_coor = int(ix)
     y_coor = int(iy) - int(line_position)
-    rec_corner = int(iy - 2)
-    rec_point1 = (1, rec_corner)
-    rec_point2 = (x_coor - 2, y_coor - 2)
-    cv2.rectangle(background, rec_point1, rec_point2, (255), 1)
-    below_contour, below_hierarchy = cv2.findContours(background, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
 
     x, y, width, height = cv2.boundingRect(obj)
 
@@ -75,28 +73,31 @@ def analyze_bound(img, imgname, obj, mask, line_position, device, debug=None, fi
             height_above_bound = y_coor - y
             height_below_bound = height - height_above_bound
 
-    below = []
-    above = []
-    mask_nonzerox, mask_nonzeroy = np.nonzero(mask)
-    obj_points = np.vstack((mask_nonzeroy, mask_nonzerox))
-    obj_points1 = np.transpose(obj_points)
-
-    for i, c in enumerate(obj_points1):
-        xy = tuple(c)
-        pptest = cv2.pointPolygonTest(below_contour[0], xy, measureDist=False)
-        if pptest == 1:
-            below.append(xy)
-            cv2.circle(ori_img, xy, 1, (0, 0, 255))
-            cv2.circle(wback, xy, 1, (0, 0, 255))
-        else:
-            above.append(xy)
-            cv2.circle(ori_img, xy, 1, (0, 255, 0))
-            cv2.circle(wback, xy, 1, (0, 255, 0))
-    above_bound_area = len(above)
-    below_bound_area = len(below)
+    # Object pixels below the boundary line are those inside the outline of a rectangle from 2 pixels above the line
+    # to 2 pixels above the bottom of the image and from 1 pixel from the left to 2 pixels from the right side. If the
+    # outline is not closed inside the image frame (the line is outside the image) no pixels are below
+    top, bottom = sorted([y_coor - 2, iy - 2])
+    if top < FRAME_INSET or bottom > iy - 1 - FRAME_INSET:
+        top, bottom = 0, 1
+    below_rows = slice(top + 1, bottom)
+    below_cols = slice(2, max(ix - 2, 2))
+    obj_area = cv2.countNonZero(mask)
+    below_bound_area = cv2.countNonZero(mask[below_rows, below_cols])
+    above_bound_area = obj_area - below_bound_area
     percent_bound_area_above = ((float(above_bound_area)) / (float(above_bound_area + below_bound_area))) * 100
     percent_bound_area_below = ((float(below_bound_area)) / (float(above_bound_area + below_bound_area))) * 100
 
+    # Mark the object pixels above (green) and below (red) the line
+    if draw and obj_area:
+        mask_y, mask_x = np.nonzero(mask)
+        box = crop_context([np.transpose((mask_x, mask_y))], size1)
+        below = np.zeros(size1[:2], dtype=bool)
+        below[below_rows, below_cols] = True
+        below = crop_image(below, box)
+        obj = crop_image(mask, box) != 0
+        for out_img in [ori_img, wback]:
+            _draw_points(crop_image(out_img, box), obj & ~below, (0, 255, 0), obj & below, (0, 0, 255))
+
     bound_header = [
         'HEADER_BOUNDARY' + str(line_position),
         'height_above_bound',
@@ -119,7 +120,7 @@ def analyze_bound(img, imgname, obj, mask, line_position, device, debug=None, fi
 
     analysis_images = []
 
-    if above_bound_area or below_bound_area:
+    if (above_bound_area or below_bound_area) and filename:
         point3 = (0, y_coor - 4)
         point4 = (x_coor, y_coor - 4)
         cv2.line(ori_img, point3, point4, (255, 0, 255), 5)
@@ -139,13 +140,12 @@ def analyze_bound(img, imgname, obj, mask, line_position, device, debug=None, fi
                 cv2.line(ori_img, (int(cmx), y_coor - 2), (int(cmx), y_coor + height_below_bound), (0, 255, 0), 3)
                 cv2.line(wback, (int(cmx), y_coor - 2), (int(cmx), y_coor - height_above_bound), (255, 0, 0), 3)
                 cv2.line(wback, (int(cmx), y_coor - 2), (int(cmx), y_coor + height_below_bound), (0, 255, 0), 3)
-        if filename:
-            # Output images with boundary line, above/below bound area
-            extention = filename.split('.')[-1]
-            # out_file = str(filename[0:-4]) + '_boundary' + str(line_position) + '.' + extention
-            out_file = str(filename[0:-4]) + '_boundary' + str(line_position) + '.jpg'
-            print_image(ori_img, out_file)
-            analysis_images = ['IMAGE', 'boundary', out_file]
+        # Output images with boundary line, above/below bound area
+        extention = filename.split('.')[-1]
+        # out_file = str(filename[0:-4]) + '_boundary' + str(line_position) + '.' + extention
+        out_file = str(filename[0:-4]) + '_boundary' + str(line_position) + '.jpg'
+        print_image(ori_img, out_file)
+        analysis_images = ['IMAGE', 'boundary', out_file]
 
     if debug is not None:
         point3 = (0, y_coor - 4)
@@ -175,3 +175,37 @@ def analyze_bound(img, imgname, obj, mask, line_position, device, debug=None, fi
             plot_image(ori_img)
 
     return device, bound_header, bound_data, analysis_images
+
+
+def _draw_points(img, points1, color1, points2, color2):
+    """Draw a circle with a radius of 1 pixel around every point of two sets of points, in raster order of the points
+    (as cv2.circle would, one point after another).
+
+    Inputs:
+    img      = image to draw on
+    points1  = first set of points (boolean image)
+    color1   = color of the first set of points
+    points2  = second set of points (boolean image, disjoint from the first)
+    color2   = color of the second set of points
+
+    :param img: numpy array
+    :param points1: numpy array
+    :param color1: tuple
+    :param points2: numpy array
+    :param color2: tuple
+    :return:
+    """
+    # Pixels of a circle with a radius of 1 pixel, relative to its center
+    circle = np.zeros((3, 3), dtype=np.uint8)
+    cv2.circle(circle, (1, 1), 1, (255))
+    height, width = np.shape(points1)
+    # A pixel is drawn last by the last point in raster order that has it on its circle, so the circle pixels are
+    # drawn from the first to the last of the pixels that are drawn from points later in raster order
+    for dy, dx in sorted(np.argwhere(circle) - 1, key=tuple, reverse=True):
+        dst = img[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)]
+        src = (slice(max(-dy, 0), height - max(dy, 0)), slice(max(-dx, 0), width - max(dx, 0)))
+        for points, color in [(points1, color1), (points2, color2)]:
+            if len(np.shape(img)) == 3:
+                dst[points[src]] = color
+            else:
+                dst[points[src]] = color[0]
@@ -7,14 +7,26 @@ from . import print_image
 from . import plot_image
 from . import fatal_error
 from . import plot_colorbar
+from .crop_context import mask_context, crop_image
+from .analysis_image import AnalysisImage
+
+# Color space conversion from BGR and channel index of each pseudocolor channel
+PSEUDO_CHANNELS = {'l': (cv2.COLOR_BGR2LAB, 0), 'm': (cv2.COLOR_BGR2LAB, 1), 'y': (cv2.COLOR_BGR2LAB, 2),
+                   'h': (cv2.COLOR_BGR2HSV, 0), 's': (cv2.COLOR_BGR2HSV, 1), 'v': (cv2.COLOR_BGR2HSV, 2)}
+
+# Histogram bin of each 8-bit channel value, by number of bins (see _histogram_lut)
+_histogram_luts = {}
 
 
 def _pseudocolored_image(device, histogram, bins, img, mask, background, channel, filename, resolution,
                          analysis_images, debug):
     """Pseudocolor image.
 
+    The output image (filename) is an AnalysisImage, rendered when it is made or, if analysis images are deferred,
+    when its analysis image row is written.
+
     Inputs:
-    histogram       = a normalized histogram of color values from one color channel
+    histogram       = channel image divided into color bins, or a function that returns it when the image is rendered
     bins            = number of color bins the channel is divided into
     img             = input image
     mask            = binary mask image
@@ -28,7 +40,7 @@ def _pseudocolored_image(device, histogram, bins, img, mask, background, channel
     Returns:
     analysis_images = list of analysis image filenames
 
-    :param histogram: list
+    :param histogram: numpy array
     :param bins: int
     :param img: numpy array
     :param mask: numpy array
@@ -39,7 +51,46 @@ def _pseudocolored_image(device, histogram, bins, img, mask, background, channel
     :param analysis_images: list
     :return analysis_images: list
     """
-   
+    if filename:
+        fig_name_pseudo = str(filename[0:-4]) + '_' + str(channel) + '_pseudo_on_' + str(background) + '.jpg'
+        path = os.path.dirname(filename)
+        analysis_images.append(['IMAGE', 'pseudo', AnalysisImage(fig_name_pseudo, _pseudocolor_composite, histogram,
+                                                                 img, mask, background)])
+
+    if debug is not None:
+        cplant_back = _pseudocolor_composite(histogram, img, mask, background)
+        if debug == 'print':
+            print_image(cplant_back, (str(device) + '_pseudocolor.jpg'))
+            fig_name = 'VIS_pseudocolor_colorbar_' + str(channel) + '_channel.svg'
+            if not os.path.isfile(path + '/' + fig_name):
+                plot_colorbar(path, fig_name, bins)
+        elif debug == 'plot':
+            plot_image(cplant_back)
+
+    return analysis_images
+
+
+def _pseudocolor_composite(histogram, img, mask, background):
+    """Pseudocolored channel image of the object pixels, on the grayscale image or on white.
+
+    Inputs:
+    histogram  = channel image divided into color bins, or a function that returns it
+    img        = input image
+    mask       = binary mask image
+    background = what background image?: channel image (img) or white
+
+    Returns:
+    cplant_back = pseudocolored image
+
+    :param histogram: numpy array
+    :param img: numpy array
+    :param mask: numpy array
+    :param background: str
+    :return cplant_back: numpy array
+    """
+    if callable(histogram):
+        histogram = histogram()
+
     # Get the image size
     if np.shape(img)[2] == 3:
         ix, iy, iz = np.shape(img)
@@ -69,22 +120,33 @@ def _pseudocolored_image(device, histogram, bins, img, mask, background, channel
         img_back3 = cv2.bitwise_and(w_back3, w_back3, mask=mask_inv)
         cplant_back = cv2.add(cplant1, img_back3)
 
-    if filename:
-        fig_name_pseudo = str(filename[0:-4]) + '_' + str(channel) + '_pseudo_on_' + str(background) + '.jpg'
-        path = os.path.dirname(filename)
-        print_image(cplant_back, fig_name_pseudo)
-        analysis_images.append(['IMAGE', 'pseudo', fig_name_pseudo])
-        
-    if debug is not None:
-        if debug == 'print':
-            print_image(cplant_back, (str(device) + '_pseudocolor.jpg'))
-            fig_name = 'VIS_pseudocolor_colorbar_' + str(channel) + '_channel.svg'
-            if not os.path.isfile(path + '/' + fig_name):
-                plot_colorbar(path, fig_name, bins)
-        elif debug == 'plot':
-            plot_image(cplant_back)
+    return cplant_back
 
-    return analysis_images
+
+def _pseudocolor_channel(img, mask, channel, bins):
+    """Channel image of the masked image, divided into color bins.
+
+    Inputs:
+    img      = input image (BGR)
+    mask     = binary mask image
+    channel  = pseudocolor channel name (see PSEUDO_CHANNELS)
+    bins     = number of color bins the channel is divided into
+
+    Returns:
+    channel_bin = channel image divided into color bins
+
+    :param img: numpy array
+    :param mask: numpy array
+    :param channel: str
+    :param bins: int
+    :return channel_bin: numpy array
+    """
+    colorspace, index = PSEUDO_CHANNELS[channel]
+    masked = cv2.bitwise_and(img, img, mask=mask)
+    if colorspace is not None:
+        masked = cv2.cvtColor(masked, colorspace)
+
+    return cv2.split(masked)[index] // (256 // bins)
 
 
 def analyze_color(img, imgname, mask, bins, device, debug=None, hist_plot_type=None, pseudo_channel='v',
@@ -127,46 +189,11 @@ def analyze_color(img, imgname, mask, bins, device, debug=None, hist_plot_type=N
     :return analysis_images: list
     """
     device += 1
-    if len(np.shape(img)) == 3:
-        ix, iy, iz = np.shape(img)
-    else:
-        ix, iy = np.shape(img)
-    size = ix, iy
-    background = np.zeros(size, dtype=np.uint8)
-    w_back = background + 255
-    ori_img = np.copy(img)
-
-    masked = cv2.bitwise_and(img, img, mask=mask)
-    b, g, r = cv2.split(masked)
-    lab = cv2.cvtColor(masked, cv2.COLOR_BGR2LAB)
-    l, m, y = cv2.split(lab)
-    hsv = cv2.cvtColor(masked, cv2.COLOR_BGR2HSV)
-    h, s, v = cv2.split(hsv)
-
-    channel = (b, g, r, l, m, y, h, s, v)
     graph_color = ('blue', 'forestgreen', 'red', 'dimgray', 'magenta', 'yellow', 'blueviolet', 'cyan', 'orange')
     label = ('blue', 'green', 'red', 'lightness', 'green-magenta', 'blue-yellow', 'hue', 'saturation', 'value')
 
     # Create Color Histogram Data
-    b_bin = b / (256 / bins)
-    g_bin = g / (256 / bins)
-    r_bin = r / (256 / bins)
-    l_bin = l / (256 / bins)
-    m_bin = m / (256 / bins)
-    y_bin = y / (256 / bins)
-    h_bin = h / (256 / bins)
-    s_bin = s / (256 / bins)
-    v_bin = v / (256 / bins)
-
-    hist_b = cv2.calcHist([b_bin], [0], mask, [bins], [0, (bins - 1)])
-    hist_g = cv2.calcHist([g_bin], [0], mask, [bins], [0, (bins - 1)])
-    hist_r = cv2.calcHist([r_bin], [0], mask, [bins], [0, (bins - 1)])
-    hist_l = cv2.calcHist([l_bin], [0], mask, [bins], [0, (bins - 1)])
-    hist_m = cv2.calcHist([m_bin], [0], mask, [bins], [0, (bins - 1)])
-    hist_y = cv2.calcHist([y_bin], [0], mask, [bins], [0, (bins - 1)])
-    hist_h = cv2.calcHist([h_bin], [0], mask, [bins], [0, (bins - 1)])
-    hist_s = cv2.calcHist([s_bin], [0], mask, [bins], [0, (bins - 1)])
-    hist_v = cv2.calcHist([v_bin], [0], mask, [bins], [0, (bins - 1)])
+    hist_b, hist_g, hist_r, hist_l, hist_m, hist_y, hist_h, hist_s, hist_v = _color_histograms(img, mask, bins)
 
     hist_data_b = [l[0] for l in hist_b]
     hist_data_g = [l[0] for l in hist_g]
@@ -218,59 +245,24 @@ def analyze_color(img, imgname, mask, bins, device, debug=None, hist_plot_type=N
 
     if p_channel is None:
         pass
-    elif p_channel == 'h':
-        if pseudo_bkg == 'white' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, h_bin, bins, img, mask, 'white', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-        if pseudo_bkg == 'img' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, h_bin, bins, img, mask, 'img', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-    elif p_channel == 's':
-        if pseudo_bkg == 'white' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, s_bin, bins, img, mask, 'white', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-        if pseudo_bkg == 'img' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, s_bin, bins, img, mask, 'img', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-    elif p_channel == 'v':
-        if pseudo_bkg == 'white' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, v_bin, bins, img, mask, 'white', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-        if pseudo_bkg == 'img' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, v_bin, bins, img, mask, 'img', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-    elif p_channel == 'l':
-        if pseudo_bkg == 'white' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, l_bin, bins, img, mask, 'white', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-        if pseudo_bkg == 'img' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, l_bin, bins, img, mask, 'img', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-    elif p_channel == 'm':
-        if pseudo_bkg == 'white' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, m_bin, bins, img, mask, 'white', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-        if pseudo_bkg == 'img' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, m_bin, bins, img, mask, 'img', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-    elif p_channel == 'y':
-        if pseudo_bkg == 'white' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, y_bin, bins, img, mask, 'white', p_channel, filename,
-                                                   resolution, analysis_images, debug)
-
-        if pseudo_bkg == 'img' or pseudo_bkg == 'both':
-            analysis_images = _pseudocolored_image(device, y_bin, bins, img, mask, 'img', p_channel, filename,
-                                                   resolution, analysis_images, debug)
+    elif p_channel in PSEUDO_CHANNELS:
+        # The pseudocolored images are only made if they are printed, plotted or written to their output files. The
+        # channel image is made once, when the first of them is rendered
+        if filename or debug is not None:
+            channel_images = []
+
+            def channel_bin():
+                if not channel_images:
+                    channel_images.append(_pseudocolor_channel(img, mask, p_channel, bins))
+                return channel_images[0]
+
+            if pseudo_bkg == 'white' or pseudo_bkg == 'both':
+                analysis_images = _pseudocolored_image(device, channel_bin, bins, img, mask, 'white', p_channel,
+                                                       filename, resolution, analysis_images, debug)
+
+            if pseudo_bkg == 'img' or pseudo_bkg == 'both':
+                analysis_images = _pseudocolored_image(device, channel_bin, bins, img, mask, 'img', p_channel,
+                                                       filename, resolution, analysis_images, debug)
 
     else:
         fatal_error('Pseudocolor Channel' + str(pseudo_channel) + ' is not "None", "l","m", "y", "h","s" or "v"!')
@@ -328,3 +320,72 @@ def analyze_color(img, imgname, mask, bins, device, debug=None, hist_plot_type=N
             plt.clf()
 
     return device, hist_header, hist_data, analysis_images
+
+
+def _color_histograms(img, mask, bins):
+    """Histograms of the blue, green, red, lightness, green-magenta, blue-yellow, hue, saturation and value channels of
+    the object pixels of an image.
+
+    Only the pixels in the mask are converted to LAB and HSV. The pixels are counted by channel value, and the counts
+    of all channels are summed into bins at once, as cv2.calcHist divides the values into bins with the range
+    [0, bins - 1] (see _histogram_lut).
+
+    Inputs:
+    img      = image (BGR)
+    mask     = binary mask of the object pixels
+    bins     = number of histogram bins
+
+    Returns:
+    hists    = histograms (numpy array, 9 x bins x 1 pixel counts, as returned by cv2.calcHist)
+
+    :param img: numpy array
+    :param mask: numpy array
+    :param bins: int
+    :return hists: numpy array
+    """
+    # Object pixels, from the bounding box of the mask
+    box = mask_context(mask)
+    pixels = np.compress(crop_image(mask, box).ravel() != 0, crop_image(img, box).reshape(-1, 3), axis=0)
+    if len(pixels):
+        pixels = pixels.reshape(-1, 1, 3)
+        colorspaces = [pixels, cv2.cvtColor(pixels, cv2.COLOR_BGR2LAB), cv2.cvtColor(pixels, cv2.COLOR_BGR2HSV)]
+        counts = np.vstack([cv2.calcHist([cs], [i], None, [256], [0, 256]) for cs in colorspaces for i in range(3)])
+    else:
+        counts = np.zeros((9 * 256, 1), dtype=np.float32)
+
+    # Sum the counts of the channel values into bins, each channel with its own range of bins plus one for the values
+    # that are outside the histogram
+    channel_bins = (_histogram_lut(bins) + np.arange(9).reshape(9, 1) * (bins + 1)).ravel()
+    hists = np.bincount(channel_bins, weights=counts.ravel(), minlength=9 * (bins + 1)).reshape(9, bins + 1)[:, :bins]
+
+    return hists.astype(np.float32).reshape(9, bins, 1)
+
+
+def _histogram_lut(bins):
+    """Histogram bin of each 8-bit channel value, for channel values divided by 256 / bins (integer division) and
+    counted by cv2.calcHist with bins bins over the range [0, bins - 1].
+
+    The bins are found with cv2.calcHist itself, which leaves values out at the end of the range, so that the
+    histograms are the same as those of cv2.calcHist. The lookup table is made once for each number of bins.
+
+    Inputs:
+    bins     = number of histogram bins
+
+    Returns:
+    lut      = histogram bin of each channel value (numpy array of 256 bin indices; bins if the value is not counted)
+
+    :param bins: int
+    :return lut: numpy array
+    """
+    if bins not in _histogram_luts:
+        with np.errstate(divide='ignore'):
+            values = np.arange(256, dtype=np.uint8) // (256 // bins)
+        lut = np.zeros(256, dtype=np.intp) + bins
+        for value in np.unique(values):
+            hist = cv2.calcHist([np.array([[value]], dtype=values.dtype)], [0], None, [bins], [0, (bins - 1)])
+            counted = np.flatnonzero(hist)
+            if len(counted):
+                lut[values == value] = counted[0]
+        _histogram_luts[bins] = lut
+
+    return _histogram_luts[bins]
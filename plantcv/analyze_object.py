@@ -4,6 +4,7 @@ import cv2
 import numpy as np
 from . import print_image
 from . import plot_image
+from .crop_context import FRAME_INSET, crop_context
 
 
 def analyze_object(img, imgname, obj, mask, device, debug=None, filename=False):
@@ -40,28 +41,16 @@ def analyze_object(img, imgname, obj, mask, device, debug=None, filename=False):
     if len(obj) < 5:
         return device, None, None, None
 
-    ori_img = np.copy(img)
     if len(np.shape(img)) == 3:
         ix, iy, iz = np.shape(img)
     else:
         ix, iy = np.shape(img)
-    size = ix, iy, 3
     size1 = ix, iy
-    background = np.zeros(size, dtype=np.uint8)
-    background1 = np.zeros(size1, dtype=np.uint8)
-    background2 = np.zeros(size1, dtype=np.uint8)
-
-    # Check is object is touching image boundaries (QC)
-    frame_background = np.zeros(size1, dtype=np.uint8)
-    frame = frame_background + 1
-    frame_contour, frame_heirarchy = cv2.findContours(frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-    ptest = []
+
+    # Check is object is touching image boundaries (QC): every point must be inside the image frame contour
     vobj = np.vstack(obj)
-    for i, c in enumerate(vobj):
-        xy = tuple(c)
-        pptest = cv2.pointPolygonTest(frame_contour[0], xy, measureDist=False)
-        ptest.append(pptest)
-    in_bounds = all(c == 1 for c in ptest)
+    in_bounds = bool(np.all((vobj[:, 0] > FRAME_INSET) & (vobj[:, 0] < iy - 1 - FRAME_INSET) &
+                            (vobj[:, 1] > FRAME_INSET) & (vobj[:, 1] < ix - 1 - FRAME_INSET)))
 
     # Convex Hull
     hull = cv2.convexHull(obj)
@@ -94,25 +83,14 @@ def analyze_object(img, imgname, obj, mask, device, debug=None, filename=False):
         minor_axis_length = axes[minor_axis]
         eccentricity = np.sqrt(1 - (axes[minor_axis] / axes[major_axis]) ** 2)
 
-        # Longest Axis: line through center of mass and point on the convex hull that is furthest away
-        cv2.circle(background, (int(cmx), int(cmy)), 4, (255, 255, 255), -1)
-        center_p = cv2.cvtColor(background, cv2.COLOR_BGR2GRAY)
-        ret, centerp_binary = cv2.threshold(center_p, 0, 255, cv2.THRESH_BINARY)
-        centerpoint, cpoint_h = cv2.findContours(centerp_binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-
-        dist = []
+        # Longest Axis: line through center of mass and point on the convex hull that is furthest away (from the
+        # outline of a filled circle of radius 4 at the center of mass)
+        caliper_mid_x, caliper_mid_y = [int(cmx), int(cmy)]
         vhull = np.vstack(hull)
-
-        for i, c in enumerate(vhull):
-            xy = tuple(c)
-            pptest = cv2.pointPolygonTest(centerpoint[0], xy, measureDist=True)
-            dist.append(pptest)
-
-        abs_dist = np.absolute(dist)
+        abs_dist = _contour_distance(vhull, _centerpoint_contour(caliper_mid_x, caliper_mid_y, iy, ix))
         max_i = np.argmax(abs_dist)
 
         caliper_max_x, caliper_max_y = list(tuple(vhull[max_i]))
-        caliper_mid_x, caliper_mid_y = [int(cmx), int(cmy)]
 
         xdiff = float(caliper_max_x - caliper_mid_x)
         ydiff = float(caliper_max_y - caliper_mid_y)
@@ -123,55 +101,50 @@ def analyze_object(img, imgname, obj, mask, device, debug=None, filename=False):
             slope = 1
         b_line = caliper_mid_y - (slope * caliper_mid_x)
 
+        # End points of the line across the image
         if slope == 0:
             xintercept = 0
             xintercept1 = 0
             yintercept = 'none'
             yintercept1 = 'none'
-            cv2.line(background1, (iy, caliper_mid_y), (0, caliper_mid_y), (255), 1)
+            line_ends = (iy, caliper_mid_y), (0, caliper_mid_y)
         else:
             xintercept = int(-b_line / slope)
             xintercept1 = int((ix - b_line) / slope)
             yintercept = 'none'
             yintercept1 = 'none'
             if 0 <= xintercept <= iy and 0 <= xintercept1 <= iy:
-                cv2.line(background1, (xintercept1, ix), (xintercept, 0), (255), 1)
+                line_ends = (xintercept1, ix), (xintercept, 0)
             elif xintercept < 0 or xintercept > iy or xintercept1 < 0 or xintercept1 > iy:
                 if xintercept < 0 and 0 <= xintercept1 <= iy:
                     yintercept = int(b_line)
-                    cv2.line(background1, (0, yintercept), (xintercept1, ix), (255), 1)
+                    line_ends = (0, yintercept), (xintercept1, ix)
                 elif xintercept > iy and 0 <= xintercept1 <= iy:
                     yintercept1 = int((slope * iy) + b_line)
-                    cv2.line(background1, (iy, yintercept1), (xintercept1, ix), (255), 1)
+                    line_ends = (iy, yintercept1), (xintercept1, ix)
                 elif 0 <= xintercept <= iy and xintercept1 < 0:
                     yintercept = int(b_line)
-                    cv2.line(background1, (0, yintercept), (xintercept, 0), (255), 1)
+                    line_ends = (0, yintercept), (xintercept, 0)
                 elif 0 <= xintercept <= iy and xintercept1 > iy:
                     yintercept1 = int((slope * iy) + b_line)
-                    cv2.line(background1, (iy, yintercept1), (xintercept, 0), (255), 1)
+                    line_ends = (iy, yintercept1), (xintercept, 0)
                 else:
                     yintercept = int(b_line)
                     yintercept1 = int((slope * iy) + b_line)
-                    cv2.line(background1, (0, yintercept), (iy, yintercept1), (255), 1)
-
-        ret1, line_binary = cv2.threshold(background1, 0, 255, cv2.THRESH_BINARY)
-        # print_image(line_binary,(str(device)+'_caliperfit.png'))
-
-        cv2.drawContours(background2, [hull], -1, (255), -1)
-        ret2, hullp_binary = cv2.threshold(background2, 0, 255, cv2.THRESH_BINARY)
-        # print_image(hullp_binary,(str(device)+'_hull.png'))
-
-        caliper = cv2.multiply(line_binary, hullp_binary)
-        # print_image(caliper,(str(device)+'_caliperlength.png'))
-
-        caliper_y, caliper_x = np.array(caliper.nonzero())
-        caliper_matrix = np.vstack((caliper_x, caliper_y))
-        caliper_transpose = np.transpose(caliper_matrix)
-        caliper_length = len(caliper_transpose)
+                    line_ends = (0, yintercept), (iy, yintercept1)
+
+        # Caliper: pixels of the line (as drawn by cv2.line) inside the filled convex hull. The hull is drawn in a
+        # buffer the size of its bounding box
+        hull_box = crop_context([hull], size1, pad=0)
+        hull_binary = np.zeros((hull_box[3], hull_box[2]), dtype=np.uint8)
+        cv2.drawContours(hull_binary, [hull], -1, (255), -1, offset=(-hull_box[0], -hull_box[1]))
+        caliper_x, caliper_y = _line_pixels(line_ends, iy, ix, hull_box)
+        inside = hull_binary[caliper_y - hull_box[1], caliper_x - hull_box[0]] != 0
+        caliper_x, caliper_y = caliper_x[inside], caliper_y[inside]
+        caliper_length = len(caliper_x)
 
         caliper_transpose1 = np.lexsort((caliper_y, caliper_x))
-        caliper_transpose2 = [(caliper_x[i], caliper_y[i]) for i in caliper_transpose1]
-        caliper_transpose = np.array(caliper_transpose2)
+        caliper_transpose = np.transpose([caliper_x[caliper_transpose1], caliper_y[caliper_transpose1]])
 
     # else:
     #  hull_area, solidity, perimeter, width, height, cmx, cmy = 'ND', 'ND', 'ND', 'ND', 'ND', 'ND', 'ND'
@@ -222,6 +195,8 @@ def analyze_object(img, imgname, obj, mask, device, debug=None, filename=False):
     analysis_images = []
 
     # Draw properties
+    if (area and filename) or debug is not None:
+        ori_img = np.copy(img)
     if area and filename:
         cv2.drawContours(ori_img, obj, -1, (255, 0, 0), 3)
         cv2.drawContours(ori_img, [hull], -1, (0, 0, 255), 3)
@@ -260,3 +235,111 @@ def analyze_object(img, imgname, obj, mask, device, debug=None, filename=False):
                 plot_image(ori_img, cmap='gray')
 
     return device, shape_header, shape_data, analysis_images
+
+
+def _centerpoint_contour(cx, cy, width, height):
+    """Contour of a filled circle of radius 4 drawn at a point of an image, found in a patch around the point.
+
+    Inputs:
+    cx       = x-coordinate of the center
+    cy       = y-coordinate of the center
+    width    = image width
+    height   = image height
+
+    Returns:
+    contour  = circle contour (image coordinates)
+
+    :param cx: int
+    :param cy: int
+    :param width: int
+    :param height: int
+    :return contour: numpy array
+    """
+    # The patch has a 1-pixel margin around the circle, except at the image edges where the circle is cut off
+    x0, y0 = max(cx - 5, 0), max(cy - 5, 0)
+    patch = np.zeros((min(cy + 6, height) - y0, min(cx + 6, width) - x0), dtype=np.uint8)
+    cv2.circle(patch, (cx - x0, cy - y0), 4, (255), -1)
+    contours = cv2.findContours(patch, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2]
+
+    return np.vstack(contours[0]) + (x0, y0)
+
+
+def _contour_distance(points, contour):
+    """Distance from points to the nearest edge of a closed contour (the absolute value of cv2.pointPolygonTest).
+
+    Inputs:
+    points   = point coordinates (N x 2)
+    contour  = contour coordinates (M x 2)
+
+    Returns:
+    dist     = distance of each point
+
+    :param points: numpy array
+    :param contour: numpy array
+    :return dist: numpy array
+    """
+    # Edges from the previous vertex (v0) to each vertex (v), and the vectors from both ends to each point
+    v = contour.astype(np.float64)
+    v0 = np.roll(v, 1, axis=0)
+    dx, dy = v[:, 0] - v0[:, 0], v[:, 1] - v0[:, 1]
+    p = points.astype(np.float64)
+    dx1, dy1 = p[:, 0:1] - v0[:, 0], p[:, 1:2] - v0[:, 1]
+    dx2, dy2 = p[:, 0:1] - v[:, 0], p[:, 1:2] - v[:, 1]
+
+    # Squared distance to the nearest end point, or to the edge line if the point projects onto the edge
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = np.where(dx1 * dx + dy1 * dy <= 0, dx1 * dx1 + dy1 * dy1,
+                        np.where(dx2 * dx + dy2 * dy >= 0, dx2 * dx2 + dy2 * dy2,
+                                 (dy1 * dx - dx1 * dy) ** 2 / (dx * dx + dy * dy)))
+
+    return np.sqrt(np.min(dist, axis=1))
+
+
+def _line_pixels(line_ends, width, height, box):
+    """Pixels of a line drawn across an image with cv2.line (thickness 1, 8-connected) that are inside a rectangle.
+
+    Inputs:
+    line_ends = line end points ((x1, y1), (x2, y2))
+    width     = image width
+    height    = image height
+    box       = rectangle (x, y, width, height)
+
+    Returns:
+    line_x    = x-coordinates of the pixels
+    line_y    = y-coordinates of the pixels
+
+    :param line_ends: tuple
+    :param width: int
+    :param height: int
+    :param box: tuple
+    :return line_x: numpy array
+    :return line_y: numpy array
+    """
+    # Clip the line to the image as cv2.line does, then step along the major axis from left to right (Bresenham)
+    ret, pt1, pt2 = cv2.clipLine((0, 0, width, height), line_ends[0], line_ends[1])
+    if not ret:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    (x1, y1), (x2, y2) = sorted([tuple(pt1), tuple(pt2)])
+    dx = x2 - x1
+    dy = abs(y2 - y1)
+    ystep = -1 if y2 < y1 else 1
+    if dy > dx:
+        start, step, major, minor, low, high = y1, ystep, dy, dx, box[1], box[1] + box[3] - 1
+    else:
+        start, step, major, minor, low, high = x1, 1, dx, dy, box[0], box[0] + box[2] - 1
+
+    # Steps of the line inside the rectangle along the major axis
+    first, last = sorted([(low - start) * step, (high - start) * step])
+    i = np.arange(max(first, 0), min(last, major) + 1, dtype=np.int64)
+    if major > 0:
+        j = (2 * minor * i + major - 1) // (2 * major)
+    else:
+        j = i
+    if dy > dx:
+        line_x, line_y = x1 + j, y1 + ystep * i
+    else:
+        line_x, line_y = x1 + i, y1 + ystep * j
+
+    inside = (line_x >= box[0]) & (line_x < box[0] + box[2]) & (line_y >= box[1]) & (line_y < box[1] + box[3])
+
+    return line_x[inside], line_y[inside]
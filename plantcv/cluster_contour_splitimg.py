@@ -4,6 +4,7 @@ from datetime import datetime
 from . import print_image
 from . import plot_image
 from . import apply_mask
+from .crop_context import crop_context, uncrop_image
 
 
 def cluster_contour_splitimg(device, img, grouped_contour_indexes, contours, outdir=None, file=None,
@@ -114,19 +115,17 @@ def cluster_contour_splitimg(device, img, grouped_contour_indexes, contours, out
             savename = str(outdir) + '/' + group_names[y]
         else:
             savename = './'+group_names[y]
-        iy, ix, iz = np.shape(img)
-        mask = np.zeros((iy, ix, 3), dtype=np.uint8)
-        masked_img = np.copy(img)
+        # Draw the group of contours in a crop the size of its bounding box
+        box = crop_context([contours[a] for a in x], np.shape(img), pad=0)
+        mask = np.zeros((box[3], box[2]), dtype=np.uint8)
         for a in x:
-            cv2.drawContours(mask, contours, a, (255, 255, 255), -1, lineType=8)
+            cv2.drawContours(mask, contours, a, (255), -1, lineType=8, offset=(-box[0], -box[1]))
 
-        mask_binary = mask[:, :, 0]
-
-        if np.sum(mask_binary) == 0:
+        if np.sum(mask) == 0:
             pass
         else:
-            retval, mask_binary = cv2.threshold(mask_binary, 254, 255, cv2.THRESH_BINARY)
-            device, masked1 = apply_mask(masked_img, mask_binary, 'white', device, debug)
+            mask_binary = uncrop_image(mask, box, np.shape(img))
+            device, masked1 = apply_mask(img, mask_binary, 'white', device, debug)
             if outdir != None:
                 print_image(masked1, savename)
             output_path.append(savename)
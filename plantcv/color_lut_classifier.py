@@ -0,0 +1,107 @@
+# Classify pixels into several classes with a color lookup table trained by plantcv-train.py (color_lut method)
+
+import os
+import cv2
+import numpy as np
+from . import print_image
+from . import plot_image
+from . import fatal_error
+from plantcv.dev.color_palette import color_palette
+
+# Color space conversions from BGR
+COLORSPACES = {"bgr": None, "hsv": cv2.COLOR_BGR2HSV, "lab": cv2.COLOR_BGR2LAB}
+
+# Models read in this process, by file path: (modification time, size, model)
+_models = {}
+
+
+def color_lut_classifier(img, lut_file, device, debug=None):
+    """Use a color lookup table to label every pixel with one of several classes and output a binary mask per class.
+
+    Inputs:
+    img      = image object (NumPy ndarray), BGR colorspace
+    lut_file = filename of the color lookup table output from the color_lut training method (see plantcv-train.py)
+    device   = device number. Used to count steps in the pipeline
+    debug    = None, print, or plot. Print = save to file, Plot = print to screen.
+
+    Returns:
+    device   = device number
+    masks    = dictionary of binary masks (ndarray), one per class name
+
+    :param img: ndarray
+    :param lut_file: str
+    :param device: int
+    :param debug: str
+    :return device: int
+    :return masks: dict
+    """
+    device += 1
+
+    # Read the lookup table
+    model = _load_model(lut_file)
+    bins = model["bins"]
+
+    # Convert the input BGR image into the color space of the lookup table
+    if model["colorspace"] is not None:
+        img_cs = cv2.cvtColor(img, model["colorspace"])
+    else:
+        img_cs = img
+
+    # Look up the class of each pixel from its color bin (whole image at once)
+    shift = 8 - (bins.bit_length() - 1)
+    c1, c2, c3 = cv2.split(img_cs)
+    labels = model["lut"][c1 >> shift, c2 >> shift, c3 >> shift]
+
+    # Binary mask for each class, 255 (white) where the pixel is labeled with the class
+    masks = {}
+    for i, cls in enumerate(model["classes"]):
+        masks[cls] = np.where(labels == i, 255, 0).astype(np.uint8)
+
+    # Print or plot the labeled image if debug is not None (one color per class, in class order)
+    if debug is not None:
+        colors = np.array(color_palette(len(model["classes"])), dtype=np.uint8)
+        labeled = colors[labels]
+        if debug == 'print':
+            print_image(labeled, (str(device) + '_color_lut_classes.jpg'))
+        elif debug == 'plot':
+            plot_image(labeled)
+
+    return device, masks
+
+
+def _load_model(lut_file):
+    """Read a color lookup table model, or return it from the models already read if the file has not changed.
+
+    Inputs:
+    lut_file = filename of a NumPy archive with the class names, color space, number of bins and lookup table
+
+    Returns:
+    model    = dictionary with the class names (list), color space conversion code, number of bins per channel and
+               lookup table (ndarray, bins x bins x bins class indices)
+
+    :param lut_file: str
+    :return model: dict
+    """
+    path = os.path.abspath(lut_file)
+    stat = os.stat(path)
+    if path in _models and _models[path][:2] == (stat.st_mtime, stat.st_size):
+        return _models[path][2]
+
+    archive = np.load(path)
+    try:
+        classes = [str(cls) for cls in archive["classes"]]
+        colorspace = str(archive["colorspace"])
+        bins = int(archive["bins"])
+        lut = archive["lut"]
+    except KeyError:
+        fatal_error("Color lookup table file is not formatted correctly: " + lut_file)
+    finally:
+        archive.close()
+    if colorspace not in COLORSPACES or lut.shape != (bins, bins, bins) or bins not in [2 ** i for i in range(1, 9)] \
+            or np.max(lut) >= len(classes):
+        fatal_error("Color lookup table file is not formatted correctly: " + lut_file)
+
+    model = {"classes": classes, "colorspace": COLORSPACES[colorspace], "bins": bins, "lut": lut}
+    _models[path] = (stat.st_mtime, stat.st_size, model)
+
+    return model
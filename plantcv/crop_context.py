@@ -0,0 +1,109 @@
+# Crop context: work on the sub-image that contains the objects (their bounding box) instead of the whole image
+
+import cv2
+import numpy as np
+
+# Inset of the contour of a whole image frame from the image edges (findContours ignores the 1-pixel image border in
+# OpenCV 2)
+FRAME_INSET = int(np.min(cv2.findContours(np.ones((3, 3), dtype=np.uint8), cv2.RETR_TREE,
+                                          cv2.CHAIN_APPROX_NONE)[-2][0]))
+
+
+def crop_context(contours, shape, pad=1):
+    """Bounding box of contours in an image, for drawing, filling and finding contours in a buffer the size of the
+    objects instead of the size of the image.
+
+    Draw contours in the crop with offset=(-x, -y) and find contours in it with offset=(x, y) to get image
+    coordinates. The default padding of 1 pixel keeps objects off the edges of the crop (unless they touch the edges
+    of the image), so that contours found in the crop are the same as in the whole image.
+
+    Inputs:
+    contours = list of contours (or a single array of points)
+    shape    = image shape (height, width[, channels])
+    pad      = number of pixels added around the bounding box
+
+    Returns:
+    box      = bounding box in the image (x, y, width, height). Contours outside the image are clipped; if there are
+               no points, the box is the pixel at the image origin, so that the crop is never empty
+
+    :param contours: list
+    :param shape: tuple
+    :param pad: int
+    :return box: tuple
+    """
+    height, width = shape[:2]
+    if len(contours) == 0 or sum([len(cnt) for cnt in contours]) == 0:
+        return 0, 0, min(1, width), min(1, height)
+    points = np.vstack(contours).reshape(-1, 2)
+    x0, y0 = np.min(points, axis=0) - pad
+    x1, y1 = np.max(points, axis=0) + pad + 1
+    x0, y0 = min(max(int(x0), 0), width - 1), min(max(int(y0), 0), height - 1)
+    x1, y1 = max(min(int(x1), width), x0 + 1), max(min(int(y1), height), y0 + 1)
+
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def mask_context(mask):
+    """Bounding box of the nonzero pixels of a mask, for working on the pixels of the objects only.
+
+    Inputs:
+    mask     = binary mask
+
+    Returns:
+    box      = bounding box in the image (x, y, width, height). If the mask is empty, the box is the pixel at the image
+               origin, as in crop_context
+
+    :param mask: numpy array
+    :return box: tuple
+    """
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    cols = np.flatnonzero(np.any(mask, axis=0))
+    if len(rows) == 0:
+        return 0, 0, min(1, np.shape(mask)[1]), min(1, np.shape(mask)[0])
+
+    return int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+
+def crop_image(img, box):
+    """View of the part of an image inside a crop context bounding box.
+
+    Inputs:
+    img      = image
+    box      = bounding box (x, y, width, height)
+
+    Returns:
+    crop     = image crop (a view, writing to it changes the image)
+
+    :param img: numpy array
+    :param box: tuple
+    :return crop: numpy array
+    """
+    x, y, width, height = box
+
+    return img[y:y + height, x:x + width]
+
+
+def uncrop_image(crop, box, shape, fill=0):
+    """Image of the whole frame with a crop at its bounding box position.
+
+    Inputs:
+    crop     = image crop
+    box      = bounding box of the crop in the image (x, y, width, height)
+    shape    = image shape (height, width); the channels are those of the crop
+    fill     = value of the pixels outside the bounding box
+
+    Returns:
+    img      = image
+
+    :param crop: numpy array
+    :param box: tuple
+    :param shape: tuple
+    :param fill: int
+    :return img: numpy array
+    """
+    img = np.zeros(tuple(shape[:2]) + np.shape(crop)[2:], dtype=crop.dtype)
+    if fill != 0:
+        img[:] = fill
+    crop_image(img, box)[:] = crop
+
+    return img
@@ -40,13 +40,6 @@ def fluor_fvfm(fdark, fmin, fmax, mask, device, filename, bins=1000, debug=None)
     """
 
     device += 1
-    if len(np.shape(fmax)) == 3:
-        ix, iy, iz = np.shape(fmax)
-    else:
-        ix, iy = np.shape(fmax)
-
-    size = ix, iy
-    background = np.zeros(size, dtype=np.uint8)
 
     # QC Fdark Image
     fdark_mask = cv2.bitwise_and(fdark, fdark, mask=mask)
@@ -59,68 +52,20 @@ def fluor_fvfm(fdark, fmin, fmax, mask, device, filename, bins=1000, debug=None)
     fmin_mask = cv2.bitwise_and(fmin, fmin, mask=mask)
     fmax_mask = cv2.bitwise_and(fmax, fmax, mask=mask)
 
-    # Calculate Fvariable
+    # Calculate Fvariable and Fv/Fm (the whole image at once)
     if len(np.shape(fmax)) == 3:
         ix, iy, iz = np.shape(fmax)
     else:
         ix, iy = np.shape(fmax)
     shape = ix, iy
 
-    fv = []
-    fmax_flat = fmax_mask.flatten()
-    fmin_flat = fmin_mask.flatten()
-
-    for i, c in enumerate(fmax_flat):
-        if fmax_flat[i] <= fmin_flat[i]:
-            fv1 = 0
-            fv.append(fv1)
-        else:
-            fv1 = fmax_flat[i] - fmin_flat[i]
-            fv.append(fv1)
-
-    fv_nan = np.isnan(fv)
-    for i, c in enumerate(fv_nan):
-        if fv_nan[i] == True:
-            fv[i] = 0
-        else:
-            pass
-
-    fv2 = np.array(fv, dtype=np.uint16)
-    fv3 = np.reshape(fv2, shape)
+    fv3, fm_nonzero, fvfm_values = _fvfm(fmin_mask, fmax_mask)
     fv_img = fv3
 
-    # Calculate Fv/Fm
-    fvfm = []
-    fm = np.hstack(fmax_flat)
-    fv1 = np.array([float(i) for i in fv], dtype=np.float)
-    fm1 = np.array([float(i) for i in fm], dtype=np.float)
-
-    for i, c in enumerate(fm1):
-        fvfm1 = fv1[i] / fm1[i]
-        if np.isnan(fvfm1) == True:
-            fvfm2 = 0
-            fvfm.append(fvfm2)
-        elif np.isinf(fvfm1) == True:
-            fvfm2 = 0
-            fvfm.append(fvfm2)
-        elif np.isneginf(fvfm1) == True:
-            fvfm2 = 0
-            fvfm.append(fvfm2)
-        else:
-            fvfm2 = fvfm1
-            fvfm.append(fvfm2)
-
     # Make Fv/Fm Histogram for Non-Zero Values
-    fvfm_nonzero = [e for i, e in enumerate(fvfm) if e != 0]
-    fvfm_nonzero_hist = np.array(fvfm_nonzero, dtype=np.float)
-    fvfm_median = np.median(fvfm_nonzero_hist)
-    fvfm_hist, fvfm_bins = np.histogram(fvfm_nonzero_hist, bins, range=(0, 1))
-    lower = np.resize(fvfm_bins, len(fvfm_bins) - 1)
-    tmid = lower + 0.5 * np.diff(fvfm_bins)
+    tmid, fvfm_hist, max_bin, fvfm_median = _fvfm_histogram(fvfm_values, bins)
     tmid_list = [l for l in tmid]
     fvfm_hist_list = [l for l in fvfm_hist]
-    fvfm_hist_max = np.argmax(fvfm_hist)
-    max_bin = tmid[fvfm_hist_max]
 
     # Store Fluorescence Histogram Data
     hist_header = (
@@ -147,7 +92,7 @@ def fluor_fvfm(fdark, fmin, fmax, mask, device, filename, bins=1000, debug=None)
     fvfm_max = np.amax(fvfm_hist)
     fvfm_min = np.amin(fvfm_hist)
     hist_shape = np.shape(fvfm_hist)
-    hist_float = np.array([float(i) for i in fvfm_hist], dtype=np.float)
+    hist_float = fvfm_hist.astype(np.float64)
     hist_background = np.zeros(hist_shape, dtype=np.uint8)
     fvfm_norm_slice = np.array((((hist_float - fvfm_min) / (fvfm_max - fvfm_min)) * 255), dtype=np.uint8)
     fvfm_stack = np.dstack((hist_background, hist_background, fvfm_norm_slice))
@@ -184,14 +129,10 @@ def fluor_fvfm(fdark, fmin, fmax, mask, device, filename, bins=1000, debug=None)
         print('\t'.join(map(str, ('IMAGE', 'hist', fig_name))))
 
         # Pseudocolor FvFm image
-        ix, iy = np.shape(fmax)
-        size = ix, iy
-        background = np.zeros(size)
-        w_back = background + 1
-        fvfm1 = np.array(fvfm, dtype=np.float)
+        fvfm1 = np.zeros(shape, dtype=np.float64)
+        fvfm1[fm_nonzero] = fvfm_values
         fvfm256 = fvfm1 * 255
-        fvfm_p = np.array(fvfm256, dtype=np.uint8)
-        fvfm_pshape = np.reshape(fvfm_p, shape)
+        fvfm_pshape = np.array(fvfm256, dtype=np.uint8)
         fvfm_pstack = np.dstack((fvfm_pshape, fvfm_pshape, fvfm_pshape))
 
         fvfm_img = plt.imshow(fvfm_pshape, vmin=0, vmax=255, cmap=cm.jet_r)
@@ -223,3 +164,60 @@ def fluor_fvfm(fdark, fmin, fmax, mask, device, filename, bins=1000, debug=None)
         plot_image(fv3, cmap='gray')
 
     return device, hist_header, hist_data
+
+
+def _fvfm(fmin, fmax):
+    """Calculate Fv and Fv/Fm from masked Fmin and Fmax images (or from arrays of their plant pixels).
+
+    Inputs:
+    fmin        = masked fmin image
+    fmax        = masked fmax image
+
+    Returns:
+    fv          = Fv (16-bit), zero where Fmax is not greater than Fmin
+    fm_nonzero  = where Fmax is not zero (boolean)
+    fvfm        = Fv/Fm where Fmax is not zero
+
+    :param fmin: numpy array
+    :param fmax: numpy array
+    :return fv: numpy array
+    :return fm_nonzero: numpy array
+    :return fvfm: numpy array
+    """
+    fv = np.where(fmax > fmin, fmax - fmin, 0).astype(np.uint16)
+    # Fv/Fm is calculated in double precision, as the histogram bins and median depend on the exact values
+    fm_nonzero = fmax != 0
+    fvfm = fv[fm_nonzero].astype(np.float64) / fmax[fm_nonzero].astype(np.float64)
+
+    return fv, fm_nonzero, fvfm
+
+
+def _fvfm_histogram(fvfm, bins):
+    """Histogram and median of the non-zero Fv/Fm values.
+
+    Inputs:
+    fvfm        = Fv/Fm values
+    bins        = number of bins from 0 to 1
+
+    Returns:
+    tmid        = bin midpoints
+    fvfm_hist   = histogram
+    max_bin     = midpoint of the histogram peak bin
+    fvfm_median = median of the non-zero Fv/Fm values
+
+    :param fvfm: numpy array
+    :param bins: int
+    :return tmid: numpy array
+    :return fvfm_hist: numpy array
+    :return max_bin: float
+    :return fvfm_median: float
+    """
+    fvfm_nonzero_hist = fvfm[fvfm != 0]
+    fvfm_median = np.median(fvfm_nonzero_hist)
+    fvfm_hist, fvfm_bins = np.histogram(fvfm_nonzero_hist, bins, range=(0, 1))
+    lower = np.resize(fvfm_bins, len(fvfm_bins) - 1)
+    tmid = lower + 0.5 * np.diff(fvfm_bins)
+    fvfm_hist_max = np.argmax(fvfm_hist)
+    max_bin = tmid[fvfm_hist_max]
+
+    return tmid, fvfm_hist, max_bin, fvfm_median
@@ -0,0 +1,98 @@
+# Fluorescence Analysis of a series of frames
+
+import numpy as np
+from . import print_image
+from . import plot_image
+from .fluor_fvfm import _fvfm, _fvfm_histogram
+
+
+def fluor_fvfm_series(stack, mask, device, fdark=0, frames=None, bins=1000, debug=None):
+    """Analyze a series of PSII camera frames: Fv/Fm of each pair of Fmin and Fmax frames of a frame stack.
+
+    Only the plant pixels of two frames are read at a time, so the stack can be a memory-mapped file (see
+    image_stack) that is larger than memory.
+
+    Inputs:
+    stack       = 16-bit frame stack (frames, height, width)
+    mask        = mask of plant (binary, single channel)
+    device      = counter for debug
+    fdark       = index of the fdark frame (default is 0)
+    frames      = list of (fmin, fmax) frame index pairs (default is the frames after the fdark frame, in pairs)
+    bins        = number of bins for the Fv/Fm histogram (default is 1000)
+    debug       = None, print, or plot. Print = save to file, Plot = print to screen.
+
+    Returns:
+    device      = device number
+    hist_header = fvfm data table headers
+    hist_data   = list of fvfm data table values, one for each frame pair (as returned by fluor_fvfm)
+
+    :param stack: numpy array
+    :param mask: numpy array
+    :param device: int
+    :param fdark: int
+    :param frames: list
+    :param bins: int
+    :param debug: str
+    :return device: int
+    :return hist_header: tuple
+    :return hist_data: list
+    """
+    device += 1
+    nframes, ix, iy = np.shape(stack)
+    if frames is None:
+        frames = [(i, i + 1) for i in range(fdark + 1, nframes - 1, 2)]
+
+    # Bounding box of the plant, so that only the rows and columns with plant pixels are read from the stack
+    rows, cols = np.nonzero(mask)
+    if len(rows) > 0:
+        y0, y1, x0, x1 = np.min(rows), np.max(rows) + 1, np.min(cols), np.max(cols) + 1
+    else:
+        y0, y1, x0, x1 = 0, 0, 0, 0
+    plant = mask[y0:y1, x0:x1] != 0
+
+    def plant_pixels(frame):
+        return np.asarray(stack[frame, y0:y1, x0:x1])[plant]
+
+    # QC Fdark frame
+    fdark_pixels = plant_pixels(fdark)
+    if len(fdark_pixels) > 0 and np.amax(fdark_pixels) > 2000:
+        qc_fdark = False
+    else:
+        qc_fdark = True
+
+    hist_header = (
+        'HEADER_HISTOGRAM',
+        'bin-number',
+        'fvfm_bins',
+        'fvfm_hist',
+        'fvfm_hist_peak',
+        'fvfm_median',
+        'fdark_passed_qc'
+    )
+
+    hist_data = []
+    for fmin, fmax in frames:
+        # Calculate Fvariable and Fv/Fm of the plant pixels
+        fv, fm_nonzero, fvfm = _fvfm(plant_pixels(fmin), plant_pixels(fmax))
+
+        # Make Fv/Fm Histogram for Non-Zero Values
+        tmid, fvfm_hist, max_bin, fvfm_median = _fvfm_histogram(fvfm, bins)
+        hist_data.append((
+            'FLU_DATA',
+            bins,
+            [l for l in tmid],
+            [l for l in fvfm_hist],
+            max_bin,
+            fvfm_median,
+            qc_fdark
+        ))
+
+        if debug is not None:
+            fv_img = np.zeros((ix, iy), dtype=np.uint16)
+            fv_img[y0:y1, x0:x1][plant] = fv
+            if debug == 'print':
+                print_image(fv_img, (str(device) + '_fv_frame' + str(fmax) + '.png'))
+            elif debug == 'plot':
+                plot_image(fv_img, cmap='gray')
+
+    return device, hist_header, hist_data
@@ -0,0 +1,39 @@
+# Stack images into a (frames, height, width) array file
+
+import cv2
+import numpy as np
+from . import fatal_error
+
+
+def image_stack(filenames, stack_file):
+    """Read a sequence of images (e.g. the frames of a PSII measurement) one at a time into a frame stack file.
+
+    Inputs:
+    filenames  = list of image file names, in frame order
+    stack_file = name of the NumPy (.npy) file to write the stack to
+
+    Returns:
+    stack      = frame stack (frames, height, width), memory-mapped read-only from the stack file
+
+    :param filenames: list
+    :param stack_file: str
+    :return stack: numpy.memmap
+    """
+    stack = None
+    for i, filename in enumerate(filenames):
+        # Read the image unchanged (e.g. 16-bit grayscale)
+        frame = cv2.imread(filename, -1)
+        if frame is None:
+            fatal_error("Failed to open " + filename)
+        if stack is None:
+            stack = np.lib.format.open_memmap(stack_file, mode='w+', dtype=frame.dtype,
+                                              shape=(len(filenames),) + frame.shape)
+        elif frame.shape != stack.shape[1:] or frame.dtype != stack.dtype:
+            fatal_error("The image " + filename + " does not have the size and type of the first image")
+        stack[i] = frame
+    if stack is None:
+        fatal_error("No images to stack")
+    stack.flush()
+    del stack
+
+    return np.load(stack_file, mmap_mode='r')
@@ -1,19 +1,27 @@
 # Classify pixels as plant or non-plant using the naive Bayes method written by Arash Abbasi,
 # adapted for Python by Noah Fahlgren
 
+import os
 import cv2
 import numpy as np
 from . import print_image
 from . import plot_image
 from . import fatal_error
 
+# Color channels of the model, in lookup table order
+CHANNELS = ["hue", "saturation", "value"]
+
+# Models read in this process, by file path: (modification time, size, model)
+_models = {}
+
 
 def naive_bayes_classifier(img, pdf_file, device, debug=None):
     """Use the Naive Bayes classifier to output a plant binary mask.
 
     Inputs:
     img      = image object (NumPy ndarray), BGR colorspace
-    pdf_file = filename of file containing PDFs output from the Naive Bayes training method (see plantcv-train.py)
+    pdf_file = filename of file containing PDFs output from the Naive Bayes training method (see plantcv-train.py),
+               either a text file or a compiled model (.npz)
     device   = device number. Used to count steps in the pipeline
     debug    = None, print, or plot. Print = save to file, Plot = print to screen.
 
@@ -30,6 +38,89 @@ def naive_bayes_classifier(img, pdf_file, device, debug=None):
     """
     device += 1
 
+    # Read the PDFs (lookup tables of probabilities and log probabilities for each class)
+    model = _load_model(pdf_file)
+
+    # Split the input BGR image into component channels for BGR, HSV, and LAB colorspaces
+    # b, g, r = cv2.split(img)
+    h, s, v = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+    # l, gm, by = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2LAB))
+
+    # Calculate the dimensions of the input image
+    width, height, depth = np.shape(img)
+
+    # Calculate the log joint probabilities that each pixel is plant or background (whole image at once)
+    # The joint probability of a class is the sum of the log probabilities of the three channels, which does not
+    # underflow like the product of the probabilities
+    plant_log = model["plant"]["log_pdfs"]
+    bg_log = model["background"]["log_pdfs"]
+    plant = plant_log[0][h] + plant_log[1][s] + plant_log[2][v]
+    bg = bg_log[0][h] + bg_log[1][s] + bg_log[2][v]
+    # Difference of the log probabilities (NaN where both probabilities are zero)
+    with np.errstate(invalid='ignore'):
+        diff = plant - bg
+        # The pixel is plant if the probability of the pixel being plant is greater than the probability of the pixel
+        # being background
+        plant_pixels = diff > 1e-9
+        # Differences within the rounding error of the log sums are decided with the product of the probabilities
+        ties = np.abs(diff) <= 1e-9
+    if np.any(ties):
+        th, ts, tv = h[ties], s[ties], v[ties]
+        plant_pdfs = model["plant"]["pdfs"]
+        bg_pdfs = model["background"]["pdfs"]
+        plant_pixels[ties] = plant_pdfs[0][th] * plant_pdfs[1][ts] * plant_pdfs[2][tv] > \
+            bg_pdfs[0][th] * bg_pdfs[1][ts] * bg_pdfs[2][tv]
+
+    # Initialize an empty mask ndarray
+    mask = np.zeros([width, height])
+    # Set pixel intensities to 255 (white) where the pixel is classified as plant
+    mask[plant_pixels] = 255
+
+    # Print or plot the mask if debug is not None
+    if debug == 'print':
+        print_image(mask, (str(device) + '_naive_bayes_mask.jpg'))
+    elif debug == 'plot':
+        plot_image(mask, cmap='gray')
+
+    return device, mask
+
+
+def _load_model(pdf_file):
+    """Read a Naive Bayes model, or return it from the models already read if the file has not changed.
+
+    Inputs:
+    pdf_file = filename of a text file of PDFs or of a compiled model (NumPy archive)
+
+    Returns:
+    model    = dictionary with a dictionary for each class: "pdfs" and "log_pdfs" lookup tables (ndarray, one row per
+               channel in CHANNELS order, one column per intensity value)
+
+    :param pdf_file: str
+    :return model: dict
+    """
+    path = os.path.abspath(pdf_file)
+    stat = os.stat(path)
+    if path in _models and _models[path][:2] == (stat.st_mtime, stat.st_size):
+        return _models[path][2]
+
+    # Compiled models are NumPy (zip) archives
+    with open(path, "rb") as pf:
+        compiled = pf.read(2) == b"PK"
+    if compiled:
+        model = _read_compiled_model(path)
+    else:
+        model = _read_text_model(path)
+    _models[path] = (stat.st_mtime, stat.st_size, model)
+
+    return model
+
+
+def _read_text_model(pdf_file):
+    """Read a text file of PDFs (one tab-delimited row per class and channel) and make the log lookup tables.
+
+    :param pdf_file: str
+    :return model: dict
+    """
     # Initialize PDF dictionary. There are two classes: plant and background (non-plant)
     pdfs = {"plant": {}, "background": {}}
     # Read the PDF file
@@ -48,39 +139,40 @@ def naive_bayes_classifier(img, pdf_file, device, debug=None):
         # Store the PDFs. Column 0 is the class, Column 1 is the color channel, the rest are p at
         # intensity values 0-255. Cast text p values as float
         pdfs[cols[0]][cols[1]] = [float(i) for i in cols[2:]]
+    pf.close()
 
-    # Split the input BGR image into component channels for BGR, HSV, and LAB colorspaces
-    # b, g, r = cv2.split(img)
-    h, s, v = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
-    # l, gm, by = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2LAB))
+    model = {}
+    for cls in pdfs:
+        tables = np.array([pdfs[cls][channel] for channel in CHANNELS], dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            model[cls] = {"pdfs": tables, "log_pdfs": np.log(tables)}
 
-    # Calculate the dimensions of the input image
-    width, height, depth = np.shape(img)
+    return model
 
-    # Initialize an empty ndarray for plant and background. These will be used to store the joint probabilities
-    plant = np.zeros([width, height])
-    bg = np.zeros([width, height])
 
-    # Loop over the image coordinates (each i, j pixel)
-    for i in range(0, width):
-        for j in range(0, height):
-            # Calculate the joint probability that this is a plant pixel
-            plant[i][j] = pdfs["plant"]["hue"][h[i][j]] * pdfs["plant"]["saturation"][s[i][j]] * \
-                          pdfs["plant"]["value"][v[i][j]]
-            # Calculate the joint probability that this is a background pixel
-            bg[i][j] = pdfs["background"]["hue"][h[i][j]] * pdfs["background"]["saturation"][s[i][j]] * \
-                       pdfs["background"]["value"][v[i][j]]
+def _read_compiled_model(pdf_file):
+    """Read a compiled model: a NumPy archive with the class and channel names and the PDF and log PDF tables of each
+    class (see plantcv-train.py).
 
-    # Initialize an empty mask ndarray
-    mask = np.zeros([width, height])
-    # Set pixel intensities to 255 (white) where the probability of the pixel being plant is greater than the
-    # probability of the pixel being background
-    mask[np.where(plant > bg)] = 255
+    :param pdf_file: str
+    :return model: dict
+    """
+    archive = np.load(pdf_file)
+    try:
+        classes = [str(cls) for cls in archive["classes"]]
+        channels = [str(channel) for channel in archive["channels"]]
+        pdfs = archive["pdfs"]
+        log_pdfs = archive["log_pdfs"]
+    except KeyError:
+        fatal_error("Naive Bayes model file is not formatted correctly: " + pdf_file)
+    finally:
+        archive.close()
+    if channels != CHANNELS or "plant" not in classes or "background" not in classes or \
+            pdfs.shape != (len(classes), len(CHANNELS), 256) or log_pdfs.shape != pdfs.shape:
+        fatal_error("Naive Bayes model file is not formatted correctly: " + pdf_file)
 
-    # Print or plot the mask if debug is not None
-    if debug == 'print':
-        print_image(mask, (str(device) + '_naive_bayes_mask.jpg'))
-    elif debug == 'plot':
-        plot_image(mask, cmap='gray')
+    model = {}
+    for i, cls in enumerate(classes):
+        model[cls] = {"pdfs": pdfs[i], "log_pdfs": log_pdfs[i]}
 
-    return device, mask
+    return model
@@ -4,6 +4,7 @@ import numpy as np
 import cv2
 from . import print_image
 from . import plot_image
+from .crop_context import crop_context, uncrop_image
 
 
 def object_composition(img, contours, hierarchy, device, debug=None):
@@ -30,11 +31,8 @@ def object_composition(img, contours, hierarchy, device, debug=None):
     """
 
     device += 1
-    ori_img = np.copy(img)
 
     stack = np.zeros((len(contours), 1))
-    r, g, b = cv2.split(ori_img)
-    mask = np.zeros(g.shape, dtype=np.uint8)
 
     for c, cnt in enumerate(contours):
         # if hierarchy[0][c][3] == -1:
@@ -50,9 +48,14 @@ def object_composition(img, contours, hierarchy, device, debug=None):
     ids = np.where(stack == 1)[0]
     if len(ids) > 0:
         group = np.vstack(contours[i] for i in ids)
-        cv2.drawContours(mask, contours, -1, (255), -1, hierarchy=hierarchy)
+        # Draw the objects in a crop the size of their bounding box
+        box = crop_context(contours, np.shape(img), pad=0)
+        mask_crop = np.zeros((box[3], box[2]), dtype=np.uint8)
+        cv2.drawContours(mask_crop, contours, -1, (255), -1, hierarchy=hierarchy, offset=(-box[0], -box[1]))
+        mask = uncrop_image(mask_crop, box, np.shape(img))
 
         if debug is not None:
+            ori_img = np.copy(img)
             for cnt in contours:
                 cv2.drawContours(ori_img, cnt, -1, (255, 0, 0), 4)
                 cv2.drawContours(ori_img, group, -1, (255, 0, 0), 4)
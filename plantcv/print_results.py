@@ -1,18 +1,82 @@
 # Print Numerical Data
 
+import json
+import struct
+import numbers
+import numpy as np
+from .analysis_image import AnalysisImage
+
+# First bytes of a binary results file. The last byte is the format version
+RESULTS_MAGIC = b'PCVRESULTS\x00\x02'
+
+# Array types that binary results files can hold: booleans, integers and floating point numbers
+RESULTS_ARRAY_KINDS = 'biuf'
+
 
 def print_results(filename, header, data):
     """Print result table
 
     Inputs:
-    filename = filename
+    filename = filename. If the filename ends in .pcv the table is appended to a binary results file, otherwise it
+               is printed to the standard output
     header   = result data table headers
-    data     = result data table values
+    data     = result data table values. AnalysisImage values are rendered and saved, and written as their file names
 
     :param filename: str
     :param header: list
     :param data: list
     :return:
     """
-    print('\t'.join(map(str, header)))
-    print('\t'.join(map(str, data)))
+    # Output images that are rendered when they are written (see AnalysisImage) are written with the results
+    header = [value.write() if isinstance(value, AnalysisImage) else value for value in header]
+    data = [value.write() if isinstance(value, AnalysisImage) else value for value in data]
+
+    if str(filename).endswith('.pcv'):
+        with open(filename, 'ab') as results:
+            # A new file starts with the binary results file signature
+            if results.tell() == 0:
+                results.write(RESULTS_MAGIC)
+            results.write(_results_record(header))
+            results.write(_results_record(data))
+    else:
+        print('\t'.join(map(str, header)))
+        print('\t'.join(map(str, data)))
+
+
+def _results_record(row):
+    """Binary results file record of one row.
+
+    A record is the length of its JSON description (4-byte little-endian unsigned integer), the JSON description and
+    the bytes of its arrays. The description holds the row values, with None for arrays, and the column, type and
+    length of each array. Lists of numbers (e.g. histograms) are stored as arrays; strings, numbers, booleans and None
+    are stored as they are and other values as text, as in tab-delimited results files.
+
+    Inputs:
+    row    = result data table row
+
+    Returns:
+    record = binary results file record
+
+    :param row: list
+    :return record: bytes
+    """
+    values = []
+    arrays = []
+    data = []
+    for i, value in enumerate(row):
+        if isinstance(value, list) and len(value) > 0 and all(isinstance(x, numbers.Number) and
+                                                              type(x) is type(value[0]) for x in value):
+            value = np.array(value)
+        if isinstance(value, np.ndarray) and value.ndim == 1 and value.dtype.kind in RESULTS_ARRAY_KINDS:
+            arrays.append([i, value.dtype.str, len(value)])
+            data.append(value.tobytes())
+            value = None
+        elif isinstance(value, (np.ndarray, np.generic)):
+            value = value.tolist()
+        if not (value is None or isinstance(value, (numbers.Integral, float, str, type(u'')))):
+            value = str(value)
+        values.append(value)
+
+    description = json.dumps({'values': values, 'arrays': arrays}).encode('utf-8')
+
+    return struct.pack('<I', len(description)) + description + b''.join(data)
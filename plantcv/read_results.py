@@ -0,0 +1,112 @@
+# Read a results file
+
+import os
+import json
+import struct
+import numbers
+import numpy as np
+from .print_results import RESULTS_MAGIC, RESULTS_ARRAY_KINDS
+from . import fatal_error
+
+
+def read_results(filename):
+    """Read the rows of a results file written by a pipeline, either a binary results file (see print_results) or a
+    tab-delimited text file.
+
+    Inputs:
+    filename = results file name
+
+    Returns:
+    rows     = list of rows; each row is a list of values. Text rows contain strings, binary rows contain the values
+               that were written and lists of numbers (e.g. histograms) are returned as numpy arrays
+
+    :param filename: str
+    :return rows: list
+    """
+    if not os.path.isfile(filename):
+        fatal_error("Cannot open " + filename)
+
+    rows = []
+    with open(filename, 'rb') as results:
+        signature = results.read(len(RESULTS_MAGIC))
+        binary = signature == RESULTS_MAGIC
+        if not binary and signature[:-1] == RESULTS_MAGIC[:-1]:
+            fatal_error("Unsupported binary results file version in " + filename)
+        if binary:
+            while True:
+                row = _read_record(results, filename)
+                if row is None:
+                    break
+                rows.append(row)
+
+    if not binary:
+        with open(filename, 'r') as results:
+            for row in results:
+                rows.append(row.rstrip('\n').split('\t'))
+
+    return rows
+
+
+def _read_record(results, filename):
+    """Read one row of a binary results file (see print_results).
+
+    A record that ends before its length or its arrays (e.g. of a pipeline that was killed while it wrote it) ends
+    the file.
+
+    Inputs:
+    results  = binary results file, at the start of a record
+    filename = results file name
+
+    Returns:
+    row      = row values, None at the end of the file
+
+    :param results: file
+    :param filename: str
+    :return row: list
+    """
+    size = results.read(4)
+    if len(size) < 4:
+        return None
+    size = struct.unpack('<I', size)[0]
+    description = results.read(size)
+    if len(description) < size:
+        return None
+    try:
+        record = json.loads(description.decode('utf-8'))
+        if not isinstance(record['values'], list) or not isinstance(record['arrays'], list):
+            raise ValueError("Invalid results record")
+        values = [_record_value(value) for value in record['values']]
+        arrays = [(int(i), np.dtype(str(dtype)), int(length)) for i, dtype, length in record['arrays']]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        fatal_error("Invalid binary results file record in " + filename)
+
+    for i, dtype, length in arrays:
+        if dtype.kind not in RESULTS_ARRAY_KINDS or not 0 <= i < len(values) or length < 0:
+            fatal_error("Invalid binary results file record in " + filename)
+        data = results.read(dtype.itemsize * length)
+        if len(data) < dtype.itemsize * length:
+            return None
+        values[i] = np.frombuffer(bytearray(data), dtype=dtype, count=length)
+
+    return values
+
+
+def _record_value(value):
+    """Check a value of a binary results file record: a string, number, boolean or None. Strings are returned as
+    native strings (on Python 2 JSON strings are decoded as unicode).
+
+    Inputs:
+    value = record value
+
+    Returns:
+    value = record value
+
+    :param value: str, number, bool or None
+    :return value: str, number, bool or None
+    """
+    if isinstance(value, type(u'')) and not isinstance(value, str):
+        return value.encode('utf-8')
+    if not (value is None or isinstance(value, (numbers.Real, str))):
+        raise ValueError("Invalid results value")
+
+    return value
@@ -11,6 +11,7 @@ from . import binary_threshold
 from . import define_roi
 from . import roi_objects
 from . import object_composition
+from .crop_context import FRAME_INSET, crop_context, uncrop_image
 
 
 def report_size_marker_area(img, shape, device, debug, marker='define', x_adj=0, y_adj=0, w_adj=0, h_adj=0,
@@ -62,20 +63,15 @@ def report_size_marker_area(img, shape, device, debug, marker='define', x_adj=0,
     """
 
     device += 1
-    ori_img = np.copy(img)
+    # Output images are only drawn if they are printed or plotted
+    draw = bool(filename) or debug is not None
+    if draw:
+        ori_img = np.copy(img)
     if len(np.shape(img)) == 3:
         ix, iy, iz = np.shape(img)
     else:
         ix, iy = np.shape(img)
 
-    size = ix, iy
-    roi_background = np.zeros(size, dtype=np.uint8)
-    roi_size = (ix - 5), (iy - 5)
-    roi = np.zeros(roi_size, dtype=np.uint8)
-    roi1 = roi + 1
-    roi_contour, roi_heirarchy = cv2.findContours(roi1, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-    cv2.drawContours(roi_background, roi_contour[0], -1, (255, 0, 0), 5)
-
     if x_adj > 0 and w_adj > 0:
         fatal_error('Adjusted ROI position is out of frame, this will cause problems in detecting objects')
     elif y_adj > 0 and h_adj > 0:
@@ -83,46 +79,48 @@ def report_size_marker_area(img, shape, device, debug, marker='define', x_adj=0,
     elif x_adj < 0 or y_adj < 0:
         fatal_error('Adjusted ROI position is out of frame, this will cause problems in detecting objects')
 
-    for cnt in roi_contour:
-        size1 = ix, iy, 3
-        background = np.zeros(size1, dtype=np.uint8)
-        if shape == 'rectangle':
-            x, y, w, h = cv2.boundingRect(cnt)
-            x1 = x + x_adj
-            y1 = y + y_adj
-            w1 = w + w_adj
-            h1 = h + h_adj
-            cv2.rectangle(background, (x1, y1), (x + w1, y + h1), (1, 1, 1), -1)
-        elif shape == 'circle':
-            x, y, w, h = cv2.boundingRect(cnt)
-            x1 = x + x_adj
-            y1 = y + y_adj
-            w1 = w + w_adj
-            h1 = h + h_adj
-            center = (int((w + x1) / 2), int((h + y1) / 2))
-            if h > w:
-                radius = int(w1 / 2)
-                cv2.circle(background, center, radius, (1, 1, 1), -1)
-            else:
-                radius = int(h1 / 2)
-                cv2.circle(background, center, radius, (1, 1, 1), -1)
-        elif shape == 'ellipse':
-            x, y, w, h = cv2.boundingRect(cnt)
-            x1 = x + x_adj
-            y1 = y + y_adj
-            w1 = w + w_adj
-            h1 = h + h_adj
-            center = (int((w + x1) / 2), int((h + y1) / 2))
-            if w > h:
-                cv2.ellipse(background, center, (w1 / 2, h1 / 2), 0, 0, 360, (1, 1, 1), -1)
-            else:
-                cv2.ellipse(background, center, (h1 / 2, w1 / 2), 0, 0, 360, (1, 1, 1), -1)
+    # The marker shape is adjusted from the bounding box of the contour of an image frame 5 pixels smaller than the
+    # image
+    x, y, w, h = FRAME_INSET, FRAME_INSET, (iy - 5) - 2 * FRAME_INSET, (ix - 5) - 2 * FRAME_INSET
+    x1 = x + x_adj
+    y1 = y + y_adj
+    w1 = w + w_adj
+    h1 = h + h_adj
+    if shape == 'rectangle':
+        corners = [(x1, y1), (x + w1, y + h1)]
+    elif shape == 'circle':
+        center = (int((w + x1) / 2), int((h + y1) / 2))
+        if h > w:
+            radius = int(w1 / 2)
         else:
-            fatal_error('Shape' + str(shape) + ' is not "rectangle", "circle", or "ellipse"!')
+            radius = int(h1 / 2)
+        corners = [(center[0] - radius, center[1] - radius), (center[0] + radius, center[1] + radius)]
+    elif shape == 'ellipse':
+        center = (int((w + x1) / 2), int((h + y1) / 2))
+        if w > h:
+            axes = (w1 / 2, h1 / 2)
+        else:
+            axes = (h1 / 2, w1 / 2)
+        corners = [(center[0] - axes[0], center[1] - axes[1]), (center[0] + axes[0], center[1] + axes[1])]
+    else:
+        fatal_error('Shape' + str(shape) + ' is not "rectangle", "circle", or "ellipse"!')
+
+    # Draw the marker shape in a crop the size of its bounding box
+    box = crop_context([np.array(corners)], (ix, iy))
+    background = np.zeros((box[3], box[2], 3), dtype=np.uint8)
+    if shape == 'rectangle':
+        cv2.rectangle(background, (x1 - box[0], y1 - box[1]), (x + w1 - box[0], y + h1 - box[1]), (1, 1, 1), -1)
+    elif shape == 'circle':
+        cv2.circle(background, (center[0] - box[0], center[1] - box[1]), radius, (1, 1, 1), -1)
+    else:
+        cv2.ellipse(background, (center[0] - box[0], center[1] - box[1]), axes, 0, 0, 360, (1, 1, 1), -1)
 
     markerback = cv2.cvtColor(background, cv2.COLOR_RGB2GRAY)
-    shape_contour, hierarchy = cv2.findContours(markerback, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-    cv2.drawContours(ori_img, shape_contour, -1, (255, 255, 0), 5)
+    shape_contour, hierarchy = cv2.findContours(markerback, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE,
+                                                offset=(box[0], box[1]))
+    markerback = uncrop_image(markerback, box, (ix, iy))
+    if draw:
+        cv2.drawContours(ori_img, shape_contour, -1, (255, 255, 0), 5)
     
     if debug is 'print':
         print_image(ori_img, (str(device) + '_marker_roi.png'))
@@ -143,6 +141,7 @@ def report_size_marker_area(img, shape, device, debug, marker='define', x_adj=0,
 
     elif marker == 'detect':
         if thresh_channel is not None and thresh is not None:
+            background = uncrop_image(background, box, (ix, iy))
             if base == 'white':
                 masked = cv2.multiply(img, background)
                 marker1 = markerback * 255
@@ -160,7 +159,8 @@ def report_size_marker_area(img, shape, device, debug, marker='define', x_adj=0,
                                                                          id_objects, obj_hierarchy, device, debug)
             device, obj, mask = object_composition(img, roi_o, hierarchy3, device, debug)
 
-            cv2.drawContours(ori_img, roi_o, -1, (0, 255, 0), -1, lineType=8, hierarchy=hierarchy3)
+            if draw:
+                cv2.drawContours(ori_img, roi_o, -1, (0, 255, 0), -1, lineType=8, hierarchy=hierarchy3)
             m = cv2.moments(mask, binaryImage=True)
             area = m['m00']
 
@@ -5,6 +5,7 @@ import numpy as np
 from . import print_image
 from . import plot_image
 from . import fatal_error
+from .crop_context import crop_context, uncrop_image
 
 
 def roi_objects(img, roi_type, roi_contour, roi_hierarchy, object_contour, obj_hierarchy, device, debug=None):
@@ -43,63 +44,77 @@ def roi_objects(img, roi_type, roi_contour, roi_hierarchy, object_contour, obj_h
     """
 
     device += 1
-    if len(np.shape(img)) == 3:
-        ix, iy, iz = np.shape(img)
-    else:
-        ix, iy = np.shape(img)
 
-    size = ix, iy, 3
+    # Objects are drawn and found in a crop the size of their bounding box. Contours are drawn with the offset of the
+    # crop and found with the opposite offset, so that they stay in image coordinates. The outline of a filled ROI is
+    # drawn with lines clipped to the image, so to cut objects to the ROI the crop includes the ROI
+    if roi_type == 'cutto':
+        box = crop_context(list(object_contour) + [roi_contour[0]], np.shape(img))
+    else:
+        box = crop_context(object_contour, np.shape(img))
+    offset = (-box[0], -box[1])
+    size = box[3], box[2], 3
     background = np.zeros(size, dtype=np.uint8)
-    ori_img = np.copy(img)
-    w_back = background + 255
     background1 = np.zeros(size, dtype=np.uint8)
     background2 = np.zeros(size, dtype=np.uint8)
 
     # Allows user to find all objects that are completely inside or overlapping with ROI
     if roi_type == 'partial':
-        for c, cnt in enumerate(object_contour):
-            length = (len(cnt) - 1)
-            stack = np.vstack(cnt)
-            test = []
-            keep = False
-            for i in range(0, length):
-                pptest = cv2.pointPolygonTest(roi_contour[0], (stack[i][0], stack[i][1]), False)
-                if int(pptest) != -1:
-                    keep = True
-            if keep == True:
-                if obj_hierarchy[0][c][3] > -1:
-                    cv2.drawContours(w_back, object_contour, c, (255, 255, 255), -1, lineType=8,
-                                     hierarchy=obj_hierarchy)
-                else:
-                    cv2.drawContours(w_back, object_contour, c, (0, 0, 0), -1, lineType=8, hierarchy=obj_hierarchy)
+        keep = _objects_in_roi(object_contour, roi_contour[0])
+        # The objects are drawn in one channel: kept objects in black, the others (and kept objects with a parent) in
+        # white. An object is drawn with its descendants, filled as by cv2.drawContours with the hierarchy (with the
+        # even-odd rule), but without passing all of the objects. Drawing in white only changes something if the
+        # bounding box of the drawn contours has black pixels
+        rects = np.reshape([cv2.boundingRect(cnt) for cnt in object_contour], (-1, 4)) + [offset[0], offset[1], 0, 0]
+        rects[:, 2:] += rects[:, :2]
+        kept = np.zeros(size[:2], dtype=np.uint8) + 255
+        for c in range(len(object_contour)):
+            indices = _subtree(obj_hierarchy, c)
+            if keep[c] and not obj_hierarchy[0][c][3] > -1:
+                color = 0
             else:
-                cv2.drawContours(w_back, object_contour, c, (255, 255, 255), -1, lineType=8, hierarchy=obj_hierarchy)
+                if len(indices) == 1:
+                    x, y, x1, y1 = rects[c]
+                else:
+                    x, y = np.min(rects[indices, :2], axis=0)
+                    x1, y1 = np.max(rects[indices, 2:], axis=0)
+                if np.all(kept[max(y, 0):y1, max(x, 0):x1]):
+                    continue
+                color = 255
+            cv2.fillPoly(kept, [object_contour[i] for i in indices], color, lineType=8, offset=offset)
 
-        kept = cv2.cvtColor(w_back, cv2.COLOR_RGB2GRAY)
+        w_back = cv2.cvtColor(kept, cv2.COLOR_GRAY2BGR)
         kept_obj = cv2.bitwise_not(kept)
-        mask = np.copy(kept_obj)
+        mask = uncrop_image(kept_obj, box, np.shape(img))
         obj_area = cv2.countNonZero(kept_obj)
-        kept_cnt, hierarchy = cv2.findContours(kept_obj, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-        cv2.drawContours(ori_img, kept_cnt, -1, (0, 255, 0), -1, lineType=8, hierarchy=hierarchy)
-        cv2.drawContours(ori_img, roi_contour, -1, (255, 0, 0), 5, lineType=8, hierarchy=roi_hierarchy)
+        kept_cnt, hierarchy = cv2.findContours(kept_obj, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE,
+                                               offset=(box[0], box[1]))
 
     # Allows user to cut objects to the ROI (all objects completely outside ROI will not be kept)
     elif roi_type == 'cutto':
-        cv2.drawContours(background1, object_contour, -1, (255, 255, 255), -1, lineType=8, hierarchy=obj_hierarchy)
+        cv2.drawContours(background1, object_contour, -1, (255, 255, 255), -1, lineType=8, hierarchy=obj_hierarchy,
+                         offset=offset)
         roi_points = np.vstack(roi_contour[0])
-        cv2.fillPoly(background2, [roi_points], (255, 255, 255))
+        cv2.fillPoly(background2, [roi_points], (255, 255, 255), offset=offset)
         obj_roi = cv2.multiply(background1, background2)
         kept_obj = cv2.cvtColor(obj_roi, cv2.COLOR_RGB2GRAY)
-        mask = np.copy(kept_obj)
+        mask = uncrop_image(kept_obj, box, np.shape(img))
         obj_area = cv2.countNonZero(kept_obj)
-        kept_cnt, hierarchy = cv2.findContours(kept_obj, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-        cv2.drawContours(w_back, kept_cnt, -1, (0, 0, 0), -1)
-        cv2.drawContours(ori_img, kept_cnt, -1, (0, 255, 0), -1, lineType=8, hierarchy=hierarchy)
-        cv2.drawContours(ori_img, roi_contour, -1, (255, 0, 0), 5, lineType=8, hierarchy=roi_hierarchy)
+        kept_cnt, hierarchy = cv2.findContours(kept_obj, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE,
+                                               offset=(box[0], box[1]))
+        w_back = background + 255
+        cv2.drawContours(w_back, kept_cnt, -1, (0, 0, 0), -1, offset=offset)
 
     else:
         fatal_error('ROI Type' + str(roi_type) + ' is not "cutto" or "partial"!')
 
+    if debug is not None:
+        # Whole images for output
+        w_back = uncrop_image(w_back, box, np.shape(img), fill=255)
+        ori_img = np.copy(img)
+        cv2.drawContours(ori_img, kept_cnt, -1, (0, 255, 0), -1, lineType=8, hierarchy=hierarchy)
+        cv2.drawContours(ori_img, roi_contour, -1, (255, 0, 0), 5, lineType=8, hierarchy=roi_hierarchy)
+
     if debug == 'print':
         print_image(w_back, (str(device) + '_roi_objects.png'))
         print_image(ori_img, (str(device) + '_obj_on_img.png'))
@@ -111,3 +126,127 @@ def roi_objects(img, roi_type, roi_contour, roi_hierarchy, object_contour, obj_h
         # print ('Object Area=', obj_area)
 
     return device, kept_cnt, hierarchy, mask, obj_area
+
+
+def _objects_in_roi(object_contour, roi):
+    """Find the objects that have a point (other than their last point) inside or on the edge of the ROI, as tested
+    with cv2.pointPolygonTest.
+
+    Points outside the bounding box of the ROI are rejected first. The other points are looked up in a raster of the
+    ROI over their bounding box, made with the integer point test of cv2.pointPolygonTest: a point is inside if it is
+    on an edge or if an odd number of edges (each with its lower end but not its upper end) cross the row of the point
+    to its right.
+
+    Inputs:
+    object_contour = contours of objects
+    roi            = contour of the ROI
+
+    Returns:
+    keep           = True for each object that is kept (numpy array)
+
+    :param object_contour: list
+    :param roi: numpy array
+    :return keep: numpy array
+    """
+    keep = np.zeros(len(object_contour), dtype=bool)
+    if len(object_contour) == 0:
+        return keep
+
+    # Points to test and their objects
+    points = [np.reshape(cnt, (-1, 2)) for cnt in object_contour]
+    lengths = np.array([len(cnt) for cnt in points])
+    points = np.vstack(points).astype(np.int64)
+    objects = np.repeat(np.arange(len(object_contour)), lengths)
+    tested = np.ones(len(points), dtype=bool)
+    tested[np.cumsum(lengths)[lengths > 0] - 1] = False
+
+    # Reject the points outside the bounding box of the ROI
+    rx, ry, rw, rh = cv2.boundingRect(roi)
+    tested &= (points[:, 0] >= rx) & (points[:, 0] < rx + rw) & (points[:, 1] >= ry) & (points[:, 1] < ry + rh)
+    points = points[tested]
+    objects = objects[tested]
+    if len(points) == 0:
+        return keep
+
+    x0, y0 = np.min(points, axis=0)
+    x1, y1 = np.max(points, axis=0) + 1
+    inside = _roi_raster(np.reshape(roi, (-1, 2)).astype(np.int64), (x0, y0, x1 - x0, y1 - y0))
+    keep[objects[inside[points[:, 1] - y0, points[:, 0] - x0]]] = True
+
+    return keep
+
+
+def _roi_raster(roi, box):
+    """Raster of the points of a box that are inside or on the edge of a polygon, as found by cv2.pointPolygonTest for
+    integer points.
+
+    Inputs:
+    roi      = polygon points (N x 2 integers)
+    box      = bounding box of the raster (x, y, width, height)
+
+    Returns:
+    inside   = True for the points inside or on the edge of the polygon (numpy array, height x width)
+
+    :param roi: numpy array
+    :param box: tuple
+    :return inside: numpy array
+    """
+    x0, y0, width, height = box
+    start = np.roll(roi, 1, axis=0)
+    end = roi
+
+    # Rows crossed by each edge, from its lower end to its upper end (excluded), in the box
+    lower = np.where((start[:, 1] <= end[:, 1])[:, np.newaxis], start, end)
+    upper = np.where((start[:, 1] <= end[:, 1])[:, np.newaxis], end, start)
+    first_row = np.maximum(lower[:, 1], y0)
+    rows = np.maximum(np.minimum(upper[:, 1], y0 + height) - first_row, 0)
+    edges = np.repeat(np.arange(len(roi)), rows)
+    y = first_row[edges] + np.arange(len(edges)) - np.repeat(np.cumsum(rows) - rows, rows)
+    lower, upper = lower[edges], upper[edges]
+
+    # An edge crosses the row to the right of the points before the first column at or after the crossing point
+    num = (upper[:, 0] - lower[:, 0]) * (y - lower[:, 1])
+    col = lower[:, 0] + -(-num // (upper[:, 1] - lower[:, 1])) - x0
+    crossings = np.bincount((y - y0) * (width + 1) + np.clip(col, 0, width),
+                            minlength=height * (width + 1)).reshape(height, width + 1)
+    # Parity of the number of crossings to the right of each point (the counts wrap around but keep their parity)
+    left = np.cumsum(crossings[:, :width], axis=1, dtype=np.uint8)
+    inside = ((np.sum(crossings, axis=1, dtype=np.uint8)[:, np.newaxis] - left) & 1).astype(bool)
+
+    # Points on the edges: the integer points of the steps of one pixel along the longer axis of each edge
+    steps = np.maximum(np.max(np.abs(end - start), axis=1), 1)
+    edges = np.repeat(np.arange(len(roi)), steps + 1)
+    step = (np.arange(len(edges)) - np.repeat(np.cumsum(steps + 1) - (steps + 1), steps + 1))[:, np.newaxis]
+    shift = step * (end[edges] - start[edges])
+    on_edge = np.all(shift % steps[edges][:, np.newaxis] == 0, axis=1)
+    points = start[edges[on_edge]] + shift[on_edge] // steps[edges[on_edge]][:, np.newaxis]
+    on_box = (points[:, 0] >= x0) & (points[:, 0] < x0 + width) & (points[:, 1] >= y0) & (points[:, 1] < y0 + height)
+    inside[points[on_box, 1] - y0, points[on_box, 0] - x0] = True
+
+    return inside
+
+
+def _subtree(hierarchy, c):
+    """Indices of a contour and its descendants (its holes, the objects in them and so on).
+
+    Inputs:
+    hierarchy     = contour hierarchy (1 x N x 4: next, previous, first child, parent)
+    c             = index of the contour
+
+    Returns:
+    indices       = indices of the contour (first) and its descendants
+
+    :param hierarchy: numpy array
+    :param c: int
+    :return indices: list
+    """
+    indices = [c]
+    i = 0
+    while i < len(indices):
+        child = hierarchy[0][indices[i]][2]
+        while child > -1:
+            indices.append(child)
+            child = hierarchy[0][child][0]
+        i += 1
+
+    return indices
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# PlantCV benchmarks
+# Usage: python tests/benchmarks.py [-r REPEAT] [benchmark [benchmark ...]]
+# Not collected by pytest; run from any directory
+
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import subprocess
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+PLANTCV_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+TEST_INPUT_COLOR = "input_color_img.jpg"
+TEST_INPUT_BINARY = "input_binary_img.png"
+TEST_INPUT_ROI = "input_roi.npz"
+TEST_INPUT_CONTOURS = "input_contours.npz"
+TEST_PDFS = "naive_bayes_pdfs.txt"
+TEST_INPUT_FDARK = "FLUO_TV_dark.jpg"
+TEST_INPUT_FMIN = "FLUO_TV_min.jpg"
+TEST_INPUT_FMAX = "FLUO_TV_max.jpg"
+
+sys.path.insert(0, PLANTCV_ROOT)
+import plantcv as pcv
+
+
+def best_time(func, repeat):
+    """Run a function several times and return the shortest run time in seconds.
+
+    :param func: function without arguments
+    :param repeat: int
+    :return: float
+    """
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def report(name, seconds, reference=None):
+    """Print a benchmark result, with the speed-up relative to a reference time.
+
+    :param name: str
+    :param seconds: float
+    :param reference: float
+    :return:
+    """
+    line = "    {0:<52} {1:10.4f} s".format(name, seconds)
+    if reference is not None and seconds > 0:
+        line += "  ({0:.1f}x)".format(reference / seconds)
+    print(line)
+
+
+def bench_import(repeat):
+    """Cold-start time of importing plantcv in a new Python interpreter.
+
+    The interpreter startup and the cv2/numpy imports are measured separately and subtracted. Loading every function
+    (as the package did before its modules were imported lazily) is the reference.
+
+    :param repeat: int
+    :return:
+    """
+    scripts = OrderedDict([
+        ("python, cv2 and numpy", "import cv2, numpy"),
+        ("all functions (eager import)", "import cv2, numpy, plantcv\nfor name in plantcv.__all__: getattr(plantcv, name)"),
+        ("import plantcv", "import cv2, numpy, plantcv"),
+        ("readimage, rgb2gray_hsv, binary_threshold",
+         "import cv2, numpy\nfrom plantcv import readimage, rgb2gray_hsv, binary_threshold"),
+    ])
+    times = OrderedDict()
+    for name in scripts:
+        times[name] = best_time(lambda: subprocess.check_call([sys.executable, "-c", scripts[name]], cwd=PLANTCV_ROOT),
+                                repeat)
+    startup = times.pop("python, cv2 and numpy")
+    report("python, cv2 and numpy", startup)
+    reference = times["all functions (eager import)"] - startup
+    for name in times:
+        report(name + " (added)", times[name] - startup, reference)
+
+
+def naive_bayes_per_pixel(img, pdf_file):
+    """Naive Bayes classifier that multiplies the PDF values of each pixel in a Python loop (the original method).
+
+    :param img: numpy array
+    :param pdf_file: str
+    :return mask: numpy array
+    """
+    pdfs = {"plant": {}, "background": {}}
+    with open(pdf_file, "r") as pf:
+        pf.readline()
+        for row in pf:
+            cols = row.rstrip("\n").split("\t")
+            pdfs[cols[0]][cols[1]] = [float(i) for i in cols[2:]]
+    h, s, v = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+    width, height, depth = np.shape(img)
+    plant = np.zeros([width, height])
+    bg = np.zeros([width, height])
+    for i in range(0, width):
+        for j in range(0, height):
+            plant[i][j] = pdfs["plant"]["hue"][h[i][j]] * pdfs["plant"]["saturation"][s[i][j]] * \
+                          pdfs["plant"]["value"][v[i][j]]
+            bg[i][j] = pdfs["background"]["hue"][h[i][j]] * pdfs["background"]["saturation"][s[i][j]] * \
+                       pdfs["background"]["value"][v[i][j]]
+    mask = np.zeros([width, height])
+    mask[np.where(plant > bg)] = 255
+    return mask
+
+
+def bench_naive_bayes(repeat):
+    """naive_bayes_classifier on the test color image, compared with the per-pixel loop (run once).
+
+    :param repeat: int
+    :return:
+    """
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
+    pdf_file = os.path.join(TEST_DATA, TEST_PDFS)
+    masks = []
+    reference = best_time(lambda: masks.append(naive_bayes_per_pixel(img, pdf_file)), 1)
+    report("per-pixel loop", reference)
+    report("naive_bayes_classifier", best_time(lambda: masks.append(pcv.naive_bayes_classifier(img, pdf_file, 0)[1]),
+                                               repeat), reference)
+    print("    identical masks: {0}".format(all([np.array_equal(masks[0], mask) for mask in masks[1:]])))
+
+
+def fvfm_per_pixel(fmin, fmax, mask, bins):
+    """Fv/Fm median and histogram calculated pixel by pixel in Python loops (the original fluor_fvfm method).
+
+    :param fmin: numpy array
+    :param fmax: numpy array
+    :param mask: numpy array
+    :param bins: int
+    :return fvfm_median: float
+    :return fvfm_hist: list
+    """
+    fmin_flat = cv2.bitwise_and(fmin, fmin, mask=mask).flatten()
+    fmax_flat = cv2.bitwise_and(fmax, fmax, mask=mask).flatten()
+    fv = []
+    for i, c in enumerate(fmax_flat):
+        if fmax_flat[i] <= fmin_flat[i]:
+            fv.append(0)
+        else:
+            fv.append(fmax_flat[i] - fmin_flat[i])
+    fv1 = np.array([float(i) for i in fv], dtype=np.float64)
+    fm1 = np.array([float(i) for i in fmax_flat], dtype=np.float64)
+    fvfm = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, c in enumerate(fm1):
+            fvfm1 = fv1[i] / fm1[i]
+            if np.isnan(fvfm1) or np.isinf(fvfm1):
+                fvfm.append(0)
+            else:
+                fvfm.append(fvfm1)
+    fvfm_nonzero = np.array([e for e in fvfm if e != 0], dtype=np.float64)
+    fvfm_hist, fvfm_bins = np.histogram(fvfm_nonzero, bins, range=(0, 1))
+    return np.median(fvfm_nonzero), [l for l in fvfm_hist]
+
+
+def bench_fluor_fvfm(repeat):
+    """fluor_fvfm on the test PSII frames scaled to 16 bits, compared with the per-pixel loops (run once).
+
+    :param repeat: int
+    :return:
+    """
+    fdark, fmin, fmax = [cv2.imread(os.path.join(TEST_DATA, filename), -1).astype(np.uint16) * 256
+                         for filename in [TEST_INPUT_FDARK, TEST_INPUT_FMIN, TEST_INPUT_FMAX]]
+    mask = np.where(fmax > 20 * 256, 255, 0).astype(np.uint8)
+    results = []
+    reference = best_time(lambda: results.append(fvfm_per_pixel(fmin, fmax, mask, 1000)), 1)
+    report("per-pixel loops", reference)
+    report("fluor_fvfm", best_time(lambda: results.append(
+        pcv.fluor_fvfm(fdark, fmin, fmax, mask, 0, False, bins=1000)[2]), repeat), reference)
+    print("    identical median and histogram: {0}".format(
+        all([result[5] == results[0][0] and result[3] == results[0][1] for result in results[1:]])))
+
+
+def bound_areas_per_pixel(mask, line_position):
+    """Object areas above and below a boundary line, with a point-in-polygon test of each object pixel in a Python loop
+    (the original analyze_bound method).
+
+    :param mask: numpy array
+    :param line_position: int
+    :return above_bound_area: int
+    :return below_bound_area: int
+    """
+    iy, ix = np.shape(mask)
+    background = np.zeros((iy, ix), dtype=np.uint8)
+    cv2.rectangle(background, (1, iy - 2), (ix - 2, iy - line_position - 2), (255), 1)
+    below_contour = cv2.findContours(background, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2]
+    above = 0
+    below = 0
+    mask_nonzeroy, mask_nonzerox = np.nonzero(mask)
+    for xy in zip(mask_nonzerox, mask_nonzeroy):
+        if cv2.pointPolygonTest(below_contour[0], (int(xy[0]), int(xy[1])), measureDist=False) == 1:
+            below += 1
+        else:
+            above += 1
+    return above, below
+
+
+def bench_analyze_bound(repeat):
+    """analyze_bound on the test color image and mask, compared with the per-pixel loop (run once).
+
+    :param repeat: int
+    :return:
+    """
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
+    mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
+    obj = np.vstack(cv2.findContours(np.copy(mask), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2])
+    areas = []
+    reference = best_time(lambda: areas.append(bound_areas_per_pixel(mask, 300)), 1)
+    report("per-pixel loop", reference)
+    report("analyze_bound", best_time(lambda: areas.append(
+        tuple(pcv.analyze_bound(img, "img", obj, mask, 300, 0, None)[2][3:6:2])), repeat), reference)
+    print("    identical areas: {0}".format(all([area == areas[0] for area in areas[1:]])))
+
+
+def color_histograms_full_frame(img, mask, bins):
+    """Color histograms of the masked image, converted to LAB and HSV and divided into bins as a whole, with one
+    cv2.calcHist call per channel (the original analyze_color method).
+
+    :param img: numpy array
+    :param mask: numpy array
+    :param bins: int
+    :return hists: list
+    """
+    masked = cv2.bitwise_and(img, img, mask=mask)
+    channels = cv2.split(masked) + cv2.split(cv2.cvtColor(masked, cv2.COLOR_BGR2LAB)) + \
+        cv2.split(cv2.cvtColor(masked, cv2.COLOR_BGR2HSV))
+    hists = []
+    for channel in channels:
+        hist = cv2.calcHist([channel // (256 // bins)], [0], mask, [bins], [0, (bins - 1)])
+        hists.append([l[0] for l in hist])
+    return hists
+
+
+def bench_analyze_color(repeat):
+    """analyze_color histograms of the test color image and mask, compared with full-frame cv2.calcHist calls.
+
+    :param repeat: int
+    :return:
+    """
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
+    mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
+    for bins in [256, 100]:
+        hists = []
+        reference = best_time(lambda: hists.append(color_histograms_full_frame(img, mask, bins)), repeat)
+        report("full-frame calcHist ({0} bins)".format(bins), reference)
+        report("analyze_color ({0} bins)".format(bins), best_time(lambda: hists.append(
+            pcv.analyze_color(img, "img", mask, bins, 0, None, None)[2][3:]), repeat), reference)
+        print("    identical histograms: {0}".format(all([hist == hists[0] for hist in hists[1:]])))
+
+
+def nir_histogram_full_frame(img, mask, bins):
+    """NIR intensity histogram of the whole image multiplied by the mask, with np.histogram (the original
+    analyze_NIR_intensity method).
+
+    :param img: numpy array
+    :param mask: numpy array
+    :param bins: int
+    :return hist: list
+    """
+    mask1 = cv2.threshold(mask, 0, 255, cv2.THRESH_BINARY)[1]
+    mask1 = (mask1 / 255)
+    masked = np.multiply(img, mask1)
+    hist, edges = np.histogram(masked, bins, (1, 65536 if img.dtype == 'uint16' else 256))
+    return [l for l in hist]
+
+
+def bench_analyze_nir(repeat):
+    """analyze_NIR_intensity histogram of the test image scaled to 16 bits, compared with the full-frame histogram.
+
+    :param repeat: int
+    :return:
+    """
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR), 0).astype(np.uint16) * 256
+    mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
+    for bins in [256, 4096]:
+        hists = []
+        reference = best_time(lambda: hists.append(nir_histogram_full_frame(img, mask, bins)), repeat)
+        report("full-frame np.histogram ({0} bins)".format(bins), reference)
+        report("analyze_NIR_intensity ({0} bins)".format(bins), best_time(lambda: hists.append(
+            pcv.analyze_NIR_intensity(img, img, mask, bins, 0)[2][3]), repeat), reference)
+        print("    identical histograms: {0}".format(all([hist == hists[0] for hist in hists[1:]])))
+
+
+def partial_roi_mask_per_point(img, roi_contour, object_contour, obj_hierarchy):
+    """Mask of the objects partially inside an ROI, with a point-in-polygon test of each object point in a Python loop
+    and the objects drawn in a whole 3-channel image (the original roi_objects method).
+
+    :param img: numpy array
+    :param roi_contour: list
+    :param object_contour: list
+    :param obj_hierarchy: numpy array
+    :return mask: numpy array
+    """
+    w_back = np.zeros(np.shape(img), dtype=np.uint8) + 255
+    for c, cnt in enumerate(object_contour):
+        keep = False
+        stack = np.vstack(cnt)
+        for i in range(0, len(cnt) - 1):
+            if int(cv2.pointPolygonTest(roi_contour[0], (stack[i][0], stack[i][1]), False)) != -1:
+                keep = True
+        if keep and not obj_hierarchy[0][c][3] > -1:
+            cv2.drawContours(w_back, object_contour, c, (0, 0, 0), -1, lineType=8, hierarchy=obj_hierarchy)
+        else:
+            cv2.drawContours(w_back, object_contour, c, (255, 255, 255), -1, lineType=8, hierarchy=obj_hierarchy)
+    return cv2.bitwise_not(cv2.cvtColor(w_back, cv2.COLOR_RGB2GRAY))
+
+
+def bench_roi_objects(repeat):
+    """roi_objects ('partial') with the test ROI and objects, compared with the per-point loop (run once).
+
+    :param repeat: int
+    :return:
+    """
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
+    roi_npz = np.load(os.path.join(TEST_DATA, TEST_INPUT_ROI))
+    contours_npz = np.load(os.path.join(TEST_DATA, TEST_INPUT_CONTOURS))
+    roi_contour, roi_hierarchy = roi_npz["arr_0"], roi_npz["arr_1"]
+    object_contour, obj_hierarchy = contours_npz["arr_0"], contours_npz["arr_1"]
+    masks = []
+    reference = best_time(lambda: masks.append(
+        partial_roi_mask_per_point(img, roi_contour, object_contour, obj_hierarchy)), 1)
+    report("per-point loop ({0} objects)".format(len(object_contour)), reference)
+    report("roi_objects", best_time(lambda: masks.append(pcv.roi_objects(
+        img, "partial", roi_contour, roi_hierarchy, object_contour, obj_hierarchy, 0, None)[3]), repeat), reference)
+    print("    identical masks: {0}".format(all([np.array_equal(mask, masks[0]) for mask in masks[1:]])))
+
+
+# Benchmarks by name, run in this order
+BENCHMARKS = OrderedDict([
+    ("import", bench_import),
+    ("naive_bayes", bench_naive_bayes),
+    ("fluor_fvfm", bench_fluor_fvfm),
+    ("analyze_bound", bench_analyze_bound),
+    ("analyze_color", bench_analyze_color),
+    ("analyze_nir", bench_analyze_nir),
+    ("roi_objects", bench_roi_objects),
+])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run PlantCV benchmarks.")
+    parser.add_argument("benchmarks", nargs="*", help="Benchmarks to run (default: all): " + ", ".join(BENCHMARKS))
+    parser.add_argument("-r", "--repeat", help="Number of times each measurement is repeated (the best is reported).",
+                        type=int, default=5)
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: " + name)
+
+    for name in args.benchmarks or BENCHMARKS:
+        print(name + ":")
+        BENCHMARKS[name](args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,15 @@
 
 import pytest
 import os
+import sys
 import shutil
+import imp
+import argparse
+import subprocess
+import signal
+import struct
+import threading
+import time
 import numpy as np
 import cv2
 import plantcv as pcv
@@ -56,6 +64,57 @@ def test_plantcv_adaptive_threshold():
         assert 0
 
 
+def test_plantcv_analysis_image():
+    # A pipeline that writes its image rows as text, as the pipelines written before analysis images could be
+    # deferred: the pseudocolored image is saved when it is made
+    pseudo_file = os.path.join(TEST_TMPDIR, 'plantcv_analysis_image_v_pseudo_on_img.jpg')
+    result_file = os.path.join(TEST_TMPDIR, 'plantcv_analysis_image.txt')
+    for name in (pseudo_file, result_file):
+        if os.path.exists(name):
+            os.remove(name)
+    script = """
+import sys
+import cv2
+import plantcv as pcv
+img = cv2.imread(sys.argv[1])
+mask = cv2.imread(sys.argv[2], -1)
+device, color_header, color_data, color_img = pcv.analyze_color(img, sys.argv[1], mask, 256, 0, None, None, 'v', 'img',
+                                                                300, sys.argv[3])
+result = open(sys.argv[4], 'a')
+for row in color_img:
+    result.write('\\t'.join(map(str, row)))
+    result.write('\\n')
+result.close()
+"""
+    assert subprocess.call([sys.executable, "-c", script, os.path.join(TEST_DATA, TEST_INPUT_COLOR),
+                            os.path.join(TEST_DATA, TEST_INPUT_BINARY),
+                            os.path.join(TEST_TMPDIR, 'plantcv_analysis_image.png'), result_file],
+                           cwd=os.path.join(TEST_DATA, "..", "..")) == 0
+    with open(result_file, 'r') as results:
+        assert results.read() == 'IMAGE\tpseudo\t' + pseudo_file + '\n'
+    assert cv2.imread(pseudo_file).shape == TEST_COLOR_DIM
+
+
+def test_plantcv_analysis_image_deferred():
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
+    mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
+    filename = os.path.join(TEST_TMPDIR, 'plantcv_analysis_image_deferred.png')
+    pseudo_file = os.path.join(TEST_TMPDIR, 'plantcv_analysis_image_deferred_v_pseudo_on_img.jpg')
+    if os.path.exists(pseudo_file):
+        os.remove(pseudo_file)
+    pcv.defer_analysis_images()
+    try:
+        device, color_header, color_data, analysis_images = pcv.analyze_color(img, "img", mask, 256, 0, None, None,
+                                                                              'v', 'img', 300, filename)
+    finally:
+        pcv.defer_analysis_images(False)
+    # The pseudocolored image is rendered when it is written
+    assert '\t'.join(map(str, analysis_images[0])) == 'IMAGE\tpseudo\t' + pseudo_file
+    assert not os.path.exists(pseudo_file)
+    assert pcv.write_analysis_images(analysis_images) == [['IMAGE', 'pseudo', pseudo_file]]
+    assert cv2.imread(pseudo_file).shape == TEST_COLOR_DIM
+
+
 def test_plantcv_analyze_bound():
     img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
     mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
@@ -66,6 +125,16 @@ def test_plantcv_analyze_bound():
     assert boundary_data[3] == 596347
 
 
+def test_plantcv_analyze_bound_split():
+    # A 4 x 10 pixel object with 4 of its 10 rows below the boundary line
+    img = np.zeros((20, 10, 3), dtype=np.uint8)
+    mask = np.zeros((20, 10), dtype=np.uint8)
+    mask[5:15, 3:7] = 255
+    obj = cv2.findContours(np.copy(mask), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2][0]
+    device, boundary_header, boundary_data, boundary_img1 = pcv.analyze_bound(img, "img", obj, mask, 8, 0, None)
+    assert boundary_data[3:] == [24, 60.0, 16, 40.0]
+
+
 def test_plantcv_analyze_color():
     img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
     mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
@@ -73,6 +142,16 @@ def test_plantcv_analyze_color():
     assert np.sum(color_data[3]) != 0
 
 
+def test_plantcv_analyze_color_bins():
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
+    mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
+    device, color_header, color_data, analysis_images = pcv.analyze_color(img, "img", mask, 100, 0, None, None)
+    # Same as the cv2.calcHist histogram of the whole masked hue channel divided into bins of 2 values
+    hue = cv2.split(cv2.cvtColor(cv2.bitwise_and(img, img, mask=mask), cv2.COLOR_BGR2HSV))[0]
+    hist = cv2.calcHist([hue // 2], [0], mask, [100], [0, 99])
+    assert color_data[9] == [l[0] for l in hist]
+
+
 def test_plantcv_analyze_nir():
     img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR), 0)
     mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
@@ -80,6 +159,14 @@ def test_plantcv_analyze_nir():
     assert np.sum(hist_data[3]) == 713986
 
 
+def test_plantcv_analyze_nir_16bit():
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR), 0).astype(np.uint16) * 257
+    mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
+    device, hist_header, hist_data, h_norm = pcv.analyze_NIR_intensity(img, img, mask, 100, 0, False, None)
+    hist, edges = np.histogram(img[np.where(mask > 0)], 100, (1, 65536))
+    assert hist_data[3] == list(hist) and hist_data[2] == list(edges[:-1])
+
+
 def test_plantcv_analyze_object():
     img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
     mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
@@ -90,6 +177,72 @@ def test_plantcv_analyze_object():
     assert obj_data[1] != 0
 
 
+def analyze_object_reference(obj, mask):
+    # Longest axis and in_bounds of an object measured as analyze_object did with full-frame images and the same cv2
+    # primitives: point tests against the image frame contour, the convex hull point farthest from a circle drawn at
+    # the center of mass, and the pixels of the line through both points inside the filled hull
+    ix, iy = np.shape(mask)
+    frame_contour = cv2.findContours(np.ones((ix, iy), dtype=np.uint8), cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2][0]
+    in_bounds = all([cv2.pointPolygonTest(frame_contour, (float(px), float(py)), False) == 1
+                     for px, py in np.vstack(obj)])
+    m = cv2.moments(mask, binaryImage=True)
+    mid_x, mid_y = int(m['m10'] / m['m00']), int(m['m01'] / m['m00'])
+    center = np.zeros((ix, iy), dtype=np.uint8)
+    cv2.circle(center, (mid_x, mid_y), 4, 255, -1)
+    center_contour = cv2.findContours(center, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2][0]
+    hull = cv2.convexHull(obj)
+    vhull = np.vstack(hull)
+    dist = [abs(cv2.pointPolygonTest(center_contour, (float(px), float(py)), True)) for px, py in vhull]
+    max_x, max_y = vhull[np.argmax(dist)]
+    slope = 1
+    if max_x != mid_x:
+        slope = float(max_y - mid_y) / float(max_x - mid_x)
+    b_line = mid_y - slope * mid_x
+    if slope == 0:
+        line_ends = (iy, mid_y), (0, mid_y)
+    else:
+        xintercept = int(-b_line / slope)
+        xintercept1 = int((ix - b_line) / slope)
+        if 0 <= xintercept <= iy and 0 <= xintercept1 <= iy:
+            line_ends = (xintercept1, ix), (xintercept, 0)
+        elif xintercept < 0 and 0 <= xintercept1 <= iy:
+            line_ends = (0, int(b_line)), (xintercept1, ix)
+        elif xintercept > iy and 0 <= xintercept1 <= iy:
+            line_ends = (iy, int(slope * iy + b_line)), (xintercept1, ix)
+        elif 0 <= xintercept <= iy and xintercept1 < 0:
+            line_ends = (0, int(b_line)), (xintercept, 0)
+        elif 0 <= xintercept <= iy and xintercept1 > iy:
+            line_ends = (iy, int(slope * iy + b_line)), (xintercept, 0)
+        else:
+            line_ends = (0, int(b_line)), (iy, int(slope * iy + b_line))
+    line = np.zeros((ix, iy), dtype=np.uint8)
+    cv2.line(line, line_ends[0], line_ends[1], 255, 1)
+    filled_hull = np.zeros((ix, iy), dtype=np.uint8)
+    cv2.drawContours(filled_hull, [hull], -1, 255, -1)
+    return np.count_nonzero(cv2.multiply(line, filled_hull)), in_bounds
+
+
+def test_plantcv_analyze_object_geometry():
+    # Horizontal bars inside the image and touching the left edge of the image, and a tilted ellipse
+    masks = []
+    for x in [50, 0]:
+        mask = np.zeros((100, 200), dtype=np.uint8)
+        cv2.rectangle(mask, (x, 48), (x + 99, 52), 255, -1)
+        masks.append(mask)
+    mask = np.zeros((100, 200), dtype=np.uint8)
+    cv2.ellipse(mask, (90, 45), (60, 20), 30, 0, 360, 255, -1)
+    masks.append(mask)
+    results = []
+    for mask in masks:
+        img = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)
+        objects, hierarchy = cv2.findContours(np.copy(mask), cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2:]
+        device, obj_header, obj_data, obj_images = pcv.analyze_object(img, "img", objects[0], mask, 0, None)
+        # The measurements are those of the full-frame method, with the cv2 version in use
+        assert (obj_data[7], obj_data[11]) == analyze_object_reference(objects[0], mask)
+        results.append(obj_data[11])
+    assert results == [True, False, True]
+
+
 def test_plantcv_apply_mask():
     img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
     mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
@@ -144,6 +297,24 @@ def test_plantcv_cluster_contours_splitimg():
     assert len(output_path) != 0
 
 
+def test_plantcv_color_lut_classifier():
+    # Cache test directory
+    cache_dir = os.path.join(TEST_TMPDIR, "test_plantcv_color_lut_classifier")
+    if not os.path.exists(cache_dir):
+        os.mkdir(cache_dir)
+    # Two bins per BGR channel: pixels with all channels >= 128 are bright, the others are dark
+    lut = np.zeros((2, 2, 2), dtype=np.uint8)
+    lut[1, 1, 1] = 1
+    with open(os.path.join(cache_dir, "color_lut.npz"), "wb") as fp:
+        np.savez(fp, classes=np.array(["dark", "bright"]), colorspace=np.array("bgr"), bins=np.array(2), lut=lut)
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
+    device, masks = pcv.color_lut_classifier(img=img, lut_file=os.path.join(cache_dir, "color_lut.npz"), device=0,
+                                             debug=None)
+    bright = np.all(img >= 128, axis=2)
+    assert sorted(masks.keys()) == ["bright", "dark"] and np.array_equal(masks["bright"] == 255, bright) and \
+        np.array_equal(masks["dark"] == 255, ~bright)
+
+
 def test_plantcv_crop_position_mask():
     nir, path1, filename1 = pcv.readimage(os.path.join(TEST_DATA, TEST_INPUT_NIR_MASK))
     mask = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_MASK), -1)
@@ -228,6 +399,48 @@ def test_plantcv_fluor_fvfm():
     assert fvfm_data[4] > 0.66
 
 
+def test_plantcv_fluor_fvfm_per_pixel():
+    # 16-bit frames with Fmax below, equal to and above Fmin, Fmax = 0 and Fmin = 0 (Fv/Fm = 1)
+    rng = np.random.RandomState(0)
+    fmin = rng.randint(0, 30000, (40, 50)).astype(np.uint16)
+    fmax = (fmin * rng.uniform(0.5, 3, (40, 50))).clip(0, 65535).astype(np.uint16)
+    fmax[0, :10] = fmin[0, :10]
+    fmax[1, :10] = 0
+    fmin[2, :10] = 0
+    fdark = np.zeros((40, 50), dtype=np.uint16)
+    mask = np.zeros((40, 50), dtype=np.uint8)
+    mask[:30, :] = 255
+    device, fvfm_header, fvfm_data = pcv.fluor_fvfm(fdark, fmin, fmax, mask, device=0, filename=False, bins=100,
+                                                    debug=None)
+    # Fv/Fm of each plant pixel with Fmax > Fmin
+    fvfm = []
+    for i in range(0, 30):
+        for j in range(0, 50):
+            if fmax[i][j] > fmin[i][j]:
+                fvfm.append(float(fmax[i][j] - fmin[i][j]) / float(fmax[i][j]))
+    fvfm_hist, fvfm_bins = np.histogram(fvfm, 100, range=(0, 1))
+    assert fvfm_data[3] == list(fvfm_hist) and fvfm_data[5] == np.median(fvfm)
+
+
+def test_plantcv_fluor_fvfm_series():
+    # Test cache directory
+    cache_dir = os.path.join(TEST_TMPDIR, "test_plantcv_fluor_fvfm_series")
+    if not os.path.exists(cache_dir):
+        os.mkdir(cache_dir)
+    # Fdark and two pairs of Fmin and Fmax frames (16-bit)
+    filenames = []
+    for i, frame in enumerate([TEST_INPUT_FDARK, TEST_INPUT_FMIN, TEST_INPUT_FMAX, TEST_INPUT_FMAX, TEST_INPUT_FMIN]):
+        img = cv2.imread(os.path.join(TEST_DATA, frame), -1).astype(np.uint16)
+        filenames.append(os.path.join(cache_dir, "frame" + str(i) + ".png"))
+        cv2.imwrite(filenames[-1], img)
+    stack = pcv.image_stack(filenames, os.path.join(cache_dir, "stack.npy"))
+    fdark, fmin, fmax = stack[0], stack[1], stack[2]
+    fmask = np.where(fmax > 20, 255, 0).astype(np.uint8)
+    device, fvfm_header, fvfm_data = pcv.fluor_fvfm_series(stack, fmask, device=0, bins=1000, debug=None)
+    _, _, pair_data = pcv.fluor_fvfm(fdark, fmin, fmax, fmask, device=0, filename=False, bins=1000, debug=None)
+    assert np.shape(stack) == (5,) + np.shape(fmask) and len(fvfm_data) == 2 and fvfm_data[0] == pair_data
+
+
 def test_plantcv_gaussian_blur():
     img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
     device, gaussian_img = pcv.gaussian_blur(device=0, img=img, ksize=(51, 51), sigmax=0, sigmay=None, debug=None)
@@ -285,6 +498,14 @@ def test_plantcv_laplace_filter():
     assert all([i == j] for i, j in zip(np.shape(lp_img), TEST_GRAY_DIM))
 
 
+def test_plantcv_lazy_import():
+    # Function modules are only imported when a function is first used, also when a module imports another directly
+    script = ("import sys; import plantcv; assert 'plantcv.watershed' not in sys.modules; "
+              "from plantcv import read_results, watershed_segmentation; assert 'plantcv.watershed' in sys.modules; "
+              "assert callable(plantcv.print_results) and callable(plantcv.apply_mask)")
+    assert subprocess.call([sys.executable, "-c", script], cwd=os.path.join(TEST_DATA, "..", "..")) == 0
+
+
 def test_plantcv_logical_and():
     img1 = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_BINARY), -1)
     img2 = np.copy(img1)
@@ -336,6 +557,58 @@ def test_plantcv_naive_bayes_classifier():
         assert 0
 
 
+def test_plantcv_naive_bayes_classifier_compiled():
+    # Cache test directory
+    cache_dir = os.path.join(TEST_TMPDIR, "test_plantcv_naive_bayes_classifier_compiled")
+    if not os.path.exists(cache_dir):
+        os.mkdir(cache_dir)
+    # Compile the text PDFs into a NumPy archive in the format written by plantcv-train.py
+    pdfs = {}
+    with open(os.path.join(TEST_DATA, TEST_PDFS), "r") as pf:
+        pf.readline()
+        for row in pf:
+            cols = row.rstrip("\n").split("\t")
+            pdfs[(cols[0], cols[1])] = [float(i) for i in cols[2:]]
+    classes = ["plant", "background"]
+    channels = ["hue", "saturation", "value"]
+    tables = np.array([[pdfs[(cls, channel)] for channel in channels] for cls in classes])
+    with np.errstate(divide='ignore'):
+        np.savez(os.path.join(cache_dir, "naive_bayes_pdfs.npz"), classes=np.array(classes), channels=np.array(channels),
+                 pdfs=tables, log_pdfs=np.log(tables))
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))[1400:1480, 1150:1230]
+    device, text_mask = pcv.naive_bayes_classifier(img=img, pdf_file=os.path.join(TEST_DATA, TEST_PDFS),
+                                                   device=0, debug=None)
+    device, compiled_mask = pcv.naive_bayes_classifier(img=img,
+                                                       pdf_file=os.path.join(cache_dir, "naive_bayes_pdfs.npz"),
+                                                       device=0, debug=None)
+    assert np.array_equal(text_mask, compiled_mask)
+
+
+def test_plantcv_naive_bayes_classifier_per_pixel():
+    # A crop with plant and background pixels
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))[1400:1480, 1150:1230]
+    device, mask = pcv.naive_bayes_classifier(img=img, pdf_file=os.path.join(TEST_DATA, TEST_PDFS),
+                                              device=0, debug=None)
+    # Per-pixel products of the PDFs
+    pdfs = {}
+    with open(os.path.join(TEST_DATA, TEST_PDFS), "r") as pf:
+        pf.readline()
+        for row in pf:
+            cols = row.rstrip("\n").split("\t")
+            pdfs[(cols[0], cols[1])] = [float(i) for i in cols[2:]]
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    expected = np.zeros(np.shape(mask))
+    for i in range(0, np.shape(img)[0]):
+        for j in range(0, np.shape(img)[1]):
+            h, s, v = hsv[i][j]
+            plant = pdfs[("plant", "hue")][h] * pdfs[("plant", "saturation")][s] * pdfs[("plant", "value")][v]
+            bg = pdfs[("background", "hue")][h] * pdfs[("background", "saturation")][s] * \
+                pdfs[("background", "value")][v]
+            if plant > bg:
+                expected[i][j] = 255
+    assert 0 < np.sum(mask == 255) < np.size(mask) and np.array_equal(mask, expected)
+
+
 def test_plantcv_object_composition():
     img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
     contours_npz = np.load(os.path.join(TEST_DATA, TEST_INPUT_CONTOURS))
@@ -366,6 +639,129 @@ def test_plantcv_output_mask():
     shutil.rmtree(path1)
 
 
+def pipeline_parser(directory, meta, match, index=None, coprocess=None, adaptor='filename'):
+    # Load plantcv-pipeline.py and select images from a directory with one of its adaptors
+    pipeline = imp.load_source("plantcv_pipeline", os.path.join(TEST_DATA, "..", "..", "plantcv-pipeline.py"))
+    valid_meta = dict([(field, 'none') for field in ['camera', 'imgtype', 'zoom', 'frame', 'timestamp', 'id',
+                                                     'treatment']])
+    fields = meta.split('_')
+    args = argparse.Namespace(dir=directory, adaptor=adaptor, type='png', delimiter='_', meta=meta,
+                              fields=dict([(field, i) for i, field in enumerate(fields)]), meta_count=len(fields),
+                              valid_meta=valid_meta, imgtype=dict([pair.split(':') for pair in match.split(',')]),
+                              dates=None, coprocess=coprocess, index=index, error_log=open(os.devnull, 'w'))
+    if adaptor == 'phenofront':
+        return pipeline.phenofront_parser(args)[1]
+    return pipeline.filename_parser(args)[1]
+
+
+def test_plantcv_pipeline_coprocess_frame():
+    # Make a test cache directory
+    cache_dir = os.path.join(TEST_TMPDIR, "test_plantcv_pipeline_coprocess_frame")
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.mkdir(cache_dir)
+    os.mkdir(os.path.join(cache_dir, "snapshot1"))
+    for name in ["VIS_0_z1.png", "NIR_1_z1.png"]:
+        open(os.path.join(cache_dir, "snapshot1", name), "w").close()
+    with open(os.path.join(cache_dir, "SnapshotInfo.csv"), "w") as fp:
+        fp.write("id,tiles\n1,VIS_0_z1;NIR_1_z1\n")
+    # Without camera in the file names, the image to coprocess is not matched by frame
+    meta = pipeline_parser(cache_dir, "imgtype_frame_zoom", "imgtype:VIS", coprocess="NIR", adaptor="phenofront")
+    index_meta = pipeline_parser(cache_dir, "imgtype_frame_zoom", "imgtype:VIS", coprocess="NIR",
+                                 adaptor="phenofront", index=os.path.join(cache_dir, "index.sqlite3"))
+    assert meta["VIS_0_z1.png"]["coimg"] == "NIR_1_z1.png" and index_meta["VIS_0_z1.png"]["coimg"] == "NIR_1_z1.png"
+
+
+def test_plantcv_pipeline_index_match():
+    # Make a test cache directory
+    cache_dir = os.path.join(TEST_TMPDIR, "test_plantcv_pipeline_index_match")
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.mkdir(cache_dir)
+    os.mkdir(os.path.join(cache_dir, "imgs"))
+    for name in ["VIS_SV_0_z300_1.png", "VIS_TV_0_z300_1.png", "NIR_SV_0_z300_1.png", "VIS_SV_0_z500_2.png"]:
+        open(os.path.join(cache_dir, "imgs", name), "w").close()
+    # Restrictions on metadata that is not in the file names (treatment) do not apply
+    match = "imgtype:VIS,camera:SV,treatment:A"
+    meta = pipeline_parser(os.path.join(cache_dir, "imgs"), "imgtype_camera_frame_zoom_id", match)
+    index_meta = pipeline_parser(os.path.join(cache_dir, "imgs"), "imgtype_camera_frame_zoom_id", match,
+                                 index=os.path.join(cache_dir, "index.sqlite3"))
+    assert sorted(meta.keys()) == ["VIS_SV_0_z300_1.png", "VIS_SV_0_z500_2.png"] and index_meta == meta
+
+
+def test_plantcv_pipeline_queue():
+    # Make a test cache directory
+    cache_dir = os.path.join(TEST_TMPDIR, "test_plantcv_pipeline_queue")
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.mkdir(cache_dir)
+    pipeline = imp.load_source("plantcv_pipeline", os.path.join(TEST_DATA, "..", "..", "plantcv-pipeline.py"))
+    # A pipeline that logs each run and writes its results file in two steps. The first run of the slow image stops
+    # between them until its worker is killed
+    script = os.path.join(cache_dir, "pipeline.py")
+    with open(script, "w") as fp:
+        fp.write("import sys\nimport os\nimport time\n"
+                 "image, result = sys.argv[2], sys.argv[4]\n"
+                 "open(os.path.join(os.path.dirname(image), 'runs.log'), 'a').write(os.path.basename(image) + '\\n')\n"
+                 "open(result, 'a').write('HEADER_SHAPES\\tarea\\n')\n"
+                 "if 'slow' in image and not os.path.exists(image + '.started'):\n"
+                 "    open(image + '.started', 'w').close()\n"
+                 "    time.sleep(120)\n"
+                 "open(result, 'a').write('SHAPES_DATA\\t' + os.path.basename(image) + '\\n')\n")
+    images = ["VIS_SV_0_z300_{0}.png".format(i) for i in range(5)] + ["VIS_SV_0_z300_slow.png"]
+    jobs = []
+    for img in images:
+        result = os.path.join(cache_dir, img + ".txt")
+        jobs.append({"image": img, "args": [script, "--image", os.path.join(cache_dir, img), "--result", result],
+                     "results": [(result, {"image": os.path.join(cache_dir, img)})]})
+    args = argparse.Namespace(queue=os.path.join(cache_dir, "queue.sqlite3"), pipeline=script, runner="subprocess",
+                              lease=1, attempts=3, timeout=0, rss=0)
+    # Three local workers (-W), each in a process group of its own so that it can be killed with its pipeline
+    workers = [subprocess.Popen([sys.executable, os.path.join(TEST_DATA, "..", "..", "plantcv-pipeline.py"), "-W",
+                                 args.queue], preexec_fn=os.setsid) for i in range(3)]
+    results_queue = pipeline.queue.Queue()
+    coordinator_stats = []
+    coordinator = threading.Thread(target=lambda: coordinator_stats.extend(pipeline.exe_queue(jobs, args,
+                                                                                              results_queue)))
+    coordinator.start()
+    try:
+        # Kill the worker of the slow image while its job is running
+        killed = None
+        while killed is None and coordinator.is_alive():
+            if os.path.exists(os.path.join(cache_dir, images[-1] + ".started")):
+                connect = pipeline.queue_connect(args.queue)
+                row = connect.execute("SELECT worker FROM jobs WHERE job_id = ?", (len(jobs) - 1,)).fetchone()
+                connect.close()
+                killed = int(row["worker"].split(":")[-1])
+                os.killpg(killed, signal.SIGKILL)
+            time.sleep(0.1)
+        coordinator.join(60)
+        assert killed is not None and not coordinator.is_alive()
+        for worker in workers:
+            if worker.pid != killed:
+                assert worker.wait() == 0
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                os.killpg(worker.pid, signal.SIGKILL)
+                worker.wait()
+    # Every job is done once, the slow image after its job was reclaimed from the killed worker
+    assert sorted([stat["image"] for stat in coordinator_stats]) == sorted([job["results"][0][1]["image"]
+                                                                           for job in jobs])
+    assert [stat["attempts"] for stat in coordinator_stats if "slow" in stat["image"]] == [2]
+    assert all([stat["status"] == 0 for stat in coordinator_stats])
+    with open(os.path.join(cache_dir, "runs.log")) as fp:
+        assert sorted(fp.read().split()) == sorted(images + [images[-1]])
+    results = []
+    while not results_queue.empty():
+        results.extend(results_queue.get())
+    assert sorted([result["features"]["area"] for result in results]) == sorted(images)
+    # The results files hold the rows of one attempt only
+    for img in images:
+        with open(os.path.join(cache_dir, img + ".txt")) as fp:
+            assert fp.read() == "HEADER_SHAPES\tarea\nSHAPES_DATA\t" + img + "\n"
+
+
 def test_plantcv_plot_hist():
     img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR), -1)
     bins, hist = pcv.plot_hist(img, False)
@@ -386,6 +782,51 @@ def test_plantcv_print_results():
     pcv.print_results(filename='not_used', header=header, data=data)
 
 
+def test_plantcv_print_results_binary():
+    header = ['HEADER_HISTOGRAM', 'bin-number', 'blue']
+    data = ['HISTOGRAM_DATA', 256, [1.0, 2.5, 0.0]]
+    filename = os.path.join(TEST_TMPDIR, 'plantcv_print_results.pcv')
+    if os.path.exists(filename):
+        os.remove(filename)
+    pcv.print_results(filename=filename, header=header, data=data)
+    rows = pcv.read_results(filename=filename)
+    # Assert that the header is returned unchanged and the histogram is returned as an array
+    assert rows[0] == header and rows[1][1] == 256 and np.array_equal(rows[1][2], np.array([1.0, 2.5, 0.0]))
+
+
+def test_plantcv_read_results_binary_invalid():
+    filename = os.path.join(TEST_TMPDIR, 'plantcv_read_results_invalid.pcv')
+    if os.path.exists(filename):
+        os.remove(filename)
+    pcv.print_results(filename=filename, header=['HEADER_SHAPES', 'area'], data=['SHAPES_DATA', 100])
+    with open(filename, 'rb') as results:
+        content = results.read()
+    # A record that ends early (e.g. of a pipeline that was killed while it wrote it) ends the file
+    with open(filename, 'wb') as results:
+        results.write(content[:-3])
+    assert pcv.read_results(filename=filename) == [['HEADER_SHAPES', 'area']]
+    # Arrays of other types than numbers (e.g. Python objects) are not read
+    description = b'{"values": ["HISTOGRAM_DATA", null], "arrays": [[1, "|O", 1]]}'
+    with open(filename, 'wb') as results:
+        results.write(content[:12] + struct.pack('<I', len(description)) + description + b'\x00' * 8)
+    with pytest.raises(RuntimeError):
+        pcv.read_results(filename=filename)
+    # Files of an earlier binary results format are not read
+    with open(filename, 'wb') as results:
+        results.write(b'PCVRESULTS\x00\x01' + content[12:])
+    with pytest.raises(RuntimeError):
+        pcv.read_results(filename=filename)
+
+
+def test_plantcv_read_results_text():
+    filename = os.path.join(TEST_TMPDIR, 'plantcv_read_results.txt')
+    with open(filename, 'w') as results:
+        results.write('HEADER_SHAPES\tarea\n')
+        results.write('SHAPES_DATA\t100\n')
+    rows = pcv.read_results(filename=filename)
+    assert rows == [['HEADER_SHAPES', 'area'], ['SHAPES_DATA', '100']]
+
+
 def test_plantcv_readimage():
     img, path, img_name = pcv.readimage(filename=os.path.join(TEST_DATA, TEST_INPUT_COLOR))
     # Assert that the image name returned equals the name of the input image
@@ -466,6 +907,53 @@ def test_plantcv_roi_objects():
     assert len(kept_contours) == 1046
 
 
+def test_plantcv_roi_objects_cutto():
+    img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
+    roi_npz = np.load(os.path.join(TEST_DATA, TEST_INPUT_ROI))
+    roi_contour = roi_npz['arr_0']
+    roi_hierarchy = roi_npz['arr_1']
+    contours_npz = np.load(os.path.join(TEST_DATA, TEST_INPUT_CONTOURS))
+    object_contours = contours_npz['arr_0']
+    object_hierarchy = contours_npz['arr_1']
+    device, kept_contours, kept_hierarchy, mask, area = pcv.roi_objects(img=img, roi_type="cutto",
+                                                                        roi_contour=roi_contour,
+                                                                        roi_hierarchy=roi_hierarchy,
+                                                                        object_contour=object_contours,
+                                                                        obj_hierarchy=object_hierarchy,
+                                                                        device=0, debug=None)
+    # Objects cut to the ROI in whole images (objects are worked on in a crop of the image)
+    objects = np.zeros(np.shape(img)[:2], dtype=np.uint8)
+    cv2.drawContours(objects, object_contours, -1, 255, -1, lineType=8, hierarchy=object_hierarchy)
+    roi = np.zeros(np.shape(img)[:2], dtype=np.uint8)
+    cv2.fillPoly(roi, [np.vstack(roi_contour[0])], 255)
+    expected = cv2.bitwise_and(objects, roi)
+    expected_contours = cv2.findContours(np.copy(expected), cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2]
+    assert np.array_equal(mask, expected) and area == cv2.countNonZero(expected) and \
+        all([np.array_equal(kept, cnt) for kept, cnt in zip(kept_contours, expected_contours)]) and \
+        len(kept_contours) == len(expected_contours)
+
+
+def test_plantcv_roi_objects_partial_edge():
+    img = np.zeros((20, 20, 3), dtype=np.uint8)
+    roi_contour = [np.array([[[5, 5]], [[14, 5]], [[14, 14]], [[5, 14]]], dtype=np.int32)]
+    roi_hierarchy = np.array([[[-1, -1, -1, -1]]], dtype=np.int32)
+    # Objects with a point on the edge of the ROI, with only their last point inside it, and outside of it
+    object_contours = [np.array([[[2, 2]], [[5, 2]], [[5, 5]], [[2, 5]]], dtype=np.int32),
+                       np.array([[[16, 16]], [[18, 16]], [[18, 18]], [[10, 10]]], dtype=np.int32),
+                       np.array([[[16, 2]], [[18, 2]], [[18, 4]], [[16, 4]]], dtype=np.int32)]
+    object_hierarchy = np.array([[[1, -1, -1, -1], [2, 0, -1, -1], [-1, 1, -1, -1]]], dtype=np.int32)
+    device, kept_contours, kept_hierarchy, mask, area = pcv.roi_objects(img=img, roi_type="partial",
+                                                                        roi_contour=roi_contour,
+                                                                        roi_hierarchy=roi_hierarchy,
+                                                                        object_contour=object_contours,
+                                                                        obj_hierarchy=object_hierarchy,
+                                                                        device=0, debug=None)
+    # Only the object on the edge is kept (the last point of an object is not tested)
+    expected = np.zeros((20, 20), dtype=np.uint8)
+    expected[2:6, 2:6] = 255
+    assert np.array_equal(mask, expected) and area == 16 and len(kept_contours) == 1
+
+
 def test_plantcv_rotate_img():
     img = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_COLOR))
     device, rotated = pcv.rotate_img(img, 45, device=0, debug=None)
@@ -496,6 +984,35 @@ def test_plantcv_sobel_filter():
     assert all([i == j] for i, j in zip(np.shape(sobel_img), TEST_GRAY_DIM))
 
 
+def test_plantcv_train_histogram_pdf():
+    from scipy.stats import gaussian_kde
+    train = imp.load_source("plantcv_train", os.path.join(TEST_DATA, "..", "..", "plantcv-train.py"))
+    # The PDFs calculated from the histograms of the training images are those of a Gaussian KDE of the pixel values
+    for img_file, mask_file in [(TEST_INPUT_COLOR, TEST_INPUT_BINARY), (TEST_INPUT_CROPPED, TEST_INPUT_CROPPED_MASK)]:
+        histograms = train.image_histograms((os.path.join(TEST_DATA, img_file), os.path.join(TEST_DATA, mask_file), 0))
+        for histogram in [row for hists in histograms for row in hists]:
+            values = np.repeat(np.arange(256), histogram)
+            assert np.allclose(train.histogram_pdf(histogram), gaussian_kde(values).evaluate(range(256)),
+                               rtol=1e-6, atol=1e-12)
+
+
+def test_plantcv_train_small_mask(capsys):
+    # Make a test cache directory
+    cache_dir = os.path.join(TEST_TMPDIR, "test_plantcv_train_small_mask")
+    if not os.path.exists(cache_dir):
+        os.mkdir(cache_dir)
+    train = imp.load_source("plantcv_train", os.path.join(TEST_DATA, "..", "..", "plantcv-train.py"))
+    mask = np.zeros((20, 20), dtype=np.uint8)
+    mask[0:3, 0:3] = 255
+    cv2.imwrite(os.path.join(cache_dir, "mask.png"), mask)
+    cv2.imwrite(os.path.join(cache_dir, "img.png"), np.zeros((20, 20, 3), dtype=np.uint8))
+    # An image with fewer than 10 plant pixels is skipped with a warning
+    plant, background = train.image_histograms((os.path.join(cache_dir, "img.png"),
+                                                os.path.join(cache_dir, "mask.png"), 0))
+    assert np.sum(plant) == 0 and np.sum(background) == 0
+    assert "skipping " + os.path.join(cache_dir, "img.png") in capsys.readouterr()[1]
+
+
 def test_plantcv_triangle_threshold():
     img1 = cv2.imread(os.path.join(TEST_DATA, TEST_INPUT_GRAY), -1)
     device, thresholded = pcv.triangle_auto_threshold(0, img1, 255, "light", 10, debug=None)